@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+
+from corpus import DERIVED, ROOT, iter_units, rel_path
+from fuzzy_search import fold
+
+
+OUT_DIR = DERIVED / 'align'
+ANCHOR_N = 5          # n-gram length for the first anchor pass
+MIN_ANCHOR_N = 2      # shortest n-gram tried inside a gap before falling back to DP
+MAX_CELLS = 40000     # gaps up to this many DP cells are aligned exactly
+BAND = 24             # half-width of the banded DP used for larger gaps without anchors
+
+# Apostrophes join a word ("o’er"); hyphens do not, as the corpus tokenizer
+# splits "good-night" into two words.
+EDITION_WORD_RE = re.compile(r"[^\W_]+(?:['’][^\W_]+)*")
+
+
+def word_key(word: str) -> str:
+    # Compare spelling only: case, accents, apostrophes and hyphens are dropped.
+    return re.sub(r'[\W_]+', '', fold(word))
+
+
+def play_words(play: str, root: Path = ROOT) -> tuple[list[str], list[int], list[tuple[str, str, int]]]:
+    # The play's speech lines in unit order as one word stream; word k
+    # belongs to lines[owner[k]].
+    keys: list[str] = []
+    owner: list[int] = []
+    lines: list[tuple[str, str, int]] = []
+    for path, data in iter_units(root / play):
+        rel = rel_path(path, root)
+        for item in data['items']:
+            if item.get('kind') != 'speech' or not item.get('line_serial'):
+                continue
+            line = len(lines)
+            lines.append((item['line_serial'], rel, item.get('line_number')))
+            for span in item.get('spans') or []:
+                for tok in span.get('tokens') or []:
+                    if tok.get('type') != 'word':
+                        continue
+                    key = word_key(tok.get('norm') or tok.get('s') or '')
+                    if key:
+                        keys.append(key)
+                        owner.append(line)
+    return keys, owner, lines
+
+
+def is_label(text: str) -> bool:
+    # Speaker names and headings: all capitals with a word of two or more
+    # letters and no line number. Verse such as "O!", "I." or "O, O, O, O!"
+    # is kept, as is a numbered line that happens to be in capitals.
+    words = EDITION_WORD_RE.findall(text)
+    return (text.isupper() and any(len(word) > 1 for word in words)
+            and not any(word.isdigit() for word in words))
+
+
+def edition_files(edition: Path) -> list[Path]:
+    if edition.is_dir():
+        return sorted(edition.rglob('*.txt'))
+    return [edition]
+
+
+def edition_words(edition: Path) -> tuple[list[str], list[tuple[int, int]], list[str]]:
+    # Every word of the edition, with (file index, 1-based line number).
+    keys: list[str] = []
+    where: list[tuple[int, int]] = []
+    names: list[str] = []
+    for f, path in enumerate(edition_files(edition)):
+        names.append(path.relative_to(edition).as_posix() if edition.is_dir() else path.name)
+        with open(path, encoding='utf-8-sig', errors='replace') as fh:
+            for number, text in enumerate(fh, 1):
+                # Speaker names, headings and the like would otherwise
+                # compete with the spoken text.
+                if is_label(text):
+                    continue
+                for word in EDITION_WORD_RE.findall(text):
+                    key = word_key(word)
+                    if key:
+                        keys.append(key)
+                        where.append((f, number))
+    return keys, where, names
+
+
+def unique_ngrams(keys: list[str], lo: int, hi: int, n: int) -> dict[tuple, int]:
+    seen: dict[tuple, int] = {}
+    for i in range(lo, hi - n + 1):
+        gram = tuple(keys[i:i + n])
+        seen[gram] = -1 if gram in seen else i
+    return {gram: i for gram, i in seen.items() if i >= 0}
+
+
+def chain(pairs: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # Longest run of anchors increasing in both streams (patience LIS on b,
+    # with pairs already sorted by a), so crossing anchors are dropped.
+    tails: list[int] = []
+    tail_at: list[int] = []
+    back = [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_at.append(k)
+        else:
+            tails[pos] = j
+            tail_at[pos] = k
+        back[k] = tail_at[pos - 1] if pos else -1
+    out = []
+    k = tail_at[-1] if tail_at else -1
+    while k >= 0:
+        out.append(pairs[k])
+        k = back[k]
+    return out[::-1]
+
+
+def banded_dp(a: list[str], b: list[str], a0: int, a1: int, b0: int, b1: int, band: int | None) -> list[tuple[int, int]]:
+    # Edit-distance alignment of a[a0:a1] with b[b0:b1]; returns aligned
+    # (i, j) pairs, equal or substituted. With `band` only cells within that
+    # distance of the diagonal are filled.
+    m, n = a1 - a0, b1 - b0
+    if band is None:
+        band = max(m, n)
+    else:
+        band = max(band, -(-n // max(m, 1)) + 1)
+    inf = m + n + 1
+    bounds = []
+    rows = []
+    moves = []
+    for r in range(m + 1):
+        centre = r * n // m if m else 0
+        lo, hi = max(0, centre - band), min(n, centre + band)
+        if r == 0:
+            lo = 0
+        if r == m:
+            hi = n
+        bounds.append(lo)
+        cost = [inf] * (hi - lo + 1)
+        move = bytearray(hi - lo + 1)
+        if r == 0:
+            for c in range(lo, hi + 1):
+                cost[c - lo] = c
+                move[c - lo] = 2
+        else:
+            prev, plo = rows[-1], bounds[-2]
+            phi = plo + len(prev) - 1
+            ai = a[a0 + r - 1]
+            for c in range(lo, hi + 1):
+                best, step = inf, 0
+                if plo <= c - 1 <= phi:
+                    best = prev[c - 1 - plo] + (0 if ai == b[b0 + c - 1] else 1)
+                if plo <= c <= phi and prev[c - plo] + 1 < best:
+                    best, step = prev[c - plo] + 1, 1
+                if c > lo and cost[c - 1 - lo] + 1 < best:
+                    best, step = cost[c - 1 - lo] + 1, 2
+                cost[c - lo] = best
+                move[c - lo] = step
+        rows.append(cost)
+        moves.append(move)
+    pairs = []
+    r, c = m, n
+    while r > 0 and c > 0:
+        step = moves[r][c - bounds[r]]
+        if step == 0:
+            pairs.append((a0 + r - 1, b0 + c - 1))
+            r, c = r - 1, c - 1
+        elif step == 1:
+            r -= 1
+        else:
+            c -= 1
+    return pairs[::-1]
+
+
+class Aligner:
+    # Unique n-grams shared by both streams anchor the alignment; the gaps
+    # between anchors are re-anchored with window-local unique n-grams
+    # (shorter ones when none are found) until they are small enough for
+    # exact DP, and only anchorless large gaps fall back to banded DP.
+
+    def __init__(self, a: list[str], b: list[str]):
+        self.a = a
+        self.b = b
+        self.pairs: list[tuple[int, int]] = []
+        self.anchors = 0
+        self.banded = 0
+
+    def run(self) -> list[tuple[int, int]]:
+        self.align(0, len(self.a), 0, len(self.b), ANCHOR_N)
+        return self.pairs
+
+    def align(self, a0: int, a1: int, b0: int, b1: int, n: int) -> None:
+        if a1 <= a0 or b1 <= b0:
+            return
+        if (a1 - a0) * (b1 - b0) <= MAX_CELLS:
+            self.pairs.extend(banded_dp(self.a, self.b, a0, a1, b0, b1, None))
+            return
+        while n >= MIN_ANCHOR_N:
+            found = self.anchor(a0, a1, b0, b1, n)
+            if found:
+                break
+            n -= 1
+        else:
+            self.banded += 1
+            self.pairs.extend(banded_dp(self.a, self.b, a0, a1, b0, b1, BAND))
+            return
+        ia, ib = a0, b0
+        for i, j in found:
+            self.align(ia, i, ib, j, n)
+            self.pairs.append((i, j))
+            ia, ib = i + 1, j + 1
+        self.align(ia, a1, ib, b1, n)
+
+    def anchor(self, a0: int, a1: int, b0: int, b1: int, n: int) -> list[tuple[int, int]]:
+        left = unique_ngrams(self.a, a0, a1, n)
+        right = unique_ngrams(self.b, b0, b1, n)
+        starts = chain(sorted((i, right[gram]) for gram, i in left.items() if gram in right))
+        self.anchors += len(starts)
+        # Each anchor matches n words; overlapping anchors share some.
+        out = []
+        for i, j in starts:
+            for k in range(n):
+                if not out or (i + k > out[-1][0] and j + k > out[-1][1]):
+                    out.append((i + k, j + k))
+        return out
+
+
+def line_table(keys: list[str], owner: list[int], ext_keys: list[str], where: list[tuple[int, int]],
+               pairs: list[tuple[int, int]], n_lines: int) -> list[tuple]:
+    # Each line maps to the edition line holding most of its aligned words,
+    # widened to the adjacent edition lines that also hold some (a verse
+    # line the edition wraps in two).
+    votes = [Counter() for _ in range(n_lines)]
+    matched = [0] * n_lines
+    words = Counter(owner)
+    for i, j in pairs:
+        line = owner[i]
+        votes[line][where[j]] += 1
+        if keys[i] == ext_keys[j]:
+            matched[line] += 1
+    out = []
+    for line in range(n_lines):
+        if not votes[line]:
+            out.append((None, matched[line], words[line]))
+            continue
+        (file, first), _ = min(votes[line].items(), key=lambda kv: (-kv[1], kv[0]))
+        last = first
+        while (file, first - 1) in votes[line]:
+            first -= 1
+        while (file, last + 1) in votes[line]:
+            last += 1
+        out.append(((file, first, last), matched[line], words[line]))
+    return out
+
+
+def align_play(play: str, edition: Path, root: Path = ROOT) -> tuple[list[tuple], dict]:
+    start = time.perf_counter()
+    keys, owner, lines = play_words(play, root)
+    if not lines:
+        raise SystemExit(f'no speech lines found under {root / play}')
+    ext_keys, where, names = edition_words(edition)
+    if not ext_keys:
+        raise SystemExit(f'no words found in {edition}')
+    aligner = Aligner(keys, ext_keys)
+    pairs = aligner.run()
+    table = line_table(keys, owner, ext_keys, where, pairs, len(lines))
+    rows = []
+    stats = Counter()
+    for (serial, path, number), (target, matched, words) in zip(lines, table):
+        status = 'exact' if matched == words else 'partial' if matched else 'aligned' if target else 'unmatched'
+        stats[status] += 1
+        file, first, last = (names[target[0]], target[1], target[2]) if target else ('', '', '')
+        rows.append((serial, path, '' if number is None else number, file, first, last, matched, words, status))
+    stats.update(
+        lines=len(lines), words=len(keys), edition_words=len(ext_keys), anchors=aligner.anchors,
+        banded_gaps=aligner.banded, matched_words=sum(1 for i, j in pairs if keys[i] == ext_keys[j]),
+    )
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return rows, dict(stats)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Map line_serials of a play to line numbers of another edition.')
+    parser.add_argument('play', help='play directory, e.g. hamlet')
+    parser.add_argument('edition', type=Path, help='plain-text edition, or a directory of .txt files read in path order')
+    parser.add_argument('--root', type=Path, default=ROOT)
+    parser.add_argument('--out', type=Path, help='output TSV (default: derived/align/<play>--<edition>.tsv)')
+    args = parser.parse_args(argv)
+
+    rows, stats = align_play(args.play, args.edition, args.root)
+    out = args.out or OUT_DIR / f'{args.play}--{args.edition.stem}.tsv'
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        f.write('line_serial\tpath\tline\tedition_file\tedition_line\tedition_last\tmatched\twords\tstatus\n')
+        for row in rows:
+            f.write('\t'.join(str(v) for v in row) + '\n')
+    print(
+        f"Aligned {stats['lines']} lines ({stats['words']} words) to {stats['edition_words']} edition words "
+        f"in {stats['seconds']}s: {stats.get('exact', 0)} exact, {stats.get('partial', 0)} partial, "
+        f"{stats.get('aligned', 0)} aligned without a shared word, {stats.get('unmatched', 0)} unmatched; {stats['anchors']} anchors, {stats['banded_gaps']} banded gaps",
+        file=sys.stderr,
+    )
+    print(f'Wrote {out}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
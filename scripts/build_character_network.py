@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+from collections import Counter, defaultdict
+from itertools import combinations
+from pathlib import Path
+
+from build_stage_timeline import COLLECTIVE, build_unit_timeline, intersect, name_patterns, unit_events
+from corpus import DERIVED, ROOT, UnitCache, iter_unit_paths, load_unit, play_id, rel_path, split_speaker
+
+
+OUT_DIR = DERIVED / 'network'
+CACHE_VERSION = 2
+EDGE_KINDS = ('adjacent', 'shared_scenes', 'copresent_lines')
+
+
+def pair_key(a: str, b: str) -> str:
+    return f'{a}|{b}' if a < b else f'{b}|{a}'
+
+
+def unit_partial(data: dict) -> dict:
+    adjacent: Counter[str] = Counter()
+    speeches: Counter[str] = Counter()
+    previous: list[str] = []
+    last_speech_id = object()
+    for item in data['items']:
+        if item.get('kind') != 'speech':
+            continue
+        speech_id = item.get('speech_id')
+        if speech_id == last_speech_id:
+            continue
+        last_speech_id = speech_id
+        names = [n for n in split_speaker(item.get('speaker')) if n not in COLLECTIVE]
+        if not names:
+            continue
+        for name in names:
+            speeches[name] += 1
+        for a in previous:
+            for b in names:
+                if a != b:
+                    adjacent[pair_key(a, b)] += 1
+        previous = names
+
+    events, cast = unit_events(data)
+    speakers = sorted(speeches)
+    return {
+        'play': play_id(data),
+        # Speakers of units with numbered lines, as build_play_timelines
+        # collects them; the union over a play is its cast.
+        'cast': sorted(cast) if any(e[0] == 'line' for e in events) else [],
+        'speeches': dict(speeches),
+        'adjacent': dict(adjacent),
+        'shared_scenes': {pair_key(a, b): 1 for a, b in combinations(speakers, 2)},
+    }
+
+
+def stage_input(data: dict) -> tuple[list[tuple], int]:
+    events, _ = unit_events(data)
+    return events, (data['meta'].get('numbering') or {}).get('line_start') or 1
+
+
+def unit_copresent(events: list[tuple], line_start: int, patterns: list) -> dict[str, int]:
+    # Lines each pair shares on stage. Matched against the whole play's
+    # cast, so characters who enter but stay silent in this unit count.
+    on_stage = build_unit_timeline(events, line_start, patterns)['on_stage']
+    copresent = {}
+    for a, b in combinations(sorted(on_stage), 2):
+        overlap = intersect(on_stage[a], on_stage[b])
+        lines = sum(overlap[i + 1] - overlap[i] + 1 for i in range(0, len(overlap), 2))
+        if lines:
+            copresent[pair_key(a, b)] = lines
+    return copresent
+
+
+def cast_digest(cast: set[str]) -> str:
+    return hashlib.sha1('\n'.join(sorted(cast)).encode('utf-8')).hexdigest()[:16]
+
+
+def collect_partials(root: Path = ROOT, cache_path: Path = OUT_DIR / 'cache.json') -> tuple[list[dict], int]:
+    # Two passes: co-presence depends on the play's cast, which is only
+    # known once every unit of the play has been read. A cached unit's
+    # co-presence is reused while its play's cast is unchanged.
+    cache = UnitCache(cache_path, CACHE_VERSION)
+    entries: list[tuple[str, Path, dict]] = []
+    loaded: dict[str, tuple[list[tuple], int]] = {}
+    rebuilt = 0
+    for path in iter_unit_paths(root):
+        key = rel_path(path, root)
+        partial = cache.get(key, path)
+        if partial is None:
+            data = load_unit(path)
+            partial = unit_partial(data) if data is not None else {}
+            if data is not None:
+                loaded[key] = stage_input(data)
+            else:
+                cache.put(key, path, partial)
+            rebuilt += 1
+        entries.append((key, path, partial))
+
+    casts: dict[str, set[str]] = defaultdict(set)
+    for _, _, partial in entries:
+        if partial:
+            casts[partial['play']].update(partial['cast'])
+    patterns = {pid: name_patterns(cast) for pid, cast in casts.items()}
+    digests = {pid: cast_digest(cast) for pid, cast in casts.items()}
+
+    partials = []
+    for key, path, partial in entries:
+        if not partial:
+            continue
+        pid = partial['play']
+        if key in loaded or partial.get('cast_digest') != digests[pid]:
+            events, line_start = loaded.pop(key, None) or stage_input(load_unit(path))
+            partial['copresent_lines'] = unit_copresent(events, line_start, patterns[pid])
+            partial['cast_digest'] = digests[pid]
+            cache.put(key, path, partial)
+        partials.append(partial)
+    cache.prune({key for key, _, _ in entries})
+    cache.save()
+    return partials, rebuilt
+
+
+def to_coo(nodes: list[str], weights: dict[str, int], key_to_pair) -> dict:
+    index = {name: i for i, name in enumerate(nodes)}
+    row, col, values = [], [], []
+    for key in sorted(weights):
+        a, b = key_to_pair(key)
+        i, j = sorted((index[a], index[b]))
+        row.append(i)
+        col.append(j)
+        values.append(weights[key])
+    return {'shape': [len(nodes), len(nodes)], 'row': row, 'col': col, 'data': values}
+
+
+def aggregate(partials: list[dict]) -> tuple[dict[str, dict], dict]:
+    by_play: dict[str, dict[str, Counter]] = defaultdict(lambda: defaultdict(Counter))
+    for partial in partials:
+        play = by_play[partial['play']]
+        play['speeches'].update(partial['speeches'])
+        for kind in EDGE_KINDS:
+            play[kind].update(partial[kind])
+
+    split = lambda key: key.split('|', 1)
+    graphs = {}
+    corpus_speeches: Counter[str] = Counter()
+    corpus_edges: dict[str, Counter] = {kind: Counter() for kind in EDGE_KINDS}
+    for pid in sorted(by_play):
+        play = by_play[pid]
+        names = set(play['speeches'])
+        for kind in EDGE_KINDS:
+            for key in play[kind]:
+                names.update(split(key))
+        nodes = sorted(names)
+        graphs[pid] = {
+            'play': pid,
+            'nodes': nodes,
+            'speeches': [play['speeches'].get(n, 0) for n in nodes],
+            'edges': {kind: to_coo(nodes, play[kind], split) for kind in EDGE_KINDS},
+        }
+        for name, count in play['speeches'].items():
+            corpus_speeches[f'{pid}:{name}'] += count
+        for kind in EDGE_KINDS:
+            for key, weight in play[kind].items():
+                a, b = split(key)
+                corpus_edges[kind][f'{pid}:{a}|{pid}:{b}'] += weight
+
+    nodes = sorted({f"{pid}:{n}" for pid, g in graphs.items() for n in g['nodes']})
+    corpus = {
+        'nodes': nodes,
+        'speeches': [corpus_speeches.get(n, 0) for n in nodes],
+        'edges': {kind: to_coo(nodes, corpus_edges[kind], split) for kind in EDGE_KINDS},
+    }
+    return graphs, corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Build per-play and corpus-wide character interaction graphs.')
+    parser.add_argument('--out', type=Path, default=OUT_DIR)
+    args = parser.parse_args()
+
+    partials, rebuilt = collect_partials(cache_path=args.out / 'cache.json')
+    graphs, corpus = aggregate(partials)
+    args.out.mkdir(parents=True, exist_ok=True)
+    for pid, graph in graphs.items():
+        with open(args.out / f'{pid}.json', 'w', encoding='utf-8') as f:
+            json.dump(graph, f, ensure_ascii=False, separators=(',', ':'))
+    with open(args.out / 'corpus.json', 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, separators=(',', ':'))
+    print(f'Wrote {len(graphs)} play graphs to {args.out} ({rebuilt} units recomputed)')
+
+
+if __name__ == '__main__':
+    main()
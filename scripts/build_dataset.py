@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from corpus import DERIVED, ROOT, is_index, rel_path
+from lazy_unit import load_lazy
+from render import play_paths, unit_blocks
+
+
+OUT_DIR = DERIVED / 'dataset'
+FORMAT_VERSION = 1
+SPLITS = ('train', 'eval', 'test')
+SKIP_UNIT_TYPES = {'front_matter', 'index'}
+
+# Shard layout: <split>-NNNNN.rec holds the examples back to back, each one a
+# zlib-compressed JSON object; <split>-NNNNN.idx holds len+1 little-endian
+# uint64 offsets into it, so example k is rec[idx[k]:idx[k+1]].
+
+
+def play_examples(job: tuple[str, list[str], str]) -> tuple[str, list[bytes]]:
+    # One example per speech, compressed in the worker.
+    play, paths, root_str = job
+    root = Path(root_str)
+    out = []
+    for path_str in paths:
+        path = Path(path_str)
+        unit = load_lazy(path)
+        if unit is None or is_index(unit) or unit.meta['unit'].get('type') in SKIP_UNIT_TYPES:
+            continue
+        meta = unit.meta
+        info = meta['unit']
+        context = {
+            'play': play,
+            'play_title': (meta.get('play') or {}).get('title'),
+            'unit_id': info.get('unit_id'),
+            'act': info.get('act'),
+            'scene': info.get('scene'),
+            'scene_title': info.get('title') or info.get('label'),
+            'path': rel_path(path, root),
+        }
+        for block in unit_blocks(unit):
+            if block[0] != 'speech' or not block[2]:
+                continue
+            _, speaker, lines = block
+            serials = [serial for _, _, serial in lines]
+            example = {
+                'id': serials[0] or f'{context["unit_id"]}-{len(out)}',
+                **context,
+                'speaker': speaker,
+                'text': '\n'.join(text for _, text, _ in lines),
+                'line_numbers': [number for number, _, _ in lines],
+                'line_serials': serials,
+            }
+            out.append(zlib.compress(json.dumps(example, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6))
+    return play, out
+
+
+def assign_splits(plays: list[str], seed: int, eval_plays: int, test_plays: int,
+                  previous: dict[str, str] | None = None) -> dict[str, str]:
+    # Whole plays are held out, ranked by a seeded hash of their names. A
+    # fresh ranking is not stable on its own: a new play hashing into the
+    # first slots would push a held-out play into train. So plays keep the
+    # split of the previous build with the same seed, and open holdout
+    # slots are only filled from plays that build has not seen.
+    if eval_plays + test_plays >= len(plays):
+        raise SystemExit(f'cannot hold out {eval_plays + test_plays} of {len(plays)} plays')
+    previous = {play: split for play, split in (previous or {}).items() if play in plays}
+    ranked = sorted(plays, key=lambda play: hashlib.sha1(f'{seed}:{play}'.encode('utf-8')).hexdigest())
+    new = [play for play in ranked if play not in previous]
+    split = {play: 'train' for play in plays}
+    for name, wanted in (('test', test_plays), ('eval', eval_plays)):
+        kept = [play for play in ranked if previous.get(play) == name][:wanted]
+        fill = [play for play in new if split[play] == 'train'][:wanted - len(kept)]
+        for play in kept + fill:
+            split[play] = name
+    return split
+
+
+def previous_splits(out: Path, seed: int) -> dict[str, str]:
+    # Split of each play in an earlier build with the same seed, if any.
+    try:
+        with open(out / 'manifest.json', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != FORMAT_VERSION or manifest.get('seed') != seed:
+        return {}
+    return {play: split for split, info in manifest['splits'].items() for play in info['plays']}
+
+
+def ordered_results(pool: ProcessPoolExecutor, fn, jobs: list, window: int) -> Iterator:
+    # Like pool.map, but with at most `window` jobs in flight, so finished
+    # plays wait in memory only until the writer catches up.
+    jobs = iter(jobs)
+    pending = deque(pool.submit(fn, job) for job in islice(jobs, window))
+    while pending:
+        result = pending.popleft().result()
+        job = next(jobs, None)
+        if job is not None:
+            pending.append(pool.submit(fn, job))
+        yield result
+
+
+class ShuffleBuffer:
+    # Streaming shuffle: holds at most `size` records and emits a random one
+    # for each record added once full. Seeded per split, so the output order
+    # is fixed for a given seed, input order and buffer size.
+
+    def __init__(self, size: int, rng: random.Random):
+        self.size = size
+        self.rng = rng
+        self.items: list[bytes] = []
+
+    def add(self, record: bytes) -> bytes | None:
+        if len(self.items) < self.size:
+            self.items.append(record)
+            return None
+        k = self.rng.randrange(self.size)
+        out, self.items[k] = self.items[k], record
+        return out
+
+    def drain(self) -> list[bytes]:
+        self.rng.shuffle(self.items)
+        out, self.items = self.items, []
+        return out
+
+
+class ShardWriter:
+    def __init__(self, out: Path, split: str, shard_size: int):
+        self.out = out
+        self.split = split
+        self.shard_size = shard_size
+        self.shards: list[dict] = []
+        self.file = None
+        self.offsets = array('Q')
+
+    def add(self, record: bytes) -> None:
+        if self.file is None:
+            self.name = f'{self.split}-{len(self.shards):05d}'
+            self.file = open(self.out / f'{self.name}.rec', 'wb')
+            self.offsets = array('Q', [0])
+            self.digest = hashlib.sha1()
+        self.file.write(record)
+        self.digest.update(record)
+        self.offsets.append(self.offsets[-1] + len(record))
+        if len(self.offsets) - 1 == self.shard_size:
+            self.close()
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        offsets = array('Q', self.offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        with open(self.out / f'{self.name}.idx', 'wb') as f:
+            offsets.tofile(f)
+        self.shards.append({
+            'name': self.name,
+            'examples': len(self.offsets) - 1,
+            'bytes': self.offsets[-1],
+            'sha1': self.digest.hexdigest(),
+        })
+
+
+def build(out: Path = OUT_DIR, root: Path = ROOT, seed: int = 0, eval_plays: int = 3, test_plays: int = 3,
+          shard_size: int = 1024, buffer: int = 4096, workers: int | None = None, resplit: bool = False) -> dict:
+    groups = play_paths(root)
+    previous = {} if resplit else previous_splits(out, seed)
+    split_of = assign_splits(sorted(groups), seed, eval_plays, test_plays, previous)
+    out.mkdir(parents=True, exist_ok=True)
+    for stale in [*out.glob('*.rec'), *out.glob('*.idx')]:
+        stale.unlink()
+    writers = {split: ShardWriter(out, split, shard_size) for split in SPLITS}
+    buffers = {split: ShuffleBuffer(buffer, random.Random(f'{seed}:{split}')) for split in SPLITS}
+    counts = {split: 0 for split in SPLITS}
+    jobs = [(play, paths, str(root)) for play, paths in groups.items()]
+    window = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for play, records in ordered_results(pool, play_examples, jobs, window):
+            split = split_of[play]
+            counts[split] += len(records)
+            for record in records:
+                emitted = buffers[split].add(record)
+                if emitted is not None:
+                    writers[split].add(emitted)
+    for split in SPLITS:
+        for record in buffers[split].drain():
+            writers[split].add(record)
+        writers[split].close()
+    manifest = {
+        'version': FORMAT_VERSION,
+        'seed': seed,
+        'shard_size': shard_size,
+        'buffer': buffer,
+        'splits': {
+            split: {
+                'plays': sorted(play for play, s in split_of.items() if s == split),
+                'examples': counts[split],
+                'shards': writers[split].shards,
+            }
+            for split in SPLITS
+        },
+    }
+    with open(out / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    return manifest
+
+
+class DatasetReader:
+    # Random access to one split: example i is found by bisecting the shard
+    # sizes, then read through that shard's offset table.
+
+    def __init__(self, out: Path = OUT_DIR, split: str = 'train'):
+        with open(out / 'manifest.json', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != FORMAT_VERSION:
+            raise ValueError(f'{out} has dataset format {manifest.get("version")}; rebuild it')
+        self.out = out
+        self.split = split
+        self.shards = manifest['splits'][split]['shards']
+        self.starts = []
+        total = 0
+        for shard in self.shards:
+            self.starts.append(total)
+            total += shard['examples']
+        self.total = total
+        self._offsets: dict[int, array] = {}
+        self._files: dict[int, object] = {}
+
+    def __len__(self) -> int:
+        return self.total
+
+    def _shard(self, k: int):
+        if k not in self._files:
+            offsets = array('Q')
+            with open(self.out / f'{self.shards[k]["name"]}.idx', 'rb') as f:
+                offsets.frombytes(f.read())
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            self._offsets[k] = offsets
+            self._files[k] = open(self.out / f'{self.shards[k]["name"]}.rec', 'rb')
+        return self._files[k], self._offsets[k]
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError(index)
+        k = bisect_right(self.starts, index) - 1
+        f, offsets = self._shard(k)
+        local = index - self.starts[k]
+        f.seek(offsets[local])
+        return json.loads(zlib.decompress(f.read(offsets[local + 1] - offsets[local])))
+
+    def __iter__(self) -> Iterator[dict]:
+        for k in range(len(self.shards)):
+            f, offsets = self._shard(k)
+            f.seek(0)
+            data = f.read(offsets[-1])
+            for start, end in zip(offsets, offsets[1:]):
+                yield json.loads(zlib.decompress(data[start:end]))
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Write shuffled, sharded speech examples with play-level holdout splits.')
+    parser.add_argument('--out', type=Path, default=OUT_DIR)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--eval-plays', type=int, default=3)
+    parser.add_argument('--test-plays', type=int, default=3)
+    parser.add_argument('--shard-size', type=int, default=1024, help='examples per shard')
+    parser.add_argument('--buffer', type=int, default=4096, help='shuffle buffer size in examples (bounds memory)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--resplit', action='store_true', help='ignore the splits of the previous build and draw them again')
+    parser.add_argument('--show', nargs=2, metavar=('SPLIT', 'INDEX'), help='print one example of an existing build')
+    args = parser.parse_args()
+
+    if args.show:
+        split, index = args.show
+        reader = DatasetReader(args.out, split)
+        print(json.dumps(reader[int(index)], ensure_ascii=False, indent=2))
+        return
+    manifest = build(args.out, ROOT, args.seed, args.eval_plays, args.test_plays, args.shard_size, args.buffer, args.workers, args.resplit)
+    for split, info in manifest['splits'].items():
+        print(f'{split}: {info["examples"]} examples in {len(info["shards"])} shards from {len(info["plays"])} plays')
+    print(f'Wrote {args.out}')
+
+
+if __name__ == '__main__':
+    main()
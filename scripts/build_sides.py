@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from build_stage_timeline import COLLECTIVE
+from corpus import DERIVED, ROOT, UnitCache, item_text, iter_unit_paths, play_id, rel_path, split_speaker, unit_id
+from lazy_unit import load_lazy
+
+
+OUT_DIR = DERIVED / 'sides'
+CACHE_VERSION = 2
+LINE_SERIAL_RE = re.compile(r'-l(\d+)$')
+
+
+def line_number(item: dict) -> int | None:
+    match = LINE_SERIAL_RE.search(item.get('line_serial') or '')
+    return int(match.group(1)) if match else item.get('line_number')
+
+
+def speech_order(items: list[dict]) -> list[dict]:
+    # Numbered lines sort by number; an unnumbered item keeps its place after
+    # the line it follows in the file instead of jumping ahead of line 1.
+    keyed = []
+    number = 0
+    for item in items:
+        found = line_number(item)
+        if found is not None:
+            number = found
+        keyed.append((number, item))
+    keyed.sort(key=lambda pair: pair[0])
+    return [item for _, item in keyed]
+
+
+def unit_speeches(data: dict) -> dict:
+    grouped: dict[str, list[dict]] = {}
+    for item in data['items']:
+        if item.get('kind') != 'speech' or not item.get('speaker'):
+            continue
+        key = item.get('speech_id') or f'seq-{item.get("seq")}'
+        grouped.setdefault(key, []).append(item)
+    speeches = []
+    for speech_id, items in grouped.items():
+        items = speech_order(items)
+        speeches.append({
+            'id': speech_id,
+            'speaker': items[0]['speaker'].replace('_', ' '),
+            'names': split_speaker(items[0]['speaker']),
+            'lines': [[item.get('line_number'), item_text(item).rstrip()] for item in items],
+        })
+    unit = data['meta']['unit']
+    return {
+        'play': play_id(data),
+        'play_title': (data['meta'].get('play') or {}).get('title'),
+        'unit_id': unit_id(data),
+        'act': unit.get('act'),
+        'scene': unit.get('scene'),
+        'title': unit.get('title') or unit.get('label'),
+        'speeches': speeches,
+    }
+
+
+def load_speeches(path_str: str) -> dict:
+    # Sides only need item text, so token arrays are never decoded.
+    data = load_lazy(Path(path_str))
+    return unit_speeches(data) if data is not None else {}
+
+
+def build_speech_index(root: Path = ROOT, out: Path = OUT_DIR, workers: int | None = None) -> tuple[dict[str, list[dict]], int]:
+    cache = UnitCache(out / 'cache.json', CACHE_VERSION)
+    keys = []
+    missing = []
+    for path in iter_unit_paths(root):
+        key = rel_path(path, root)
+        keys.append(key)
+        if cache.get(key, path) is None:
+            missing.append(path)
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, value in zip(missing, pool.map(load_speeches, map(str, missing), chunksize=8)):
+                cache.put(rel_path(path, root), path, value)
+    cache.prune(set(keys))
+    cache.save()
+
+    plays: dict[str, list[dict]] = defaultdict(list)
+    for key in keys:
+        unit = cache.entries[key]['value']
+        if unit and unit['speeches']:
+            plays[unit['play']].append({**unit, 'path': key})
+    return dict(plays), len(missing)
+
+
+def roles(units: list[dict]) -> list[str]:
+    names = {name for unit in units for speech in unit['speeches'] for name in speech['names']}
+    return sorted(names - COLLECTIVE)
+
+
+def side(units: list[dict], role: str) -> list[dict]:
+    role = role.upper()
+    scenes = []
+    for unit in units:
+        entries = []
+        previous = None
+        for speech in unit['speeches']:
+            if role in speech['names']:
+                cue = None
+                if previous is not None and role not in previous['names'] and previous['lines']:
+                    cue = {'speaker': previous['speaker'], 'line': previous['lines'][-1][1].strip()}
+                entries.append({'id': speech['id'], 'speaker': speech['speaker'], 'cue': cue, 'lines': speech['lines']})
+            previous = speech
+        if entries:
+            scenes.append({
+                'unit_id': unit['unit_id'], 'path': unit['path'], 'act': unit['act'], 'scene': unit['scene'],
+                'title': unit['title'], 'speeches': entries,
+            })
+    return scenes
+
+
+def format_side(role: str, play_title: str | None, scenes: list[dict]) -> str:
+    out = [f'{role} — {play_title}' if play_title else role]
+    for scene in scenes:
+        out.append('')
+        out.append(scene['title'] or scene['unit_id'])
+        for speech in scene['speeches']:
+            out.append('')
+            if speech['cue']:
+                out.append(f'        {speech["cue"]["speaker"]}: … {speech["cue"]["line"]}')
+            if speech['speaker'].upper() != role:
+                out.append(f'        ({speech["speaker"]})')
+            for number, text in speech['lines']:
+                out.append(f'{number if number is not None else "":>6}  {text.strip()}')
+    return '\n'.join(out) + '\n'
+
+
+def role_filename(role: str) -> str:
+    return re.sub(r'[^\w]+', '_', role).strip('_') or 'UNNAMED'
+
+
+def export_play(job: tuple[str, list[dict], str, str]) -> tuple[str, int]:
+    pid, units, out_str, fmt = job
+    out = Path(out_str) / pid
+    shutil.rmtree(out, ignore_errors=True)
+    out.mkdir(parents=True, exist_ok=True)
+    play_title = units[0].get('play_title')
+    names = roles(units)
+    for role in names:
+        scenes = side(units, role)
+        if fmt == 'json':
+            with open(out / f'{role_filename(role)}.json', 'w', encoding='utf-8') as f:
+                json.dump({'play': pid, 'role': role, 'scenes': scenes}, f, ensure_ascii=False, indent=2)
+                f.write('\n')
+        else:
+            with open(out / f'{role_filename(role)}.txt', 'w', encoding='utf-8') as f:
+                f.write(format_side(role, play_title, scenes))
+    return pid, len(names)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate actors' sides: each speech of a role with its cue line.")
+    parser.add_argument('--play', action='append', help='limit to these play ids (repeatable)')
+    parser.add_argument('--role', help='print the side for this role (requires a single --play)')
+    parser.add_argument('--list-roles', action='store_true', help='list the roles of each selected play')
+    parser.add_argument('--format', choices=('txt', 'json'), default='txt')
+    parser.add_argument('--out', type=Path, default=OUT_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    plays, rebuilt = build_speech_index(out=args.out, workers=args.workers)
+    selected = {pid: units for pid, units in plays.items() if not args.play or pid in args.play}
+    if args.play and not selected:
+        raise SystemExit(f'No speeches found for {", ".join(args.play)}')
+
+    if args.role:
+        if len(selected) != 1:
+            raise SystemExit('--role needs exactly one --play')
+        [(pid, units)] = selected.items()
+        scenes = side(units, args.role)
+        if not scenes:
+            raise SystemExit(f'{args.role} has no speeches in {pid}')
+        if args.format == 'json':
+            print(json.dumps({'play': pid, 'role': args.role.upper(), 'scenes': scenes}, ensure_ascii=False, indent=2))
+        else:
+            print(format_side(args.role.upper(), units[0].get('play_title'), scenes), end='')
+        return
+
+    if args.list_roles:
+        for pid, units in sorted(selected.items()):
+            print(f'{pid}\t{", ".join(roles(units))}')
+        return
+
+    jobs = [(pid, units, str(args.out), args.format) for pid, units in sorted(selected.items())]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(export_play, jobs))
+    print(f'Wrote {sum(n for _, n in results)} sides for {len(results)} plays to {args.out} ({rebuilt} units reindexed)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+
+from corpus import DERIVED, ROOT, iter_play_unit_paths, load_unit, play_id, rel_path, span_text, split_speaker, unit_id
+
+
+OUT_DIR = DERIVED / 'timeline'
+
+# Collective speaker names never take part in entrances or exits.
+COLLECTIVE = {'ALL', 'BOTH', 'OMNES'}
+
+STAGE_VERB = re.compile(r'^\W*(re-?enter|enter|exeunt|exit|manet|manent)\b\W*(.*)$', re.IGNORECASE | re.DOTALL)
+ALL_BUT = re.compile(r'^(all\s+)?(but|except|save)\b', re.IGNORECASE)
+
+
+def stage_clauses(text: str) -> list[tuple[str, str]]:
+    clauses = []
+    for clause in re.split(r'(?<=[.;])\s+|\s*[\[\]]\s*', text):
+        m = STAGE_VERB.match(clause.strip())
+        if not m:
+            continue
+        verb = m.group(1).lower()
+        if verb in {'enter', 're-enter', 'reenter'}:
+            verb = 'enter'
+        clauses.append((verb, m.group(2)))
+    return clauses
+
+
+def name_patterns(cast: set[str]) -> list[tuple[str, re.Pattern]]:
+    names = sorted((n for n in cast if n not in COLLECTIVE), key=len, reverse=True)
+    return [(n, re.compile(rf'\b{re.escape(n)}\b', re.IGNORECASE)) for n in names]
+
+
+def names_in(text: str, patterns: list[tuple[str, re.Pattern]]) -> list[str]:
+    found = []
+    for name, pattern in patterns:
+        if pattern.search(text):
+            found.append(name)
+            # Mask the match so "Clown" is not found again inside "First Clown".
+            text = pattern.sub(' ', text)
+    return found
+
+
+def unit_events(data: dict) -> tuple[list[tuple], set[str]]:
+    events: list[tuple] = []
+    cast: set[str] = set()
+    for item in data['items']:
+        kind = item.get('kind')
+        if kind == 'speech' and item.get('line_number') is not None:
+            names = split_speaker(item.get('speaker'))
+            cast.update(names)
+            events.append(('line', item['line_number'], names))
+            for span in item.get('spans') or []:
+                if span.get('type') == 'stage':
+                    events.append(('stage', span_text(span), True))
+        elif kind == 'stage':
+            events.append(('stage', ' '.join(span_text(s) for s in item.get('spans') or []), False))
+        elif kind == 'heading':
+            events.append(('heading',))
+    return events, cast
+
+
+def add_interval(flat: list[int], start: int, end: int) -> None:
+    if end < start:
+        return
+    if flat and start <= flat[-1] + 1:
+        flat[-1] = max(flat[-1], end)
+    else:
+        flat.extend((start, end))
+
+
+def build_unit_timeline(events: list[tuple], line_start: int, patterns: list[tuple[str, re.Pattern]]) -> dict:
+    on_stage: dict[str, list[int]] = defaultdict(list)
+    speaking: dict[str, list[int]] = defaultdict(list)
+    entered: dict[str, int] = {}
+    cursor = line_start - 1
+    first_line = None
+    last_speakers: list[str] = []
+
+    def leave(name: str, end: int) -> None:
+        start = entered.pop(name, None)
+        if start is not None:
+            add_interval(on_stage[name], start, end)
+
+    for event in events:
+        if event[0] == 'line':
+            _, line, names = event
+            cursor = line
+            if first_line is None:
+                first_line = line
+            for name in names:
+                if name in COLLECTIVE:
+                    continue
+                entered.setdefault(name, line)
+                add_interval(speaking[name], line, line)
+            if names:
+                last_speakers = [n for n in names if n not in COLLECTIVE]
+        elif event[0] == 'stage':
+            _, text, embedded = event
+            for verb, rest in stage_clauses(text):
+                named = names_in(rest, patterns)
+                if verb == 'enter':
+                    for name in named:
+                        entered.setdefault(name, cursor if embedded else cursor + 1)
+                elif verb in {'manet', 'manent'}:
+                    for name in named:
+                        entered.setdefault(name, cursor)
+                elif ALL_BUT.match(rest):
+                    for name in list(entered):
+                        if name not in named:
+                            leave(name, cursor)
+                elif named:
+                    for name in named:
+                        leave(name, cursor)
+                elif verb == 'exeunt':
+                    for name in list(entered):
+                        leave(name, cursor)
+                else:
+                    for name in last_speakers:
+                        leave(name, cursor)
+    for name in list(entered):
+        leave(name, cursor)
+    return {
+        'lines': [first_line if first_line is not None else line_start, cursor],
+        'on_stage': {k: v for k, v in sorted(on_stage.items()) if v},
+        'speaking': dict(sorted(speaking.items())),
+    }
+
+
+def build_play_timelines(root: Path = ROOT, plays: set[str] | None = None) -> dict[str, dict]:
+    collected: dict[str, list[tuple[dict, list[tuple]]]] = defaultdict(list)
+    casts: dict[str, set[str]] = defaultdict(set)
+    # Units of other plays are never loaded.
+    for path in iter_play_unit_paths(root, plays):
+        data = load_unit(path)
+        if data is None:
+            continue
+        pid = play_id(data)
+        events, cast = unit_events(data)
+        if not any(e[0] == 'line' for e in events):
+            continue
+        info = {
+            'unit_id': unit_id(data),
+            'path': rel_path(path, root),
+            'line_start': (data['meta'].get('numbering') or {}).get('line_start') or 1,
+        }
+        collected[pid].append((info, events))
+        casts[pid].update(cast)
+
+    result = {}
+    for pid, units in collected.items():
+        patterns = name_patterns(casts[pid])
+        out = {}
+        for info, events in units:
+            timeline = build_unit_timeline(events, info['line_start'], patterns)
+            out[info['unit_id']] = {'path': info['path'], **timeline}
+        result[pid] = {'play': pid, 'units': out}
+    return result
+
+
+def intersect(a: list[int], b: list[int]) -> list[int]:
+    out: list[int] = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i], b[j])
+        end = min(a[i + 1], b[j + 1])
+        if start <= end:
+            out.extend((start, end))
+        if a[i + 1] < b[j + 1]:
+            i += 2
+        else:
+            j += 2
+    return out
+
+
+def subtract(a: list[int], b: list[int]) -> list[int]:
+    out: list[int] = []
+    j = 0
+    for i in range(0, len(a), 2):
+        start, end = a[i], a[i + 1]
+        while j < len(b) and b[j + 1] < start:
+            j += 2
+        k = j
+        while k < len(b) and b[k] <= end:
+            if b[k] > start:
+                out.extend((start, b[k] - 1))
+            start = max(start, b[k + 1] + 1)
+            k += 2
+        if start <= end:
+            out.extend((start, end))
+    return out
+
+
+def load_timeline(pid: str, out_dir: Path = OUT_DIR) -> dict:
+    with open(out_dir / f'{pid}.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def silent_on_stage(timeline: dict, name: str) -> dict[str, list[int]]:
+    name = name.upper()
+    result = {}
+    for uid, unit in timeline['units'].items():
+        spans = subtract(unit['on_stage'].get(name, []), unit['speaking'].get(name, []))
+        if spans:
+            result[uid] = spans
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Build per-unit on-stage timelines from entrances, exits and speakers.')
+    parser.add_argument('--play', action='append', help='limit to these play ids (repeatable)')
+    parser.add_argument('--out', type=Path, default=OUT_DIR)
+    parser.add_argument('--silent', metavar='NAME', help='print line ranges where NAME is on stage but silent')
+    args = parser.parse_args()
+
+    if args.silent:
+        if not args.play:
+            raise SystemExit('--silent needs --play')
+        for pid in args.play:
+            for uid, spans in silent_on_stage(load_timeline(pid, args.out), args.silent).items():
+                ranges = ', '.join(f'{s}-{e}' if s != e else str(s) for s, e in zip(spans[::2], spans[1::2]))
+                print(f'{uid}\t{ranges}')
+        return
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    timelines = build_play_timelines(plays=set(args.play) if args.play else None)
+    for pid, timeline in timelines.items():
+        with open(args.out / f'{pid}.json', 'w', encoding='utf-8') as f:
+            json.dump(timeline, f, ensure_ascii=False, separators=(',', ':'))
+    print(f'Wrote {len(timelines)} timelines to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
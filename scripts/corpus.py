@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Iterator
+
+
+ROOT = Path(__file__).resolve().parent.parent
+DERIVED = ROOT / 'derived'
+
+SKIP_DIRS = {'.git', '.github', 'node_modules', 'dist', 'derived', 'scripts', 'search', 'tools'}
+SKIP_FILES = {'index.json', 'package.json'}
+
+
+def load(path: Path) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(path: Path, data: dict) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def load_unit(path: Path) -> dict | None:
+    # Mirrors tools/build-index.mjs: unreadable or non-unit JSON is skipped.
+    try:
+        data = load(path)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        return None
+    if not (data.get('meta') or {}).get('unit'):
+        return None
+    return data
+
+
+def iter_unit_paths(root: Path = ROOT) -> Iterator[Path]:
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith('.')]
+        top = Path(dirpath) == root
+        for name in filenames:
+            if name.endswith('.json') and not (top and name in SKIP_FILES):
+                found.append(Path(dirpath) / name)
+    yield from sorted(found)
+
+
+def iter_units(root: Path = ROOT) -> Iterator[tuple[Path, dict]]:
+    for path in iter_unit_paths(root):
+        data = load_unit(path)
+        if data is not None:
+            yield path, data
+
+
+def iter_play_unit_paths(root: Path = ROOT, plays: set[str] | None = None) -> Iterator[Path]:
+    # A play's units share its top-level directory, so the first unit that
+    # loads names the play for the whole directory and other plays are never
+    # read. Directory names are not always play ids ("merry-wives" lives in
+    # the-merry-wives-of-windsor/).
+    groups: dict[str, list[Path]] = {}
+    for path in iter_unit_paths(root):
+        groups.setdefault(Path(rel_path(path, root)).parts[0], []).append(path)
+    for group in groups.values():
+        if plays and next((play_id(d) for d in map(load_unit, group) if d is not None), None) not in plays:
+            continue
+        yield from group
+
+
+def is_index(data: dict) -> bool:
+    # Contents pages: unit type "index", or a front-matter unit keyed "...-index".
+    unit = data['meta']['unit']
+    return 'index' in (unit.get('type'), (unit.get('unit_key') or '').split('-')[-1])
+
+
+def play_id(data: dict) -> str:
+    play = data['meta'].get('play') or {}
+    if play.get('id'):
+        return play['id']
+    return re.sub(r'[^\w-]', '', re.sub(r'\s+', '-', (play.get('title') or '').lower()))
+
+
+def unit_id(data: dict) -> str:
+    return data['meta']['unit'].get('unit_id') or ''
+
+
+def rel_path(path: Path, root: Path = ROOT) -> str:
+    # Files outside the corpus (validating a scratch copy) keep their own path.
+    try:
+        return path.resolve().relative_to(root.resolve()).as_posix()
+    except ValueError:
+        return str(path)
+
+
+def tokens_to_text(tokens: list[dict]) -> str:
+    return ''.join(tok.get('pre', '') + tok.get('s', '') for tok in tokens)
+
+
+def span_text(span: dict) -> str:
+    if isinstance(span.get('text'), str):
+        return span['text']
+    return tokens_to_text(span.get('tokens') or [])
+
+
+def item_text(item: dict) -> str:
+    return ''.join(span_text(span) for span in item.get('spans') or [])
+
+
+def split_speaker(speaker: str | None) -> list[str]:
+    # "HORATIO and MARCELLUS" speaks for both; "FIRST WARDER (within)" is FIRST WARDER.
+    if not speaker:
+        return []
+    name = re.sub(r'\s*\([^)]*\)', '', speaker.replace('_', ' ')).strip()
+    parts = re.split(r'\s*,\s*|\s+and\s+|\s*&\s*', name)
+    return [part.strip().upper() for part in parts if part.strip()]
+
+
+def file_digest(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+class UnitCache:
+    # Per-file derived values keyed by relative path. A file is only re-hashed
+    # when its size or mtime changed, and only recomputed when its hash changed.
+
+    def __init__(self, path: Path, version: int = 1):
+        self.path = path
+        self.version = version
+        self.entries: dict[str, dict] = {}
+        self.dirty = False
+        self._pending: dict[str, tuple[os.stat_result, str]] = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = None
+        if isinstance(stored, dict) and stored.get('version') == version:
+            self.entries = stored.get('entries') or {}
+
+    def get(self, key: str, path: Path):
+        st = path.stat()
+        entry = self.entries.get(key)
+        if entry and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return entry['value']
+        digest = file_digest(path)
+        if entry and entry['digest'] == digest:
+            entry['mtime_ns'] = st.st_mtime_ns
+            entry['size'] = st.st_size
+            self.dirty = True
+            return entry['value']
+        self._pending[key] = (st, digest)
+        return None
+
+    def put(self, key: str, path: Path, value) -> None:
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            pending = (path.stat(), file_digest(path))
+        st, digest = pending
+        self.entries[key] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'digest': digest, 'value': value}
+        self.dirty = True
+
+    def prune(self, keys: set[str]) -> None:
+        for key in set(self.entries) - keys:
+            del self.entries[key]
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'entries': self.entries}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        self.dirty = False
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import argparse
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from corpus import DERIVED, ROOT, iter_unit_paths, load_unit, play_id, rel_path, span_text, unit_id
+
+
+OUT_DIR = DERIVED / 'parquet'
+ROW_GROUP_ROWS = 64 * 1024
+TABLES = ('lines', 'tokens')
+
+# Layout under OUT_DIR, both partitioned by play:
+#   <table>/play_id=<play>/part-0.parquet        zstd Parquet for other tools
+#   arrow/<table>/play_id=<play>/part-0.arrow    uncompressed Arrow IPC, which
+#                                                read_table() memory-maps
+
+DICT = pa.dictionary(pa.int32(), pa.string())
+
+LINES_SCHEMA = pa.schema([
+    ('line_serial', pa.string()),
+    ('unit_id', DICT),
+    ('path', DICT),
+    ('act', pa.int16()),
+    ('scene', pa.int16()),
+    ('line_number', pa.int32()),
+    ('item_serial', pa.string()),
+    ('kind', DICT),
+    ('subtype', DICT),
+    ('speaker', DICT),
+    ('speech_id', pa.string()),
+    ('speech_seq', pa.int32()),
+    ('text', pa.string()),
+])
+
+TOKENS_SCHEMA = pa.schema([
+    ('line_serial', pa.string()),
+    ('item_serial', pa.string()),
+    ('unit_id', DICT),
+    ('span', pa.int16()),
+    ('pos', pa.int32()),
+    ('serial', pa.string()),
+    ('type', DICT),
+    ('s', pa.string()),
+    ('norm', DICT),
+    ('pre', DICT),
+    ('em', pa.bool_()),
+    ('punct_kind', DICT),
+    ('speaker', DICT),
+])
+
+
+class BufferedWriter:
+    # Collects columns for one table and flushes a row group every ROW_GROUP_ROWS rows.
+
+    def __init__(self, path: Path, schema: pa.Schema):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.schema = schema
+        self.writer = pq.ParquetWriter(path, schema, compression='zstd', use_dictionary=True)
+        self.columns: dict[str, list] = {name: [] for name in schema.names}
+        self.rows = 0
+
+    def append(self, row: tuple) -> None:
+        for name, value in zip(self.schema.names, row):
+            self.columns[name].append(value)
+        self.rows += 1
+        if self.rows >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        table = pa.table(self.columns, schema=self.schema)
+        self.writer.write_table(table, row_group_size=self.rows)
+        self.columns = {name: [] for name in self.schema.names}
+        self.rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+def write_arrow(parquet_path: Path, arrow_path: Path) -> None:
+    # One play's table at a time. Row groups were written with their own
+    # dictionaries; the IPC file format needs one dictionary per column.
+    table = pq.read_table(parquet_path).unify_dictionaries()
+    arrow_path.parent.mkdir(parents=True, exist_ok=True)
+    with pa.ipc.new_file(arrow_path, table.schema) as writer:
+        writer.write_table(table)
+
+
+def export_play(job: tuple[str, list[str], str, str]) -> tuple[str, int, int]:
+    pid, paths, root_str, out_str = job
+    root, out = Path(root_str), Path(out_str)
+    lines = BufferedWriter(out / 'lines' / f'play_id={pid}' / 'part-0.parquet', LINES_SCHEMA)
+    tokens = BufferedWriter(out / 'tokens' / f'play_id={pid}' / 'part-0.parquet', TOKENS_SCHEMA)
+    n_lines = n_tokens = 0
+    try:
+        for path_str in paths:
+            path = Path(path_str)
+            data = load_unit(path)
+            if data is None:
+                continue
+            uid = unit_id(data)
+            unit = data['meta']['unit']
+            act = unit.get('act') if isinstance(unit.get('act'), int) else None
+            scene = unit.get('scene') if isinstance(unit.get('scene'), int) else None
+            rel = rel_path(path, root)
+            for item in data['items']:
+                spans = item.get('spans') or []
+                if item.get('line_serial'):
+                    lines.append((
+                        item['line_serial'], uid, rel, act, scene, item.get('line_number'), item.get('serial'),
+                        item.get('kind'), item.get('subtype'), item.get('speaker'), item.get('speech_id'),
+                        item.get('speech_seq'), ''.join(span_text(span) for span in spans),
+                    ))
+                    n_lines += 1
+                for span_idx, span in enumerate(spans):
+                    for pos, tok in enumerate(span.get('tokens') or []):
+                        tokens.append((
+                            item.get('line_serial'), item.get('serial'), uid, span_idx, pos, tok.get('serial'),
+                            tok.get('type'), tok.get('s'), tok.get('norm'), tok.get('pre'), bool(tok.get('em')),
+                            (tok.get('punct') or {}).get('kind'), item.get('speaker'),
+                        ))
+                        n_tokens += 1
+            # Drop the parsed unit before loading the next one.
+            del data
+    finally:
+        lines.close()
+        tokens.close()
+    for table in TABLES:
+        part = Path(table) / f'play_id={pid}'
+        write_arrow(out / part / 'part-0.parquet', out / 'arrow' / part / 'part-0.arrow')
+    return pid, n_lines, n_tokens
+
+
+def play_jobs(root: Path, out: Path) -> list[tuple[str, list[str], str, str]]:
+    by_play: dict[str, list[str]] = defaultdict(list)
+    for path in iter_unit_paths(root):
+        by_play[Path(rel_path(path, root)).parts[0]].append(str(path))
+    jobs = []
+    for group in sorted(by_play.values()):
+        pid = next((play_id(d) for d in map(load_unit, map(Path, group)) if d is not None), None)
+        if pid:
+            jobs.append((pid, group, str(root), str(out)))
+    return jobs
+
+
+def export(out: Path = OUT_DIR, root: Path = ROOT, workers: int | None = None) -> list[tuple[str, int, int]]:
+    for table in TABLES:
+        shutil.rmtree(out / table, ignore_errors=True)
+        shutil.rmtree(out / 'arrow' / table, ignore_errors=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(export_play, play_jobs(root, out)))
+
+
+def dataset(table: str = 'tokens', out: Path = OUT_DIR, arrow: bool = True) -> ds.Dataset:
+    # The Arrow IPC copy by default; arrow=False opens the Parquet files.
+    if arrow:
+        return ds.dataset(str((out / 'arrow' / table).resolve()), format='arrow',
+                          partitioning=ds.HivePartitioning.discover(infer_dictionary=True),
+                          filesystem=pafs.LocalFileSystem(use_mmap=True))
+    return ds.dataset(str((out / table).resolve()), format='parquet', partitioning='hive')
+
+
+def read_table(table: str = 'tokens', play: str | None = None, columns: list[str] | None = None,
+               out: Path = OUT_DIR) -> pa.Table:
+    # Zero-copy: the file columns are views into the memory-mapped IPC files
+    # (dictionaries included); only the play_id partition column's indices
+    # are allocated. Pruning on play_id skips the other plays' files.
+    flt = ds.field('play_id') == play if play else None
+    return dataset(table, out).to_table(columns=columns, filter=flt)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Export lines and tokens to Parquet partitioned by play.')
+    parser.add_argument('--out', type=Path, default=OUT_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    results = export(args.out, workers=args.workers)
+    lines = sum(r[1] for r in results)
+    tokens = sum(r[2] for r in results)
+    print(f'Wrote {len(results)} plays ({lines} lines, {tokens} tokens) to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from corpus import DERIVED, ROOT, file_digest, iter_unit_paths, load_unit, play_id, rel_path, span_text, unit_id
+from profiling import NullTrace, Trace, add_trace_arguments, finish_trace, trace_from_args
+
+
+DB_PATH = DERIVED / 'corpus.sqlite'
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS plays (
+    play_id TEXT PRIMARY KEY,
+    title TEXT
+);
+CREATE TABLE IF NOT EXISTS units (
+    unit_pk INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    play_id TEXT NOT NULL,
+    unit_id TEXT,
+    type TEXT,
+    act INTEGER,
+    scene INTEGER,
+    label TEXT,
+    title TEXT,
+    line_start INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT,
+    n_items INTEGER,
+    n_lines INTEGER,
+    n_tokens INTEGER
+);
+CREATE TABLE IF NOT EXISTS items (
+    item_pk INTEGER PRIMARY KEY,
+    unit_pk INTEGER NOT NULL REFERENCES units(unit_pk),
+    seq INTEGER,
+    serial TEXT,
+    kind TEXT,
+    subtype TEXT,
+    speaker TEXT,
+    speech_id TEXT,
+    speech_seq INTEGER,
+    line_number INTEGER,
+    line_serial TEXT,
+    text TEXT
+);
+CREATE TABLE IF NOT EXISTS tokens (
+    item_pk INTEGER NOT NULL REFERENCES items(item_pk),
+    span INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    i INTEGER,
+    serial TEXT,
+    type TEXT,
+    s TEXT,
+    norm TEXT,
+    pre TEXT,
+    em INTEGER,
+    punct_kind TEXT,
+    punct_dash TEXT,
+    punct_quote TEXT,
+    punct_role TEXT,
+    PRIMARY KEY (item_pk, span, pos)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stage_spans (
+    item_pk INTEGER NOT NULL REFERENCES items(item_pk),
+    span INTEGER NOT NULL,
+    subtype TEXT,
+    text TEXT,
+    PRIMARY KEY (item_pk, span)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS skipped (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(
+    text, content='items', content_rowid='item_pk', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE INDEX IF NOT EXISTS items_unit ON items(unit_pk);
+CREATE INDEX IF NOT EXISTS items_speaker ON items(speaker);
+CREATE INDEX IF NOT EXISTS items_serial ON items(serial);
+CREATE INDEX IF NOT EXISTS items_line_serial ON items(line_serial);
+CREATE INDEX IF NOT EXISTS tokens_norm ON tokens(norm);
+CREATE INDEX IF NOT EXISTS tokens_serial ON tokens(serial);
+'''
+
+
+def connect(db_path: Path = DB_PATH) -> sqlite3.Connection:
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=OFF')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version not in (0, SCHEMA_VERSION):
+        raise SystemExit(f'{db_path} has schema version {version}; rerun with --rebuild')
+    conn.executescript(SCHEMA)
+    conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+    return conn
+
+
+def unit_rows(path_str: str, root_str: str) -> dict:
+    path, root = Path(path_str), Path(root_str)
+    data = load_unit(path)
+    if data is None:
+        # Recorded in `skipped` so an unchanged bad file is not re-read on every refresh.
+        st = path.stat()
+        return {'path': rel_path(path, root), 'skipped': True, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                'digest': file_digest(path)}
+    unit = data['meta']['unit']
+    items = []
+    tokens = []
+    stage_spans = []
+    n_lines = 0
+    for local, item in enumerate(data['items']):
+        spans = item.get('spans') or []
+        items.append((
+            item.get('seq'), item.get('serial'), item.get('kind'), item.get('subtype'), item.get('speaker'),
+            item.get('speech_id'), item.get('speech_seq'), item.get('line_number'), item.get('line_serial'),
+            ''.join(span_text(span) for span in spans),
+        ))
+        if item.get('kind') == 'speech' and item.get('line_number') is not None:
+            n_lines += 1
+        for span_idx, span in enumerate(spans):
+            # Stage directions inside another item, e.g. "(Aside.)" in a speech.
+            if span.get('type') == 'stage' and item.get('kind') != 'stage':
+                stage_spans.append((local, span_idx, span.get('stage'), span_text(span)))
+            for pos, tok in enumerate(span.get('tokens') or []):
+                punct = tok.get('punct') or {}
+                tokens.append((
+                    local, span_idx, pos, tok.get('i'), tok.get('serial'), tok.get('type'), tok.get('s'), tok.get('norm'),
+                    tok.get('pre'), 1 if tok.get('em') else 0,
+                    punct.get('kind'), punct.get('dash'), punct.get('quote'), punct.get('role'),
+                ))
+    st = path.stat()
+    return {
+        'path': rel_path(path, root),
+        'play_id': play_id(data),
+        'play_title': (data['meta'].get('play') or {}).get('title'),
+        'unit': (
+            unit_id(data), unit.get('type'), unit.get('act'), unit.get('scene'), unit.get('label'), unit.get('title'),
+            (data['meta'].get('numbering') or {}).get('line_start'),
+        ),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'digest': file_digest(path),
+        'items': items,
+        'tokens': tokens,
+        'stage_spans': stage_spans,
+        'n_lines': n_lines,
+    }
+
+
+def play_rows(job: tuple[list[str], str]) -> list[dict]:
+    paths, root = job
+    out = []
+    for path in paths:
+        start = time.perf_counter()
+        rows = unit_rows(path, root)
+        rows['seconds'] = time.perf_counter() - start
+        out.append(rows)
+    return out
+
+
+def delete_unit(conn: sqlite3.Connection, unit_pk: int) -> None:
+    conn.execute(
+        "INSERT INTO lines_fts(lines_fts, rowid, text) "
+        "SELECT 'delete', item_pk, text FROM items WHERE unit_pk = ? AND text != ''",
+        (unit_pk,),
+    )
+    conn.execute('DELETE FROM tokens WHERE item_pk IN (SELECT item_pk FROM items WHERE unit_pk = ?)', (unit_pk,))
+    conn.execute('DELETE FROM stage_spans WHERE item_pk IN (SELECT item_pk FROM items WHERE unit_pk = ?)', (unit_pk,))
+    conn.execute('DELETE FROM items WHERE unit_pk = ?', (unit_pk,))
+    conn.execute('DELETE FROM units WHERE unit_pk = ?', (unit_pk,))
+
+
+def insert_unit(conn: sqlite3.Connection, rows: dict) -> None:
+    cur = conn.execute(
+        'INSERT INTO units (path, play_id, unit_id, type, act, scene, label, title, line_start, '
+        'size, mtime_ns, digest, n_items, n_lines, n_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (rows['path'], rows['play_id'], *rows['unit'], rows['size'], rows['mtime_ns'], rows['digest'],
+         len(rows['items']), rows['n_lines'], len(rows['tokens'])),
+    )
+    unit_pk = cur.lastrowid
+    base = (conn.execute('SELECT COALESCE(MAX(item_pk), 0) FROM items').fetchone()[0]) + 1
+    conn.executemany(
+        'INSERT INTO items (item_pk, unit_pk, seq, serial, kind, subtype, speaker, speech_id, speech_seq, '
+        'line_number, line_serial, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        ((base + local, unit_pk, *item) for local, item in enumerate(rows['items'])),
+    )
+    conn.executemany(
+        'INSERT INTO tokens (item_pk, span, pos, i, serial, type, s, norm, pre, em, punct_kind, punct_dash, '
+        'punct_quote, punct_role) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        ((base + tok[0], *tok[1:]) for tok in rows['tokens']),
+    )
+    conn.executemany(
+        'INSERT INTO stage_spans (item_pk, span, subtype, text) VALUES (?, ?, ?, ?)',
+        ((base + span[0], *span[1:]) for span in rows['stage_spans']),
+    )
+    conn.execute(
+        "INSERT INTO lines_fts(rowid, text) SELECT item_pk, text FROM items WHERE unit_pk = ? AND text != ''",
+        (unit_pk,),
+    )
+
+
+def stale_units(conn: sqlite3.Connection, root: Path) -> tuple[dict[str, list[str]], list[int]]:
+    known = {row[0]: row[1:] for row in conn.execute('SELECT path, unit_pk, size, mtime_ns, digest FROM units')}
+    skipped = {row[0]: row[1:] for row in conn.execute('SELECT path, size, mtime_ns, digest FROM skipped')}
+    changed: dict[str, list[str]] = defaultdict(list)
+    seen = set()
+    for path in iter_unit_paths(root):
+        rel = rel_path(path, root)
+        seen.add(rel)
+        if rel in known:
+            table, (size, mtime_ns, digest) = 'units', known[rel][1:]
+        elif rel in skipped:
+            table, (size, mtime_ns, digest) = 'skipped', skipped[rel]
+        else:
+            table = None
+        if table:
+            st = path.stat()
+            if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                continue
+            if st.st_size == size and file_digest(path) == digest:
+                conn.execute(f'UPDATE {table} SET mtime_ns = ? WHERE path = ?', (st.st_mtime_ns, rel))
+                continue
+        # Group by top-level play directory so each play is one job and one transaction.
+        changed[Path(rel).parts[0]].append(str(path))
+    removed = [entry[0] for rel, entry in known.items() if rel not in seen]
+    conn.executemany('DELETE FROM skipped WHERE path = ?', [(rel,) for rel in skipped if rel not in seen])
+    return changed, removed
+
+
+def refresh(
+    db_path: Path = DB_PATH, root: Path = ROOT, workers: int | None = None, paths: list[Path] | None = None,
+    trace: Trace | None = None,
+) -> int:
+    trace = trace or NullTrace()
+    conn = connect(db_path)
+    try:
+        with trace.stage('scan'):
+            if paths is None:
+                changed, removed = stale_units(conn, root)
+            else:
+                changed = defaultdict(list)
+                for path in paths:
+                    changed[Path(rel_path(path, root)).parts[0]].append(str(path))
+                removed = []
+            with conn:
+                for unit_pk in removed:
+                    delete_unit(conn, unit_pk)
+            trace.count(changed=sum(len(group) for group in changed.values()), removed=len(removed))
+        jobs = [(group, str(root)) for _, group in sorted(changed.items())]
+        count = 0
+        # Rows are built in the workers and inserted here; each unit's trace
+        # entry carries both times (load_seconds is measured in the worker).
+        with trace.stage('export'), ProcessPoolExecutor(max_workers=workers) as pool:
+            for group, units in zip(jobs, pool.map(play_rows, jobs)):
+                with conn:
+                    for path_str in group[0]:
+                        rel = rel_path(Path(path_str), root)
+                        row = conn.execute('SELECT unit_pk FROM units WHERE path = ?', (rel,)).fetchone()
+                        if row:
+                            delete_unit(conn, row[0])
+                        conn.execute('DELETE FROM skipped WHERE path = ?', (rel,))
+                    for rows in units:
+                        if rows.get('skipped'):
+                            conn.execute(
+                                'INSERT INTO skipped (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+                                (rows['path'], rows['size'], rows['mtime_ns'], rows['digest']),
+                            )
+                            print(f'{rows["path"]}: not a unit file; skipped until it changes', file=sys.stderr)
+                            continue
+                        start = time.perf_counter()
+                        conn.execute(
+                            'INSERT INTO plays (play_id, title) VALUES (?, ?) '
+                            'ON CONFLICT(play_id) DO UPDATE SET title = excluded.title',
+                            (rows['play_id'], rows['play_title']),
+                        )
+                        insert_unit(conn, rows)
+                        count += 1
+                        insert_seconds = time.perf_counter() - start
+                        trace.add_unit(
+                            rows['path'], rows['seconds'] + insert_seconds, files=1, items=len(rows['items']),
+                            tokens=len(rows['tokens']), bytes=rows['size'],
+                            load_seconds=rows['seconds'], insert_seconds=insert_seconds,
+                        )
+        with trace.stage('cleanup'), conn:
+            conn.execute('DELETE FROM plays WHERE play_id NOT IN (SELECT play_id FROM units)')
+        return count
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Export the corpus into a SQLite database with an FTS5 line index.')
+    parser.add_argument('--db', type=Path, default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help='drop the database and export everything')
+    parser.add_argument('--workers', type=int, default=None)
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+
+    trace = trace_from_args(args, 'export_sqlite')
+    if args.rebuild:
+        for suffix in ('', '-wal', '-shm'):
+            Path(f'{args.db}{suffix}').unlink(missing_ok=True)
+    count = refresh(args.db, workers=args.workers, trace=trace)
+    print(f'Refreshed {count} units in {args.db}')
+    finish_trace(trace, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from corpus import DERIVED, ROOT, is_index, item_text, iter_unit_paths, load_unit, rel_path, span_text
+from fix_henry_vi_part1_act1 import dedupe_span_text
+
+
+OUT_PATH = DERIVED / 'duplicates.json'
+MIN_RUN = 3
+MIN_LINE_WORDS = 4
+MOD = (1 << 61) - 1
+BASE = 1_000_003
+
+
+def dedupe_check(text: str) -> str | None:
+    # The same two checks dedupe_span_text applies: identical halves, or a
+    # first sentence repeated as the remainder.
+    stripped = text.strip()
+    if dedupe_span_text(text) == stripped:
+        return None
+    half = len(stripped) // 2
+    return 'halves' if stripped[:half].strip() == stripped[half:].strip() else 'sentence'
+
+
+def tandem_runs(words: list[str], min_run: int = MIN_RUN) -> list[tuple[int, int, int]]:
+    # Finds w[i:i+L] immediately repeated (count times), longest periods first,
+    # comparing rolling hashes and confirming on equal hashes.
+    n = len(words)
+    if n < 2 * min_run:
+        return []
+    ids: dict[str, int] = {}
+    prefix = [0] * (n + 1)
+    power = [1] * (n + 1)
+    for i, word in enumerate(words):
+        prefix[i + 1] = (prefix[i] * BASE + ids.setdefault(word, len(ids) + 1)) % MOD
+        power[i + 1] = power[i] * BASE % MOD
+
+    def window(i: int, length: int) -> int:
+        return (prefix[i + length] - prefix[i] * power[length]) % MOD
+
+    covered = [False] * n
+    runs = []
+    for length in range(n // 2, min_run - 1, -1):
+        i = 0
+        while i + 2 * length <= n:
+            if covered[i] or window(i, length) != window(i + length, length) or words[i:i + length] != words[i + length:i + 2 * length]:
+                i += 1
+                continue
+            count = 2
+            while i + (count + 1) * length <= n and window(i + count * length, length) == window(i, length):
+                count += 1
+            end = i + count * length
+            for k in range(i, end):
+                covered[k] = True
+            runs.append((i, length, count))
+            i = end
+    return runs
+
+
+def unit_findings(path_str: str, root_str: str) -> list[dict]:
+    path = Path(path_str)
+    data = load_unit(path)
+    # Contents pages list each scene's title next to its file name by design.
+    if data is None or is_index(data):
+        return []
+    rel = rel_path(path, Path(root_str))
+    findings = []
+    previous = None
+    for item in data['items']:
+        base = {'path': rel, 'serial': item.get('serial'), 'line_number': item.get('line_number'), 'kind': item.get('kind')}
+        for span_idx, span in enumerate(item.get('spans') or []):
+            tokens = span.get('tokens') or []
+            positions = [pos for pos, tok in enumerate(tokens) if tok.get('type') == 'word']
+            words = [tokens[pos].get('norm') or tokens[pos].get('s') or '' for pos in positions]
+            if not words:
+                continue
+            text = span_text(span)
+            checks = []
+            score = 0
+            check = dedupe_check(text)
+            if check:
+                checks.append(check)
+                score = len(words) // 2
+            runs = []
+            for start, length, count in tandem_runs(words):
+                first, last = tokens[positions[start]], tokens[positions[start + count * length - 1]]
+                runs.append({
+                    'words': ' '.join(words[start:start + length]),
+                    'length': length,
+                    'count': count,
+                    'tokens': [first.get('serial'), last.get('serial')],
+                })
+                score = max(score, length * (count - 1))
+            if runs:
+                checks.append('tandem_run')
+            if checks:
+                findings.append({**base, 'span': span_idx, 'checks': checks, 'score': score, 'runs': runs, 'text': text.strip()})
+
+        text = item_text(item).strip()
+        n_words = sum(1 for span in item.get('spans') or [] for tok in span.get('tokens') or [] if tok.get('type') == 'word')
+        if previous and n_words >= MIN_LINE_WORDS and text == previous[1] and item.get('kind') == previous[0].get('kind'):
+            findings.append({
+                **base, 'span': None, 'checks': ['repeated_line'], 'score': n_words, 'runs': [],
+                'text': text, 'previous': previous[0].get('serial'),
+            })
+        previous = (item, text)
+    return findings
+
+
+def scan(root: Path = ROOT, workers: int | None = None) -> list[dict]:
+    paths = [str(p) for p in iter_unit_paths(root)]
+    findings = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for unit in pool.map(unit_findings, paths, [str(root)] * len(paths), chunksize=8):
+            findings.extend(unit)
+    findings.sort(key=lambda f: (-f['score'], f['path'], f['serial'] or ''))
+    return findings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Scan every span for doubled text and repeated token runs.')
+    parser.add_argument('--min-score', type=int, default=MIN_RUN, help='drop findings with fewer duplicated words')
+    parser.add_argument('--out', type=Path, default=OUT_PATH)
+    parser.add_argument('--top', type=int, default=30, help='print the N highest-ranked findings')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    findings = [f for f in scan(workers=args.workers) if f['score'] >= args.min_score]
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(findings, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    for finding in findings[:args.top]:
+        where = finding['serial'] or finding['path']
+        text = finding['text'] if len(finding['text']) <= 80 else finding['text'][:77] + '...'
+        print(f'{finding["score"]:>4}  {",".join(finding["checks"]):<22} {where}  {text}')
+    print(f'Wrote {len(findings)} findings to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import argparse
+import json
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from corpus import DERIVED, ROOT, iter_unit_paths, load_unit, play_id, rel_path, unit_id
+
+
+OUT_PATH = DERIVED / 'reuse.json'
+SHINGLE = 5
+WINDOW = 50
+STRIDE = 25
+MIN_WORDS = 12
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+MERSENNE = (1 << 31) - 1
+CHUNK = 1 << 15
+MAX_BUCKET = 64
+
+
+def speech_words(data: dict) -> list[tuple[dict, list[str], list[int | None]]]:
+    # One word sequence per speech (grouped by speech_id), with the line number of each word.
+    speeches: dict[str, tuple[dict, list[str], list[int | None]]] = {}
+    for item in data['items']:
+        if item.get('kind') != 'speech' or not item.get('speech_id'):
+            continue
+        entry = speeches.get(item['speech_id'])
+        if entry is None:
+            entry = speeches[item['speech_id']] = ({'speech_id': item['speech_id'], 'speaker': item.get('speaker')}, [], [])
+        for span in item.get('spans') or []:
+            if span.get('type') == 'stage':
+                continue
+            for tok in span.get('tokens') or []:
+                if tok.get('type') == 'word' and tok.get('norm'):
+                    entry[1].append(tok['norm'])
+                    entry[2].append(item.get('line_number'))
+    return list(speeches.values())
+
+
+def unit_documents(path_str: str, root_str: str) -> list[tuple[dict, bytes]]:
+    # Splits each speech into overlapping windows and hashes their word shingles.
+    path = Path(path_str)
+    data = load_unit(path)
+    if data is None:
+        return []
+    base = {'play': play_id(data), 'unit_id': unit_id(data), 'path': rel_path(path, Path(root_str))}
+    docs = []
+    for info, words, lines in speech_words(data):
+        if len(words) < MIN_WORDS:
+            continue
+        starts = range(0, max(1, len(words) - WINDOW + STRIDE), STRIDE) if len(words) > WINDOW else [0]
+        for start in starts:
+            window = words[start:start + WINDOW]
+            if len(window) < MIN_WORDS:
+                continue
+            shingles = array('I', sorted({
+                zlib.crc32(' '.join(window[i:i + SHINGLE]).encode('utf-8'))
+                for i in range(len(window) - SHINGLE + 1)
+            }))
+            numbered = [n for n in lines[start:start + WINDOW] if n is not None]
+            docs.append(({
+                **base, **info,
+                'lines': [numbered[0], numbered[-1]] if numbered else None,
+                'text': ' '.join(window[:16]),
+            }, shingles.tobytes()))
+    return docs
+
+
+def collect_documents(root: Path = ROOT, workers: int | None = None) -> tuple[list[dict], np.ndarray, np.ndarray]:
+    paths = [str(p) for p in iter_unit_paths(root)]
+    meta: list[dict] = []
+    parts: list[np.ndarray] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for docs in pool.map(unit_documents, paths, [str(root)] * len(paths), chunksize=8):
+            for info, shingles in docs:
+                meta.append(info)
+                parts.append(np.frombuffer(shingles, dtype=np.uint32))
+    lengths = np.fromiter((len(p) for p in parts), dtype=np.int64, count=len(parts))
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return meta, np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint32), offsets
+
+
+def minhash(shingles: np.ndarray, offsets: np.ndarray, seed: int = 1) -> np.ndarray:
+    # Universal hashes (a * x + b) mod 2^31-1; every intermediate fits in uint64.
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE, size=(NUM_PERM, 1), dtype=np.uint64)
+    b = rng.integers(0, MERSENNE, size=(NUM_PERM, 1), dtype=np.uint64)
+    values = shingles.astype(np.uint64) % MERSENNE
+    n_docs = len(offsets) - 1
+    signatures = np.empty((n_docs, NUM_PERM), dtype=np.uint32)
+    start = 0
+    while start < n_docs:
+        # Whole documents per chunk so reduceat never straddles a boundary.
+        end = int(np.searchsorted(offsets, offsets[start] + CHUNK, side='right')) - 1
+        end = min(max(end, start + 1), n_docs)
+        lo, hi = offsets[start], offsets[end]
+        hashed = (a * values[lo:hi] + b) % MERSENNE
+        signatures[start:end] = np.minimum.reduceat(hashed, offsets[start:end] - lo, axis=1).T
+        start = end
+    return signatures
+
+
+def lsh_candidates(signatures: np.ndarray) -> np.ndarray:
+    n_docs = len(signatures)
+    pairs = []
+    for band in range(BANDS):
+        rows = signatures[:, band * ROWS:(band + 1) * ROWS].astype(np.uint64)
+        keys = np.zeros(n_docs, dtype=np.uint64)
+        for col in range(ROWS):
+            keys = keys * np.uint64(0x100000001B3) ^ rows[:, col]
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [n_docs]))
+        for lo, hi in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            # Oversized buckets are boilerplate ("Exeunt"-style refrains); skip them.
+            if hi - lo > MAX_BUCKET:
+                continue
+            members = np.sort(order[lo:hi])
+            i, j = np.triu_indices(len(members), k=1)
+            pairs.append(members[i] * n_docs + members[j])
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    flat = np.unique(np.concatenate(pairs))
+    return np.stack((flat // n_docs, flat % n_docs), axis=1)
+
+
+def find_reuse(root: Path = ROOT, threshold: float = 0.5, cross_play: bool = False, workers: int | None = None) -> list[dict]:
+    meta, shingles, offsets = collect_documents(root, workers)
+    signatures = minhash(shingles, offsets)
+    candidates = lsh_candidates(signatures)
+    if len(candidates):
+        similarity = (signatures[candidates[:, 0]] == signatures[candidates[:, 1]]).mean(axis=1)
+        candidates, similarity = candidates[similarity >= threshold], similarity[similarity >= threshold]
+    else:
+        similarity = np.zeros(0)
+
+    # Windows of the same pair of speeches collapse to their best-scoring match.
+    best: dict[tuple, tuple[float, int, int]] = {}
+    for (i, j), score in zip(candidates.tolist(), similarity.tolist()):
+        a, b = meta[i], meta[j]
+        if a['speech_id'] == b['speech_id'] and a['path'] == b['path']:
+            continue
+        if cross_play and a['play'] == b['play']:
+            continue
+        key = (a['path'], a['speech_id'], b['path'], b['speech_id'])
+        if key not in best or score > best[key][0]:
+            best[key] = (score, i, j)
+    matches = [
+        {'similarity': round(score, 3), 'a': meta[i], 'b': meta[j]}
+        for score, i, j in best.values()
+    ]
+    matches.sort(key=lambda m: (-m['similarity'], m['a']['path'], m['a']['speech_id']))
+    return matches
+
+
+def describe(doc: dict) -> str:
+    lines = doc['lines']
+    where = f'{lines[0]}-{lines[1]}' if lines and lines[0] != lines[1] else str(lines[0]) if lines else '-'
+    return f'{doc["path"]}:{where} {doc["speaker"]}'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Find near-duplicate passages with MinHash signatures and LSH banding.')
+    parser.add_argument('--threshold', type=float, default=0.5, help='minimum estimated Jaccard similarity')
+    parser.add_argument('--cross-play', action='store_true', help='only report matches between different plays')
+    parser.add_argument('--out', type=Path, default=OUT_PATH)
+    parser.add_argument('--top', type=int, default=20, help='print the N strongest matches')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    matches = find_reuse(threshold=args.threshold, cross_play=args.cross_play, workers=args.workers)
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(matches, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    for match in matches[:args.top]:
+        print(f'{match["similarity"]:.2f}  {describe(match["a"])}')
+        print(f'      {describe(match["b"])}')
+        print(f'      {match["a"]["text"]} …')
+    print(f'Wrote {len(matches)} matches to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
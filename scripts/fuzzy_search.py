@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from corpus import DERIVED, ROOT, UnitCache, item_text, iter_unit_paths, load_unit, rel_path
+from profiling import NullTrace, Trace, add_trace_arguments, finish_trace, trace_from_args
+
+
+OUT_DIR = DERIVED / 'fuzzy'
+CACHE_VERSION = 1
+INDEX_VERSION = 2
+APOSTROPHES = {"'", '’', '‘'}
+
+
+def fold(word: str) -> str:
+    text = unicodedata.normalize('NFKD', word.replace('’', "'").replace('‘', "'").lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def bare(form: str) -> str:
+    return form.replace("'", '')
+
+
+def trigrams(form: str) -> set[str]:
+    padded = f'$${bare(form)}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def join_apostrophes(tokens: list[dict]) -> list[tuple[str, list[int]]]:
+    # Rejoins words split around a separate apostrophe token ("ne" "’" "er",
+    # "brandish" "’" "d") and returns (form, token positions) pairs.
+    words: list[tuple[str, list[int]]] = []
+    attach = False
+    for pos, tok in enumerate(tokens):
+        kind = tok.get('type')
+        text = tok.get('norm') or tok.get('s') or ''
+        glued = not tok.get('pre')
+        if kind == 'punct' and tok.get('s') in APOSTROPHES:
+            if words and glued and words[-1][1][-1] == pos - 1 and not words[-1][0].endswith("'"):
+                words[-1] = (words[-1][0] + "'", words[-1][1] + [pos])
+                attach = True
+            else:
+                words.append(("'", [pos]))
+                attach = True
+            continue
+        if kind != 'word':
+            attach = False
+            continue
+        if attach and glued and words and words[-1][1][-1] == pos - 1:
+            words[-1] = (words[-1][0] + fold(text), words[-1][1] + [pos])
+        else:
+            words.append((fold(text), [pos]))
+        attach = False
+    return [(form, positions) for form, positions in words if bare(form)]
+
+
+def unit_forms(data: dict) -> dict[str, int]:
+    forms: Counter[str] = Counter()
+    for item in data['items']:
+        for span in item.get('spans') or []:
+            for form, _ in join_apostrophes(span.get('tokens') or []):
+                forms[form] += 1
+    return dict(forms)
+
+
+def build_index(root: Path = ROOT, out: Path = OUT_DIR, trace: Trace | None = None) -> tuple[dict, int]:
+    trace = trace or NullTrace()
+    cache = UnitCache(out / 'cache.json', CACHE_VERSION)
+    paths = []
+    by_form: dict[str, dict[int, int]] = defaultdict(dict)
+    keys = set()
+    rebuilt = 0
+    with trace.stage('load'):
+        for path in iter_unit_paths(root):
+            key = rel_path(path, root)
+            keys.add(key)
+            forms = cache.get(key, path)
+            if forms is None:
+                with trace.unit(key, files=1, bytes=path.stat().st_size) as counters:
+                    data = load_unit(path)
+                    forms = unit_forms(data) if data is not None else {}
+                    counters['forms'] = len(forms)
+                cache.put(key, path, forms)
+                rebuilt += 1
+            if not forms:
+                continue
+            unit = len(paths)
+            paths.append(key)
+            for form, count in forms.items():
+                by_form[form][unit] = count
+        cache.prune(keys)
+        cache.save()
+        trace.count(cached=len(keys) - rebuilt)
+
+    with trace.stage('index'):
+        forms = sorted(by_form)
+        postings: dict[str, list[int]] = defaultdict(list)
+        for form_id, form in enumerate(forms):
+            for gram in trigrams(form):
+                postings[gram].append(form_id)
+        index = {
+            'version': INDEX_VERSION,
+            'paths': paths,
+            'forms': forms,
+            'sizes': [len(trigrams(f)) for f in forms],
+            'counts': [sum(by_form[f].values()) for f in forms],
+            'units': [sorted(by_form[f]) for f in forms],
+            'trigrams': dict(sorted(postings.items())),
+        }
+        trace.count(forms=len(forms), trigrams=len(postings))
+    return index, rebuilt
+
+
+def load_index(out: Path = OUT_DIR) -> dict:
+    with open(out / 'index.json', encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('version') != INDEX_VERSION:
+        raise SystemExit(f'{out / "index.json"} is out of date; rerun with --build')
+    return index
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    # Damerau-Levenshtein (adjacent transpositions) restricted to the diagonal
+    # band |i - j| <= limit; anything outside it is already over the limit.
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    prev2: list[int] = []
+    prev = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        row = [over] * (len(b) + 1)
+        if i <= limit:
+            row[0] = i
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            best = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                best = min(best, prev2[j - 2] + 1)
+            row[j] = min(best, over)
+        if min(row) > limit:
+            return over
+        prev2, prev = prev, row
+    return prev[-1]
+
+
+def search(index: dict, query: str, max_distance: int | None = None, limit: int = 20) -> list[dict]:
+    form = fold(query.strip())
+    target = bare(form)
+    if max_distance is None:
+        max_distance = 0 if len(target) <= 2 else 1 if len(target) <= 5 else 2
+    grams = trigrams(form)
+    shared: Counter[int] = Counter()
+    for gram in grams:
+        shared.update(index['trigrams'].get(gram, ()))
+    forms = index['forms']
+    sizes = index['sizes']
+    hits = []
+    for form_id, count in shared.items():
+        # An edit removes at most three distinct trigrams from either word (four
+        # for a transposition), which bounds how few the two can share.
+        if count < max(len(grams), sizes[form_id]) - 4 * max_distance:
+            continue
+        candidate = forms[form_id]
+        distance = edit_distance(target, bare(candidate), max_distance)
+        if distance > max_distance:
+            continue
+        hits.append({
+            'form': candidate,
+            'distance': distance,
+            'exact': candidate == form,
+            'count': index['counts'][form_id],
+            'units': len(index['units'][form_id]),
+            'id': form_id,
+        })
+    hits.sort(key=lambda h: (h['distance'], not h['exact'], -h['count'], h['form']))
+    return hits[:limit]
+
+
+def occurrences(index: dict, hit: dict, root: Path = ROOT, limit: int = 10) -> list[tuple[str, int | None, str]]:
+    found = []
+    for unit in index['units'][hit['id']]:
+        data = load_unit(root / index['paths'][unit])
+        if data is None:
+            continue
+        for item in data['items']:
+            for span in item.get('spans') or []:
+                if any(form == hit['form'] for form, _ in join_apostrophes(span.get('tokens') or [])):
+                    found.append((index['paths'][unit], item.get('line_number'), item_text(item).strip()))
+                    break
+            if len(found) >= limit:
+                return found
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fuzzy, spelling-tolerant word search over distinct token norms.')
+    parser.add_argument('query', nargs='*')
+    parser.add_argument('--build', action='store_true', help='(re)build the form index before searching')
+    parser.add_argument('--out', type=Path, default=OUT_DIR)
+    parser.add_argument('--distance', type=int, default=None, help='maximum edit distance (default depends on length)')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--show', type=int, default=0, metavar='N', help='print up to N lines for each form')
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+
+    trace = trace_from_args(args, 'fuzzy_search')
+    index_path = args.out / 'index.json'
+    if args.build or not index_path.exists():
+        index, rebuilt = build_index(out=args.out, trace=trace)
+        with trace.stage('write'):
+            args.out.mkdir(parents=True, exist_ok=True)
+            with open(index_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+            trace.count(bytes=index_path.stat().st_size)
+        print(f'Indexed {len(index["forms"])} forms from {len(index["paths"])} units ({rebuilt} units rescanned)')
+    else:
+        with trace.stage('load_index'):
+            index = load_index(args.out)
+
+    for query in args.query:
+        start = time.perf_counter()
+        hits = search(index, query, args.distance, args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f'{query}: {len(hits)} forms in {elapsed:.1f} ms')
+        for hit in hits:
+            print(f'  {hit["form"]:<20} d={hit["distance"]}  {hit["count"]:>6} tokens in {hit["units"]} units')
+            for path, line, text in occurrences(index, hit, limit=args.show) if args.show else ():
+                print(f'      {path}:{line if line is not None else "-"}  {text}')
+    finish_trace(trace, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Iterator
+
+from corpus import ROOT, iter_unit_paths
+
+
+ITEM_FIELDS = (
+    'seq', 'serial', 'kind', 'subtype', 'speaker', 'speech_id', 'speech_seq', 'line_number', 'line_serial', 'subsection',
+)
+SPAN_FIELDS = ('type', 'em', 'text')
+
+# Unit files are written with indent=2, so a token array closes on a line
+# indented exactly like the line that opened it. Arrays laid out any other
+# way are simply left inline and parsed with the rest of the document.
+TOKENS_OPEN = b'"tokens": [\n'
+
+
+class Span:
+    __slots__ = SPAN_FIELDS + ('extra', '_unit', '_start', '_end', '_tokens')
+
+    def __init__(self, unit: Unit, data: dict, ref: tuple[int, int] | None):
+        self.type = data.pop('type', None)
+        self.em = data.pop('em', None)
+        self.text = data.pop('text', None)
+        tokens = data.pop('tokens', None)
+        self.extra = data or None
+        self._unit = unit
+        self._start, self._end = ref or (0, 0)
+        self._tokens = None if ref else tokens
+
+    @property
+    def tokens(self) -> list[dict]:
+        if self._tokens is None:
+            self._tokens = json.loads(self._unit.read(self._start, self._end)) if self._end else []
+        return self._tokens
+
+    @property
+    def loaded(self) -> bool:
+        return self._tokens is not None
+
+    def release(self) -> None:
+        if self._end:
+            self._tokens = None
+
+    # Dict-style access so corpus.span_text() and friends accept lazy spans.
+    def get(self, key: str, default=None):
+        if key == 'tokens':
+            return self.tokens
+        if key in SPAN_FIELDS:
+            return getattr(self, key)
+        return (self.extra or {}).get(key, default)
+
+    def __getitem__(self, key: str):
+        if key in SPAN_FIELDS or key == 'tokens' or key in (self.extra or {}):
+            return self.get(key)
+        raise KeyError(key)
+
+    def to_dict(self) -> dict:
+        return {'type': self.type, 'em': self.em, 'text': self.text, **(self.extra or {}), 'tokens': [dict(tok) for tok in self.tokens]}
+
+
+class Item:
+    __slots__ = ITEM_FIELDS + ('spans', 'extra')
+
+    def __init__(self, data: dict, spans: list[Span]):
+        for field in ITEM_FIELDS:
+            setattr(self, field, data.pop(field, None))
+        data.pop('spans', None)
+        self.spans = spans
+        self.extra = data or None
+
+    @property
+    def text(self) -> str:
+        return ''.join(span.text if isinstance(span.text, str) else '' for span in self.spans)
+
+    def get(self, key: str, default=None):
+        if key in ITEM_FIELDS or key == 'spans':
+            value = getattr(self, key)
+            return default if value is None else value
+        return (self.extra or {}).get(key, default)
+
+    def __getitem__(self, key: str):
+        if key in ITEM_FIELDS or key == 'spans' or key in (self.extra or {}):
+            return self.get(key)
+        raise KeyError(key)
+
+    def to_dict(self) -> dict:
+        out = {field: getattr(self, field) for field in ITEM_FIELDS}
+        out.update(self.extra or {})
+        out['spans'] = [span.to_dict() for span in self.spans]
+        return out
+
+
+class Unit:
+    __slots__ = ('path', 'meta', 'items', '_stat')
+
+    def __init__(self, path: Path, meta: dict, stat):
+        self.path = path
+        self.meta = meta
+        self.items: list[Item] = []
+        self._stat = (stat.st_size, stat.st_mtime_ns)
+
+    def read(self, start: int, end: int) -> bytes:
+        # Token bytes are read back from the file on demand, so no descriptor
+        # or buffer is held between accesses.
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            st = os.fstat(fd)
+            if (st.st_size, st.st_mtime_ns) != self._stat:
+                raise RuntimeError(f'{self.path} changed since it was loaded')
+            return os.pread(fd, end - start, start)
+        finally:
+            os.close(fd)
+
+    def get(self, key: str, default=None):
+        return {'meta': self.meta, 'items': self.items}.get(key, default)
+
+    def __getitem__(self, key: str):
+        if key == 'meta':
+            return self.meta
+        if key == 'items':
+            return self.items
+        raise KeyError(key)
+
+    def to_dict(self) -> dict:
+        return {'meta': self.meta, 'items': [item.to_dict() for item in self.items]}
+
+
+def load_lazy(path: Path) -> Unit | None:
+    # Same acceptance rules as corpus.load_unit, but token arrays are replaced
+    # by their byte offsets before parsing and only decoded on access.
+    try:
+        raw = path.read_bytes()
+        st = path.stat()
+    except OSError:
+        return None
+    refs: list[tuple[int, int]] = []
+    pieces = []
+    last = 0
+    pos = raw.find(TOKENS_OPEN)
+    while pos >= 0:
+        indent = raw[raw.rfind(b'\n', 0, pos) + 1:pos]
+        start = pos + len(TOKENS_OPEN) - 2
+        close = raw.find(b'\n' + indent + b']', start) if not indent.strip() else -1
+        if close < 0:
+            pos = raw.find(TOKENS_OPEN, start)
+            continue
+        end = close + len(indent) + 2
+        pieces.append(raw[last:start])
+        pieces.append(str(len(refs)).encode('ascii'))
+        refs.append((start, end))
+        last = end
+        pos = raw.find(TOKENS_OPEN, end)
+    pieces.append(raw[last:])
+    del raw
+    try:
+        data = json.loads(b''.join(pieces))
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        return None
+    if not (data.get('meta') or {}).get('unit'):
+        return None
+
+    unit = Unit(path, data['meta'], st)
+    for item in data['items']:
+        spans = []
+        for span in item.get('spans') or []:
+            tokens = span.get('tokens')
+            ref = refs[tokens] if isinstance(tokens, int) and not isinstance(tokens, bool) else None
+            spans.append(Span(unit, span, ref))
+        unit.items.append(Item(item, spans))
+    return unit
+
+
+def iter_lazy_units(root: Path = ROOT) -> Iterator[Unit]:
+    for path in iter_unit_paths(root):
+        unit = load_lazy(path)
+        if unit is not None:
+            yield unit
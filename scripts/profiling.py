@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+
+SLOWEST_UNITS = 10
+PROFILE_ROWS = 25
+
+
+def rounded(counters: dict) -> dict:
+    return {k: round(v, 6) if isinstance(v, float) else v for k, v in counters.items()}
+
+
+def max_rss_kb(who: int = resource.RUSAGE_SELF) -> int:
+    # High-water mark in KiB (Linux reports KiB, macOS bytes).
+    rss = resource.getrusage(who).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.counters: dict[str, float] = {}
+        self.units: list[tuple[float, str, dict]] = []
+        self.n_units = 0
+        self.unit_seconds = 0.0
+        self.max_rss_kb = 0
+        self.children_max_rss_kb = 0
+        self.tracemalloc_peak = None
+        self.profile: list[dict] | None = None
+
+    def count(self, **counters: float) -> None:
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_unit(self, key: str, seconds: float, counters: dict) -> None:
+        # Only the slowest units are kept, so tracing the whole canon stays cheap.
+        self.n_units += 1
+        self.unit_seconds += seconds
+        self.units.append((seconds, key, counters))
+        if len(self.units) > 4 * SLOWEST_UNITS:
+            self.units.sort(key=lambda u: -u[0])
+            del self.units[SLOWEST_UNITS:]
+
+    def to_dict(self) -> dict:
+        out = {
+            'name': self.name,
+            'seconds': round(self.seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'counters': rounded(self.counters),
+            'max_rss_kb': self.max_rss_kb,
+            'children_max_rss_kb': self.children_max_rss_kb,
+        }
+        if self.n_units:
+            slowest = sorted(self.units, key=lambda u: -u[0])[:SLOWEST_UNITS]
+            out['units'] = {
+                'count': self.n_units,
+                'seconds': round(self.unit_seconds, 6),
+                'slowest': [{'unit': key, 'seconds': round(seconds, 6), **rounded(counters)} for seconds, key, counters in slowest],
+            }
+        if self.tracemalloc_peak is not None:
+            out['tracemalloc_peak_bytes'] = self.tracemalloc_peak
+        if self.profile is not None:
+            out['profile'] = self.profile
+        return out
+
+
+class Trace:
+    # Wall/CPU time, counters and memory per named stage, plus the slowest
+    # units inside each stage. Stages nest ("export/insert"). With profile=True
+    # each outermost stage also runs under cProfile, and with memory=True
+    # tracemalloc reports the peak Python allocation of each stage. Work done in
+    # worker processes is reported back with add_unit().
+
+    def __init__(self, name: str, profile: bool = False, memory: bool = False):
+        self.name = name
+        self.profile = profile
+        self.memory = memory
+        self.started = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self.stages: list[Stage] = []
+        self._stack: list[Stage] = []
+        self._profiler: cProfile.Profile | None = None
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @property
+    def current(self) -> Stage | None:
+        return self._stack[-1] if self._stack else None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        parent = self.current
+        stage = Stage(f'{parent.name}/{name}' if parent else name)
+        self.stages.append(stage)
+        self._stack.append(stage)
+        profiler = None
+        if self.profile and self._profiler is None:
+            profiler = self._profiler = cProfile.Profile()
+            profiler.enable()
+        if self.memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - wall
+            stage.cpu_seconds = time.process_time() - cpu
+            stage.max_rss_kb = max_rss_kb()
+            stage.children_max_rss_kb = max_rss_kb(resource.RUSAGE_CHILDREN)
+            if self.memory:
+                # reset_peak() in a nested stage lowers the parent's peak; the
+                # parent still sees everything allocated after the child ended.
+                stage.tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+            if profiler is not None:
+                profiler.disable()
+                stage.profile = profile_rows(profiler)
+                self._profiler = None
+            self._stack.pop()
+            if parent is not None:
+                parent.count(**stage.counters)
+
+    @contextmanager
+    def unit(self, key: str, **counters: float) -> Iterator[dict]:
+        # Times one unit inside the current stage; the yielded dict takes
+        # counters that are only known once the unit has been processed.
+        start = time.perf_counter()
+        values = dict(counters)
+        try:
+            yield values
+        finally:
+            self.add_unit(key, time.perf_counter() - start, **values)
+
+    def add_unit(self, key: str, seconds: float, **counters: float) -> None:
+        stage = self.current
+        if stage is None:
+            raise RuntimeError('add_unit() outside of a stage')
+        stage.add_unit(key, seconds, counters)
+        stage.count(units=1, **counters)
+
+    def count(self, **counters: float) -> None:
+        if self.current is not None:
+            self.current.count(**counters)
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'started': self.started.isoformat(timespec='seconds'),
+            'argv': sys.argv,
+            'pid': os.getpid(),
+            'seconds': round(time.perf_counter() - self._t0, 6),
+            'max_rss_kb': max_rss_kb(),
+            'children_max_rss_kb': max_rss_kb(resource.RUSAGE_CHILDREN),
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+    def summary(self) -> str:
+        lines = []
+        for stage in self.stages:
+            counters = ' '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}' for k, v in stage.counters.items())
+            line = f'{stage.name:<24} {stage.seconds:8.3f}s  rss {stage.max_rss_kb // 1024}M  {counters}'
+            if stage.n_units:
+                seconds, key, _ = max(stage.units, key=lambda u: u[0])
+                line += f'  slowest {key} {seconds:.3f}s'
+            lines.append(line.rstrip())
+        return '\n'.join(lines)
+
+
+class NullTrace(Trace):
+    # Same interface, no bookkeeping; scripts use it when --trace is not given.
+
+    def __init__(self, name: str = ''):
+        super().__init__(name)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        yield Stage(name)
+
+    @contextmanager
+    def unit(self, key: str, **counters: float) -> Iterator[dict]:
+        yield dict(counters)
+
+    def add_unit(self, key: str, seconds: float, **counters: float) -> None:
+        pass
+
+    def count(self, **counters: float) -> None:
+        pass
+
+
+def profile_rows(profiler: cProfile.Profile, limit: int = PROFILE_ROWS) -> list[dict]:
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, func), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f'{Path(filename).name}:{line}({func})',
+            'calls': calls,
+            'tottime': round(tottime, 6),
+            'cumtime': round(cumtime, 6),
+        })
+    rows.sort(key=lambda r: -r['cumtime'])
+    return rows[:limit]
+
+
+def add_trace_arguments(parser) -> None:
+    parser.add_argument('--trace', type=Path, metavar='PATH', help='write a JSON timing trace to PATH')
+    parser.add_argument('--trace-profile', action='store_true', help='capture cProfile statistics per stage')
+    parser.add_argument('--trace-memory', action='store_true', help='capture the tracemalloc peak per stage')
+
+
+def trace_from_args(args, name: str) -> Trace:
+    if not args.trace:
+        return NullTrace(name)
+    return Trace(name, profile=args.trace_profile, memory=args.trace_memory)
+
+
+def finish_trace(trace: Trace, args) -> None:
+    if isinstance(trace, NullTrace) or not args.trace:
+        return
+    trace.write(args.trace)
+    print(trace.summary(), file=sys.stderr)
+    print(f'Wrote trace to {args.trace}', file=sys.stderr)
@@ -0,0 +1,718 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+from corpus import DERIVED, split_speaker
+from fuzzy_search import fold
+
+
+INDEX_PATH = DERIVED / 'query' / 'index.bin'
+INDEX_VERSION = 2
+MAGIC = b'SJQ1'
+
+# Query syntax, clauses ANDed together:
+#   word                 a token norm (folded like fuzzy_search)
+#   "two words"          a phrase; "two words"~3 allows up to 3 words between terms
+#   play:hamlet act:3 scene:1 unit:<unit_id>
+#   speaker:HAMLET speaker:"FIRST WITCH"
+#   kind:speech subtype:exit heading:act (a kind name as field sets the subtype)
+#   stage:aside          a stage item of that subtype, or an item holding a
+#                        stage span with that subtype or word ("(Aside.)")
+#   line:73 line:60-80
+#   text:"shuffled off" (substring of the line text; scanned, never indexed)
+#   -clause              excludes matches
+CLAUSE_RE = re.compile(r'(-?)(?:([a-z_]+):)?(?:"([^"]*)"(?:~(\d+))?|(\S+))')
+UNIT_FIELDS = ('play', 'act', 'scene', 'unit')
+KINDS = ('speech', 'speaker_label', 'stage', 'heading', 'cast_entry')
+FIELDS = set(UNIT_FIELDS) | {'speaker', 'kind', 'subtype', 'line', 'text', 'word'} | set(KINDS)
+
+# Relative cost of touching one candidate, per access path.
+COST_COLUMN = 1.0
+COST_PHRASE = 2.0
+COST_TEXT = 40.0
+TEXT_BATCH = 500
+
+
+class QueryError(ValueError):
+    pass
+
+
+def corpus_signature(db: sqlite3.Connection) -> str:
+    # Changes whenever export_sqlite adds, drops or rewrites a unit.
+    digest = hashlib.sha1()
+    for path, unit_digest in db.execute('SELECT path, digest FROM units ORDER BY path'):
+        digest.update(f'{path}\0{unit_digest}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def speaker_keys(speaker: str | None) -> set[str]:
+    if not speaker:
+        return set()
+    whole = re.sub(r'\s+', ' ', speaker.replace('_', ' ')).strip().upper()
+    return {whole, *split_speaker(speaker)}
+
+
+class Writer:
+    # Collects uint32 runs into one buffer and hands back their offsets.
+
+    def __init__(self):
+        self.data = array('I')
+
+    def put(self, values) -> int:
+        offset = len(self.data)
+        self.data.extend(values)
+        return offset
+
+
+def build_index(db: sqlite3.Connection) -> tuple[dict, array]:
+    # Items become dense doc ids in corpus order (unit path, then seq), so
+    # every posting list is sorted and every unit is a contiguous doc range.
+    units = []
+    unit_of_pk = {}
+    for unit_pk, path, play, uid, act, scene in db.execute(
+        'SELECT unit_pk, path, play_id, unit_id, act, scene FROM units ORDER BY path'
+    ):
+        unit_of_pk[unit_pk] = len(units)
+        units.append([path, play, uid, act, scene, 0, 0])
+
+    kinds = ['']
+    kind_ids = {'': 0}
+    subtypes = ['']
+    subtype_ids = {'': 0}
+    columns = {name: array('I') for name in ('item_pk', 'unit', 'kind', 'subtype', 'line')}
+    doc_of_pk = {}
+    speakers: dict[str, list[int]] = defaultdict(list)
+    by_kind: dict[str, list[int]] = defaultdict(list)
+    stage: dict[str, set[int]] = defaultdict(set)
+    rows = db.execute(
+        'SELECT i.item_pk, i.unit_pk, i.kind, i.subtype, i.speaker, i.line_number FROM items i '
+        'JOIN units u ON u.unit_pk = i.unit_pk ORDER BY u.path, i.seq, i.item_pk'
+    )
+    for doc, (item_pk, unit_pk, kind, subtype, speaker, line) in enumerate(rows):
+        unit = unit_of_pk[unit_pk]
+        if units[unit][6] == 0:
+            units[unit][5] = doc
+        units[unit][6] = doc + 1
+        kind, subtype = kind or '', subtype or ''
+        if kind not in kind_ids:
+            kind_ids[kind] = len(kinds)
+            kinds.append(kind)
+        if subtype not in subtype_ids:
+            subtype_ids[subtype] = len(subtypes)
+            subtypes.append(subtype)
+        doc_of_pk[item_pk] = doc
+        columns['item_pk'].append(item_pk)
+        columns['unit'].append(unit)
+        columns['kind'].append(kind_ids[kind])
+        columns['subtype'].append(subtype_ids[subtype])
+        columns['line'].append(line if isinstance(line, int) and line > 0 else 0)
+        by_kind[kind].append(doc)
+        if subtype:
+            by_kind[f'{kind}/{subtype}'].append(doc)
+            if kind == 'stage':
+                stage[subtype].add(doc)
+        for key in speaker_keys(speaker):
+            speakers[key].append(doc)
+
+    # Stage spans inside speeches carry no subtype in practice, so their
+    # words stand in for it: "(Aside.)" puts the item under stage:aside.
+    for item_pk, subtype, text in db.execute('SELECT item_pk, subtype, text FROM stage_spans'):
+        for key in {subtype or '', *words(text or '')} - {''}:
+            stage[key.lower()].add(doc_of_pk[item_pk])
+
+    # Positions count word tokens across the spans of an item.
+    terms: dict[str, tuple[array, array]] = {}
+    last_pk, pos = None, 0
+    for item_pk, norm, s in db.execute(
+        "SELECT item_pk, norm, s FROM tokens WHERE type = 'word' ORDER BY item_pk, span, pos"
+    ):
+        if item_pk != last_pk:
+            last_pk, pos = item_pk, 0
+        term = fold(norm or s or '')
+        if term:
+            entry = terms.get(term)
+            if entry is None:
+                entry = terms[term] = (array('I'), array('I'))
+            entry[0].append(doc_of_pk[item_pk])
+            entry[1].append(pos)
+        pos += 1
+
+    out = Writer()
+    header = {
+        'version': INDEX_VERSION,
+        'docs': len(columns['unit']),
+        'units': units,
+        'kinds': kinds,
+        'subtypes': subtypes,
+        'columns': {name: out.put(col) for name, col in columns.items()},
+        'speakers': {key: [out.put(docs), len(docs)] for key, docs in sorted(speakers.items())},
+        'kind_docs': {key: [out.put(docs), len(docs)] for key, docs in sorted(by_kind.items())},
+        'stage_docs': {key: [out.put(sorted(docs)), len(docs)] for key, docs in sorted(stage.items())},
+        'terms': {},
+    }
+    for term in sorted(terms):
+        docs, positions = terms[term]
+        # Occurrences are in doc order but not position order (items span
+        # several rows); sort so each doc's positions are ascending.
+        pairs = sorted(zip(docs, positions))
+        distinct = array('I')
+        bounds = array('I')
+        for k, (doc, _) in enumerate(pairs):
+            if not distinct or distinct[-1] != doc:
+                distinct.append(doc)
+                bounds.append(k)
+        bounds.append(len(pairs))
+        header['terms'][term] = [out.put(distinct), len(distinct), out.put(bounds), out.put(p for _, p in pairs)]
+    return header, out.data
+
+
+def write_index(header: dict, data: array, path: Path = INDEX_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    head = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    head += b' ' * (-(len(MAGIC) + 4 + len(head)) % 4)
+    # Per-process temp name: the CLI, the daemon and watch mode may all
+    # rebuild the index at once.
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + len(head).to_bytes(4, 'little') + head)
+        data.tofile(f)
+    os.replace(tmp, path)
+
+
+def read_index(path: Path = INDEX_PATH) -> tuple[dict, memoryview] | None:
+    try:
+        blob = path.read_bytes()
+    except OSError:
+        return None
+    if blob[:4] != MAGIC:
+        return None
+    size = int.from_bytes(blob[4:8], 'little')
+    header = json.loads(blob[8:8 + size])
+    if header.get('version') != INDEX_VERSION:
+        return None
+    return header, memoryview(blob)[8 + size:].cast('I')
+
+
+class Index:
+    # Read-only view over one index file. Posting lists are zero-copy
+    # memoryview slices of the file buffer, sorted by doc id.
+
+    def __init__(self, header: dict, data: memoryview):
+        self.header = header
+        self.data = data
+        self.signature = header.get('signature')
+        self.docs = header['docs']
+        self.units = header['units']
+        self.kinds = {name: k for k, name in enumerate(header['kinds'])}
+        self.subtypes = {name: k for k, name in enumerate(header['subtypes'])}
+        n = self.docs
+        self.columns = {name: data[offset:offset + n] for name, offset in header['columns'].items()}
+
+    def _slice(self, entry: list | None) -> memoryview:
+        if entry is None:
+            return self.data[0:0]
+        offset, n = entry[0], entry[1]
+        return self.data[offset:offset + n]
+
+    def speaker(self, name: str) -> memoryview:
+        return self._slice(self.header['speakers'].get(name))
+
+    def kind_docs(self, key: str) -> memoryview:
+        return self._slice(self.header['kind_docs'].get(key))
+
+    def stage_docs(self, key: str) -> memoryview:
+        return self._slice(self.header['stage_docs'].get(key))
+
+    def term_docs(self, term: str) -> memoryview:
+        return self._slice(self.header['terms'].get(term))
+
+    def positions(self, term: str, k: int) -> memoryview:
+        # Positions of the term in its k-th doc.
+        _, _, bounds, positions = self.header['terms'][term]
+        return self.data[positions + self.data[bounds + k]:positions + self.data[bounds + k + 1]]
+
+
+# --- query model -----------------------------------------------------------
+
+class Clause(ABC):
+    # One predicate. `estimate` is the number of matching docs (exact for
+    # posting lists), `drive()` returns the sorted matching docs and
+    # `keep(docs)` filters a sorted candidate list.
+
+    negated = False
+    access = ''
+
+    def estimate(self, index: Index) -> int:
+        return index.docs
+
+    def drive_cost(self, index: Index) -> float:
+        return self.estimate(index)
+
+    def filter_cost(self, index: Index, candidates: int) -> float:
+        return candidates * COST_COLUMN
+
+    def drive(self, index: Index, db) -> list[int]:
+        return self.keep(index, db, range(index.docs))
+
+    @abstractmethod
+    def keep(self, index: Index, db, docs) -> list[int]:
+        ...
+
+    def label(self) -> str:
+        return ('-' if self.negated else '') + self.text
+
+
+def gallop(docs, postings) -> list[int]:
+    # Intersects a small sorted list with a large one: each probe doubles
+    # its step from the last match, then binary-searches the bracket.
+    out = []
+    n = len(postings)
+    lo = 0
+    for doc in docs:
+        step = 1
+        hi = lo
+        while hi < n and postings[hi] < doc:
+            lo = hi
+            hi += step
+            step <<= 1
+        lo = bisect_left(postings, doc, lo, min(hi + 1, n))
+        if lo == n:
+            break
+        if postings[lo] == doc:
+            out.append(doc)
+    return out
+
+
+def gallop_cost(candidates: int, postings: int) -> float:
+    if not candidates or not postings:
+        return 0.0
+    return candidates * (1 + math.log2(1 + postings / candidates))
+
+
+class PostingsClause(Clause):
+    def __init__(self, text: str):
+        self.text = text
+
+    @abstractmethod
+    def postings(self, index: Index):
+        ...
+
+    def estimate(self, index: Index) -> int:
+        return len(self.postings(index))
+
+    def filter_cost(self, index: Index, candidates: int) -> float:
+        return gallop_cost(candidates, self.estimate(index))
+
+    def drive(self, index: Index, db) -> list[int]:
+        return self.postings(index).tolist()
+
+    def keep(self, index: Index, db, docs) -> list[int]:
+        return gallop(docs, self.postings(index))
+
+
+class SpeakerClause(PostingsClause):
+    access = 'speaker index'
+
+    def __init__(self, text: str, name: str):
+        super().__init__(text)
+        self.name = re.sub(r'\s+', ' ', name.replace('_', ' ')).strip().upper()
+
+    def postings(self, index: Index):
+        return index.speaker(self.name)
+
+
+class TermClause(PostingsClause):
+    access = 'norm postings'
+
+    def __init__(self, text: str, term: str):
+        super().__init__(text)
+        self.term = term
+
+    def postings(self, index: Index):
+        return index.term_docs(self.term)
+
+
+class StageClause(PostingsClause):
+    access = 'stage index'
+
+    def __init__(self, text: str, key: str):
+        super().__init__(text)
+        self.key = key
+
+    def postings(self, index: Index):
+        return index.stage_docs(self.key)
+
+
+class KindClause(Clause):
+    # Posting lists drive; the kind/subtype columns filter.
+    access = 'kind index'
+
+    def __init__(self, text: str, kind: str | None, subtype: str | None):
+        self.text = text
+        self.kind = kind
+        self.subtype = subtype
+
+    def _lists(self, index: Index) -> list:
+        if self.kind is not None:
+            key = self.kind if self.subtype is None else f'{self.kind}/{self.subtype}'
+            return [index.kind_docs(key)]
+        return [index.kind_docs(f'{kind}/{self.subtype}') for kind in index.header['kinds'] if kind]
+
+    def estimate(self, index: Index) -> int:
+        return sum(len(docs) for docs in self._lists(index))
+
+    def drive(self, index: Index, db) -> list[int]:
+        lists = [docs for docs in self._lists(index) if len(docs)]
+        if len(lists) == 1:
+            return lists[0].tolist()
+        return sorted(doc for docs in lists for doc in docs)
+
+    def keep(self, index: Index, db, docs) -> list[int]:
+        kinds, subtypes = index.columns['kind'], index.columns['subtype']
+        kind = index.kinds.get(self.kind, -1) if self.kind is not None else None
+        subtype = index.subtypes.get(self.subtype, -1) if self.subtype is not None else None
+        return [doc for doc in docs
+                if (kind is None or kinds[doc] == kind) and (subtype is None or subtypes[doc] == subtype)]
+
+
+class UnitClause(Clause):
+    # play/act/scene/unit select whole units, i.e. contiguous doc ranges.
+    access = 'unit catalog'
+
+    def __init__(self, text: str, field: str, value: str):
+        self.text = text
+        self.field = field
+        self.value = value
+
+    def _match(self, unit: list) -> bool:
+        path, play, uid, act, scene = unit[:5]
+        if self.field == 'play':
+            return play == self.value
+        if self.field == 'unit':
+            return uid == self.value or path == self.value
+        number = act if self.field == 'act' else scene
+        return number is not None and str(number) == self.value
+
+    def unit_ids(self, index: Index) -> list[int]:
+        return [k for k, unit in enumerate(index.units) if self._match(unit)]
+
+    def estimate(self, index: Index) -> int:
+        return sum(index.units[k][6] - index.units[k][5] for k in self.unit_ids(index))
+
+    def drive(self, index: Index, db) -> list[int]:
+        docs = []
+        for k in self.unit_ids(index):
+            docs.extend(range(index.units[k][5], index.units[k][6]))
+        return docs
+
+    def keep(self, index: Index, db, docs) -> list[int]:
+        wanted = set(self.unit_ids(index))
+        units = index.columns['unit']
+        return [doc for doc in docs if units[doc] in wanted]
+
+
+class LineClause(Clause):
+    access = 'line column'
+
+    def __init__(self, text: str, value: str):
+        self.text = text
+        m = re.fullmatch(r'(\d+)(?:-(\d+))?', value)
+        if not m:
+            raise QueryError(f'line: expects N or N-M, got {value!r}')
+        self.low = int(m.group(1))
+        self.high = int(m.group(2) or m.group(1))
+
+    def drive_cost(self, index: Index) -> float:
+        return index.docs * COST_COLUMN
+
+    def keep(self, index: Index, db, docs) -> list[int]:
+        lines = index.columns['line']
+        low, high = self.low, self.high
+        return [doc for doc in docs if low <= lines[doc] <= high]
+
+
+class PhraseClause(Clause):
+    # Drives from the rarest term, gallops into the others, then checks
+    # positions: each term must follow the previous within `slop` words.
+    access = 'norm postings + positions'
+
+    def __init__(self, text: str, terms: list[str], slop: int):
+        self.text = text
+        self.terms = terms
+        self.slop = slop
+
+    def _ordered(self, index: Index) -> list[str]:
+        return sorted(set(self.terms), key=lambda term: len(index.term_docs(term)))
+
+    def estimate(self, index: Index) -> int:
+        return min(len(index.term_docs(term)) for term in self.terms)
+
+    def drive_cost(self, index: Index) -> float:
+        ordered = self._ordered(index)
+        first = len(index.term_docs(ordered[0]))
+        return first + sum(gallop_cost(first, len(index.term_docs(t))) for t in ordered[1:]) + first * COST_PHRASE
+
+    def filter_cost(self, index: Index, candidates: int) -> float:
+        return sum(gallop_cost(candidates, len(index.term_docs(t))) for t in self.terms) + candidates * COST_PHRASE
+
+    def drive(self, index: Index, db) -> list[int]:
+        ordered = self._ordered(index)
+        return self.keep(index, db, index.term_docs(ordered[0]).tolist())
+
+    def keep(self, index: Index, db, docs) -> list[int]:
+        for term in self._ordered(index):
+            docs = gallop(docs, index.term_docs(term))
+            if not docs:
+                return []
+        return [doc for doc in docs if self._matches(index, doc)]
+
+    def _matches(self, index: Index, doc: int) -> bool:
+        found = []
+        for term in self.terms:
+            postings = index.term_docs(term)
+            found.append(index.positions(term, bisect_left(postings, doc)))
+        reach = self.slop + 1
+
+        def extend(k: int, after: int) -> bool:
+            if k == len(found):
+                return True
+            positions = found[k]
+            i = bisect_left(positions, after + 1)
+            while i < len(positions) and positions[i] <= after + reach:
+                if extend(k + 1, positions[i]):
+                    return True
+                i += 1
+            return False
+
+        return any(extend(1, start) for start in found[0])
+
+
+class TextClause(Clause):
+    # Substring of the item text: no index covers it, so it reads text from
+    # the database for the candidates, or for every item when it has to drive.
+    access = 'text scan'
+
+    def __init__(self, text: str, needle: str):
+        self.text = text
+        self.needle = fold(needle)
+
+    def drive_cost(self, index: Index) -> float:
+        return index.docs * COST_TEXT
+
+    def filter_cost(self, index: Index, candidates: int) -> float:
+        return candidates * COST_TEXT
+
+    def drive(self, index: Index, db) -> list[int]:
+        pks = index.columns['item_pk']
+        doc_of = {pk: doc for doc, pk in enumerate(pks)}
+        docs = [doc_of[pk] for pk, text in db.execute('SELECT item_pk, text FROM items') if self.needle in fold(text or '')]
+        return sorted(docs)
+
+    def keep(self, index: Index, db, docs) -> list[int]:
+        pks = index.columns['item_pk']
+        hits = set()
+        docs = list(docs)
+        for start in range(0, len(docs), TEXT_BATCH):
+            batch = {pks[doc]: doc for doc in docs[start:start + TEXT_BATCH]}
+            marks = ','.join('?' * len(batch))
+            for pk, text in db.execute(f'SELECT item_pk, text FROM items WHERE item_pk IN ({marks})', list(batch)):
+                if self.needle in fold(text or ''):
+                    hits.add(batch[pk])
+        return [doc for doc in docs if doc in hits]
+
+
+def words(text: str) -> list[str]:
+    return [w for w in (part.strip("-") for part in re.split(r"[^\w'’-]+", fold(text))) if w]
+
+
+def parse(query: str) -> list[Clause]:
+    clauses: list[Clause] = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        m = CLAUSE_RE.match(query, pos)
+        if not m or not m.group(0):
+            raise QueryError(f'cannot parse query at {query[pos:]!r}')
+        pos = m.end()
+        while pos < len(query) and query[pos].isspace():
+            pos += 1
+        negated, field, quoted, slop, bare = m.groups()
+        value = quoted if quoted is not None else bare
+        text = m.group(0).lstrip('-')
+        field = field or ('word' if quoted is None else None)
+        if field is not None and field not in FIELDS:
+            raise QueryError(f'unknown field {field!r} (known: {", ".join(sorted(FIELDS))})')
+        if field is None or field == 'word':
+            terms = words(value)
+            if not terms:
+                continue
+            if len(terms) == 1 and slop is None:
+                clause = TermClause(text, terms[0])
+            else:
+                clause = PhraseClause(text, terms, int(slop or 0))
+        elif field in UNIT_FIELDS:
+            clause = UnitClause(text, field, value if field in ('unit', 'act', 'scene') else value.lower())
+        elif field == 'speaker':
+            clause = SpeakerClause(text, value)
+        elif field == 'kind':
+            clause = KindClause(text, value.lower(), None)
+        elif field == 'subtype':
+            clause = KindClause(text, None, value.lower())
+        elif field == 'stage':
+            clause = StageClause(text, fold(value))
+        elif field in KINDS:
+            clause = KindClause(text, field, value.lower())
+        elif field == 'line':
+            clause = LineClause(text, value)
+        else:
+            clause = TextClause(text, value)
+        clause.negated = bool(negated)
+        clauses.append(clause)
+    if not clauses:
+        raise QueryError('empty query')
+    return clauses
+
+
+class Plan:
+    # The positive clause with the cheapest way to produce its docs drives;
+    # the rest filter its candidates, most selective (per unit of cost)
+    # first, and exclusions run last. With no positive clause every doc is a
+    # candidate, which is the full scan the planner otherwise avoids.
+
+    def __init__(self, index: Index, clauses: list[Clause]):
+        self.index = index
+        positive = [c for c in clauses if not c.negated]
+        negative = [c for c in clauses if c.negated]
+        self.driver = min(positive, key=lambda c: c.drive_cost(index)) if positive else None
+        rest = [c for c in positive if c is not self.driver]
+        self.steps: list[Clause] = []
+        candidates = self.driver.estimate(index) if self.driver else index.docs
+        while rest:
+            best = min(rest, key=lambda c: (c.filter_cost(index, candidates), c.estimate(index)))
+            rest.remove(best)
+            self.steps.append(best)
+            candidates = candidates * best.estimate(index) // max(index.docs, 1)
+        self.steps.extend(sorted(negative, key=lambda c: c.filter_cost(index, candidates)))
+        self.timings: list[tuple[str, str, int, int, float]] = []
+
+    def run(self, db) -> list[int]:
+        index = self.index
+        start = time.perf_counter()
+        if self.driver is None:
+            docs = list(range(index.docs))
+            self.timings.append(('scan', 'all items', index.docs, index.docs, time.perf_counter() - start))
+        else:
+            docs = self.driver.drive(index, db)
+            self.timings.append(('drive', self.driver.label(), self.driver.estimate(index), len(docs), time.perf_counter() - start))
+        for clause in self.steps:
+            start = time.perf_counter()
+            if not docs:
+                self.timings.append(('skip', clause.label(), clause.estimate(index), 0, 0.0))
+                continue
+            if clause.negated:
+                drop = set(clause.keep(index, db, docs))
+                docs = [doc for doc in docs if doc not in drop]
+                step = 'exclude'
+            else:
+                docs = clause.keep(index, db, docs)
+                step = 'filter'
+            self.timings.append((step, clause.label(), clause.estimate(index), len(docs), time.perf_counter() - start))
+        return docs
+
+    def explain(self) -> str:
+        clauses = {c.label(): c for c in ([self.driver] if self.driver else []) + self.steps}
+        lines = ['step     clause                          access                     est       rows      ms']
+        for step, label, estimate, rows, seconds in self.timings:
+            access = clauses[label].access if label in clauses else 'full scan'
+            lines.append(f'{step:<8} {label[:31]:<31} {access:<26} {estimate:>8} {rows:>9} {seconds * 1000:7.2f}')
+        return '\n'.join(lines)
+
+
+_loaded: dict[str, Index] = {}
+
+
+def load_index(db: sqlite3.Connection, path: Path = INDEX_PATH, rebuild: bool = False) -> Index:
+    # Rebuilt (from the database) only when the corpus changed; a
+    # long-running process keeps the last index in memory.
+    signature = corpus_signature(db)
+    cached = _loaded.get(str(path))
+    if cached is not None and cached.signature == signature and not rebuild:
+        return cached
+    stored = None if rebuild else read_index(path)
+    if stored is None or stored[0].get('signature') != signature:
+        header, data = build_index(db)
+        header['signature'] = signature
+        write_index(header, data, path)
+        stored = read_index(path)
+    index = _loaded[str(path)] = Index(*stored)
+    return index
+
+
+def search(db: sqlite3.Connection, query: str, index: Index | None = None) -> tuple[list[int], Plan]:
+    index = index or load_index(db)
+    plan = Plan(index, parse(query))
+    return plan.run(db), plan
+
+
+def result_rows(db: sqlite3.Connection, index: Index, docs: list[int]) -> list[tuple]:
+    pks = index.columns['item_pk']
+    rows = {}
+    for start in range(0, len(docs), TEXT_BATCH):
+        batch = [pks[doc] for doc in docs[start:start + TEXT_BATCH]]
+        marks = ','.join('?' * len(batch))
+        for row in db.execute(
+            'SELECT i.item_pk, u.path, i.line_number, i.speaker, i.text FROM items i '
+            f'JOIN units u ON u.unit_pk = i.unit_pk WHERE i.item_pk IN ({marks})',
+            batch,
+        ):
+            rows[row[0]] = row[1:]
+    return [rows[pks[doc]] for doc in docs]
+
+
+def main(argv: list[str] | None = None) -> int:
+    from export_sqlite import DB_PATH
+
+    parser = argparse.ArgumentParser(description='Structured queries over the SQLite export (see CLAUSE_RE for the syntax).')
+    parser.add_argument('query', nargs='?', help='omit to only bring the query index up to date')
+    parser.add_argument('--db', type=Path, default=DB_PATH)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--count', action='store_true')
+    parser.add_argument('--explain', action='store_true', help='run the query and print its plan with estimated and actual rows')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the query index')
+    args = parser.parse_args(argv)
+
+    if not args.db.exists():
+        raise SystemExit(f'{args.db} does not exist; run scripts/export_sqlite.py first')
+    db = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+    index = load_index(db, rebuild=args.rebuild)
+    if args.query is None:
+        return 0
+    try:
+        docs, plan = search(db, args.query, index)
+    except QueryError as exc:
+        raise SystemExit(f'query: {exc}')
+    if args.explain:
+        print(plan.explain())
+    elif args.count:
+        print(len(docs))
+    else:
+        for path, line, speaker, text in result_rows(db, index, docs[:args.limit]):
+            print(f'{path}\t{"" if line is None else line}\t{speaker or ""}\t{(text or "").strip()}')
+    return 0 if docs else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import argparse
+import re
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+from xml.sax.saxutils import escape, quoteattr
+
+from corpus import DERIVED, ROOT, is_index, iter_unit_paths, rel_path, span_text, split_speaker
+from lazy_unit import Unit, load_lazy
+
+
+OUT_DIR = DERIVED / 'render'
+LINE_BREAK = re.compile(r'\r?\n')
+TEI_NS = 'http://www.tei-c.org/ns/1.0'
+TEI_SPOOL = 8 << 20   # bytes of TEI body kept in memory before spilling to disk
+
+# Stage subtypes mapped onto TEI's suggested <stage type> values.
+STAGE_TYPES = {
+    'enter': 'entrance',
+    'exit': 'exit',
+    'exeunt': 'exit',
+    'aside': 'delivery',
+    'within': 'location',
+    'above': 'location',
+    'kneels': 'business',
+    'sound': 'sound',
+    'music': 'music',
+}
+
+
+def display(text: str) -> str:
+    return text.replace('\u00a0', ' ')
+
+
+def speaker_name(value: str | None) -> str:
+    return display((value or '').replace('_', ' ')).strip()
+
+
+def item_lines(item) -> list[str]:
+    return LINE_BREAK.split(''.join(span_text(span) for span in item.get('spans') or []))
+
+
+def unit_blocks(unit: Unit) -> Iterator[tuple]:
+    # The display rules of viewer/copy-text.js (createItemsCopier), as blocks:
+    #   ('heading', subtype, text)
+    #   ('stage', subtype, lines)
+    #   ('speech', speaker, [(line_number, text, line_serial), ...])
+    #   ('other', kind, lines)
+    # A speaker_label names the next speech; consecutive speech items with the
+    # same speech_id form one speech.
+    speech = None
+    pending_speaker = None
+    for item in unit.items:
+        kind = item.get('kind')
+        if kind == 'speech':
+            if speech is None or item.get('speech_id') != speech[0]:
+                if speech is not None:
+                    yield speech[1]
+                block = ('speech', speaker_name(pending_speaker or item.get('speaker')), [])
+                speech = (item.get('speech_id'), block)
+                pending_speaker = None
+            number = item.get('line_number')
+            body = display(''.join(span_text(span) for span in item.get('spans') or [])).rstrip(' \t')
+            if number is not None:
+                body = body.lstrip()
+            speech[1][2].append((number, body, item.get('line_serial')))
+            for span in item.spans:
+                span.release()
+            continue
+        if speech is not None:
+            yield speech[1]
+            speech = None
+        if kind == 'speaker_label':
+            pending_speaker = speaker_name(item.get('speaker'))
+        elif kind == 'stage':
+            yield ('stage', item.get('subtype'), item_lines(item))
+        elif kind == 'heading':
+            yield ('heading', item.get('subtype'), display(item.text))
+        else:
+            yield ('other', kind, item_lines(item))
+    if speech is not None:
+        yield speech[1]
+
+
+class TextRenderer:
+    # Same text as the viewer's "copy" button: blocks separated by a blank
+    # line, speeches as the speaker's name followed by numbered lines.
+    suffix = '.txt'
+
+    def __init__(self, out):
+        self.out = out
+        self.started = False
+
+    def begin(self, meta: dict) -> None:
+        pass
+
+    def block_lines(self, block: tuple) -> list[str]:
+        kind, label, body = block
+        if kind == 'heading':
+            return [body]
+        if kind == 'speech':
+            lines = [label] if label else []
+            return lines + [f'{number} {text}' if number is not None else text for number, text, _ in body]
+        return body
+
+    def write_block(self, lines: list[str]) -> None:
+        lines = [display(line).rstrip(' \t') for line in lines]
+        while lines and not lines[0].strip():
+            lines.pop(0)
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if not lines:
+            return
+        if self.started:
+            self.out.write('\n')
+        self.out.write('\n'.join(lines) + '\n')
+        self.started = True
+
+    def unit(self, unit: Unit, blocks: list[tuple]) -> None:
+        for block in blocks:
+            self.write_block(self.block_lines(block))
+
+    def end(self) -> None:
+        pass
+
+
+MD_SPECIAL = re.compile(r'([\\`*_\[\]<>|])')
+MD_LEADING = re.compile(r'^(\s*)([#+-]|\d+[.)])')
+
+
+def md_escape(text: str) -> str:
+    return MD_LEADING.sub(lambda m: m.group(1) + '\\' + m.group(2), MD_SPECIAL.sub(r'\\\1', text))
+
+
+class MarkdownRenderer(TextRenderer):
+    suffix = '.md'
+    HEADINGS = {'act': '##', 'scene': '###'}
+
+    def begin(self, meta: dict) -> None:
+        self.write_block([f'# {md_escape((meta.get("play") or {}).get("title") or "")}'])
+
+    def block_lines(self, block: tuple) -> list[str]:
+        kind, label, body = block
+        if kind == 'heading':
+            return [f'{self.HEADINGS.get(label, "####")} {md_escape(body.strip())}']
+        if kind == 'stage':
+            text = ' '.join(line.strip() for line in body if line.strip())
+            return [f'*{md_escape(text)}*'] if text else []
+        if kind == 'speech':
+            lines = [md_escape(text) for _, text, _ in body if text.strip()]
+            if label:
+                lines.insert(0, f'**{md_escape(label)}**')
+            # A trailing backslash is a hard line break in CommonMark.
+            return [line + '\\' for line in lines[:-1]] + lines[-1:]
+        return [md_escape(line) for line in body]
+
+
+def tei_id(name: str) -> str:
+    ident = re.sub(r'[^\w-]+', '-', name.lower()).strip('-')
+    # xml:id must be an NCName, which cannot start with a digit or hyphen.
+    return ident if re.match(r'[^\W\d]', ident) else f'person-{ident}'
+
+
+class TeiRenderer:
+    # The <sp who> references need a <listPerson> in the header, but the
+    # speakers are only known once the play has been read. The body is
+    # spooled (to disk past TEI_SPOOL bytes) and the header written last.
+    suffix = '.xml'
+
+    def __init__(self, out):
+        self.final = out
+        self.out = tempfile.SpooledTemporaryFile(max_size=TEI_SPOOL, mode='w+', encoding='utf-8')
+        self.act = None
+        self.meta: dict = {}
+        self.seen_ids: set[str] = set()
+        self.people: dict[str, str] = {}
+
+    def write(self, depth: int, text: str, out=None) -> None:
+        (out or self.out).write('  ' * depth + text + '\n')
+
+    def begin(self, meta: dict) -> None:
+        self.meta = meta
+
+    def person(self, name: str) -> str:
+        if name not in self.people:
+            ident = tei_id(name)
+            while ident in self.seen_ids:
+                ident += '-person'
+            self.seen_ids.add(ident)
+            self.people[name] = ident
+        return self.people[name]
+
+    def header(self) -> None:
+        play = self.meta.get('play') or {}
+        source = (self.meta.get('source') or {}).get('edition') or ''
+        out = self.final
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.write(0, f'<TEI xmlns="{TEI_NS}">', out)
+        self.write(1, '<teiHeader>', out)
+        self.write(2, '<fileDesc>', out)
+        self.write(3, '<titleStmt>', out)
+        self.write(4, f'<title>{escape(play.get("title") or "")}</title>', out)
+        for author in play.get('authors') or []:
+            self.write(4, f'<author>{escape(author)}</author>', out)
+        self.write(3, '</titleStmt>', out)
+        self.write(3, '<publicationStmt><p>Generated from shakespeare-json.</p></publicationStmt>', out)
+        self.write(3, f'<sourceDesc><p>{escape(source)}</p></sourceDesc>', out)
+        self.write(2, '</fileDesc>', out)
+        if self.people:
+            self.write(2, '<profileDesc>', out)
+            self.write(3, '<particDesc>', out)
+            self.write(4, '<listPerson>', out)
+            for name, ident in self.people.items():
+                self.write(5, f'<person xml:id={quoteattr(ident)}><persName>{escape(name)}</persName></person>', out)
+            self.write(4, '</listPerson>', out)
+            self.write(3, '</particDesc>', out)
+            self.write(2, '</profileDesc>', out)
+        self.write(1, '</teiHeader>', out)
+        self.write(1, '<text>', out)
+        self.write(2, '<body>', out)
+
+    def close_act(self) -> None:
+        if self.act is not None:
+            self.write(3, '</div>')
+            self.act = None
+
+    def line(self, depth: int, number, text: str, serial: str | None) -> None:
+        attrs = f' n="{number}"' if number is not None else ''
+        if serial and serial not in self.seen_ids:
+            self.seen_ids.add(serial)
+            attrs += f' xml:id={quoteattr(serial)}'
+        self.write(depth, f'<l{attrs}>{escape(text)}</l>')
+
+    def unit(self, unit: Unit, blocks: list[tuple]) -> None:
+        info = unit.meta['unit']
+        act = info.get('act')
+        if act != self.act:
+            self.close_act()
+            if act is not None:
+                self.write(3, f'<div type="act" n="{act}">')
+                self.act = act
+        depth = 4 if self.act is not None else 3
+        attrs = f'type={quoteattr(info.get("type") or "unit")}'
+        if info.get('scene') is not None:
+            attrs += f' n="{info["scene"]}"'
+        if info.get('unit_id') and info['unit_id'] not in self.seen_ids:
+            self.seen_ids.add(info['unit_id'])
+            attrs += f' xml:id={quoteattr(info["unit_id"])}'
+        self.write(depth, f'<div {attrs}>')
+        in_cast = False
+        for kind, label, body in blocks:
+            if in_cast and kind != 'other':
+                self.write(depth + 1, '</castList>')
+                in_cast = False
+            if kind == 'heading':
+                # The act heading sits in the act's first scene file; the
+                # per-unit div keeps it with that scene.
+                head_type = '' if label in ('act', 'scene') else f' type={quoteattr(label or "sub")}'
+                self.write(depth + 1, f'<head{head_type}>{escape(body.strip())}</head>')
+            elif kind == 'stage':
+                text = ' '.join(line.strip() for line in body if line.strip())
+                stage_type = STAGE_TYPES.get(label, label)
+                self.write(depth + 1, f'<stage{f" type={quoteattr(stage_type)}" if stage_type else ""}>{escape(text)}</stage>')
+            elif kind == 'speech':
+                who = ' '.join(f'#{self.person(name)}' for name in split_speaker(label))
+                self.write(depth + 1, f'<sp{f" who={quoteattr(who)}" if who else ""}>')
+                if label:
+                    self.write(depth + 2, f'<speaker>{escape(label)}</speaker>')
+                for number, text, serial in body:
+                    self.line(depth + 2, number, text, serial)
+                self.write(depth + 1, '</sp>')
+            else:
+                lines = [line.strip() for line in body if line.strip()]
+                if not lines:
+                    continue
+                if label == 'cast_entry':
+                    if not in_cast:
+                        self.write(depth + 1, '<castList>')
+                        in_cast = True
+                    self.write(depth + 2, f'<castItem>{escape(" ".join(lines))}</castItem>')
+                else:
+                    self.write(depth + 1, f'<p>{escape(" ".join(lines))}</p>')
+        if in_cast:
+            self.write(depth + 1, '</castList>')
+        self.write(depth, '</div>')
+
+    def end(self) -> None:
+        self.close_act()
+        self.header()
+        self.out.seek(0)
+        shutil.copyfileobj(self.out, self.final)
+        self.out.close()
+        self.write(2, '</body>', self.final)
+        self.write(1, '</text>', self.final)
+        self.write(0, '</TEI>', self.final)
+
+
+RENDERERS = {'txt': TextRenderer, 'md': MarkdownRenderer, 'tei': TeiRenderer}
+
+
+def render_units(paths: list[Path], renderers: list) -> int:
+    # One pass over the units feeds every renderer; each unit's blocks are
+    # dropped before the next file is read, so memory stays at one unit.
+    count = 0
+    for path in paths:
+        unit = load_lazy(path)
+        if unit is None or is_index(unit):
+            continue
+        if count == 0:
+            for renderer in renderers:
+                renderer.begin(unit.meta)
+        blocks = list(unit_blocks(unit))
+        for renderer in renderers:
+            renderer.unit(unit, blocks)
+        count += 1
+    if count:
+        for renderer in renderers:
+            renderer.end()
+    return count
+
+
+def render_play(job: tuple[str, list[str], str, list[str]]) -> tuple[str, int]:
+    play, paths, out_str, formats = job
+    out = Path(out_str) / play
+    out.mkdir(parents=True, exist_ok=True)
+    files = [open(out / f'{play}{RENDERERS[fmt].suffix}', 'w', encoding='utf-8') for fmt in formats]
+    try:
+        count = render_units([Path(p) for p in paths], [RENDERERS[fmt](f) for fmt, f in zip(formats, files)])
+    finally:
+        for f in files:
+            f.close()
+    return play, count
+
+
+def play_paths(root: Path = ROOT, plays: set[str] | None = None) -> dict[str, list[str]]:
+    grouped: dict[str, list[str]] = defaultdict(list)
+    for path in iter_unit_paths(root):
+        play = Path(rel_path(path, root)).parts[0]
+        if not plays or play in plays:
+            grouped[play].append(str(path))
+    return dict(sorted(grouped.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Render plays as plain text, TEI XML or Markdown.')
+    parser.add_argument('--play', action='append', help='play directory to render (repeatable; default: all)')
+    parser.add_argument('--format', action='append', choices=sorted(RENDERERS), help='repeatable; default: all')
+    parser.add_argument('--out', type=Path, default=OUT_DIR)
+    parser.add_argument('--stdout', action='store_true', help='write a single play and format to stdout')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    formats = args.format or sorted(RENDERERS)
+    groups = play_paths(plays=set(args.play or ()))
+    if args.play and len(groups) != len(set(args.play)):
+        parser.error(f'unknown play: {", ".join(sorted(set(args.play) - set(groups)))}')
+    if args.stdout:
+        if len(groups) != 1 or len(formats) != 1:
+            parser.error('--stdout needs exactly one --play and one --format')
+        (paths,) = groups.values()
+        render_units([Path(p) for p in paths], [RENDERERS[formats[0]](sys.stdout)])
+        return
+
+    jobs = [(play, paths, str(args.out), formats) for play, paths in groups.items()]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for play, count in pool.map(render_play, jobs):
+            print(f'{play}: {count} units')
+    print(f'Rendered {len(jobs)} plays as {", ".join(formats)} into {args.out}')
+
+
+if __name__ == '__main__':
+    main()
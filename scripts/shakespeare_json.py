@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import os
+import sys
+
+# Nothing heavy is imported up front (not even pathlib): argparse, sqlite3
+# and the export modules are imported by the code paths that need them, so
+# a query handed to the daemon only pays for interpreter startup and socket.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DERIVED = os.path.join(ROOT, 'derived')
+DB_PATH = os.path.join(DERIVED, 'corpus.sqlite')
+SOCKET_PATH = os.environ.get('SHAKESPEARE_JSON_SOCKET', os.path.join(DERIVED, 'shakespeare-json.sock'))
+DAEMON_COMMANDS = {'search', 'query', 'kwic', 'stats', 'resolve-serial'}
+
+
+class CommandError(Exception):
+    pass
+
+
+def open_db(db_path: str = DB_PATH):
+    import sqlite3
+
+    if not os.path.exists(db_path):
+        raise CommandError(f'{db_path} does not exist; run `shakespeare-json export sqlite` first')
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+    conn.execute('PRAGMA query_only=ON')
+    conn.execute('PRAGMA mmap_size=1073741824')
+    return conn
+
+
+def play_filter(args, column: str = 'u.play_id') -> tuple[str, list]:
+    if not args.play:
+        return '', []
+    return f' AND {column} IN ({",".join("?" * len(args.play))})', list(args.play)
+
+
+def cmd_search(db, args, out) -> int:
+    where, params = play_filter(args)
+    if args.count:
+        (count,) = db.execute(
+            'SELECT COUNT(*) FROM lines_fts f JOIN items i ON i.item_pk = f.rowid JOIN units u ON u.unit_pk = i.unit_pk '
+            f'WHERE lines_fts MATCH ?{where}',
+            [args.query, *params],
+        ).fetchone()
+        print(count, file=out)
+        return 0 if count else 1
+    order = 'rank' if args.rank else 'u.path, i.seq'
+    rows = db.execute(
+        'SELECT u.path, i.line_number, i.speaker, i.text FROM lines_fts f '
+        'JOIN items i ON i.item_pk = f.rowid JOIN units u ON u.unit_pk = i.unit_pk '
+        f'WHERE lines_fts MATCH ?{where} ORDER BY {order} LIMIT ?',
+        [args.query, *params, args.limit],
+    )
+    count = 0
+    for path, line, speaker, text in rows:
+        count += 1
+        print(f'{path}\t{"" if line is None else line}\t{speaker or ""}\t{text.strip()}', file=out)
+    return 0 if count else 1
+
+
+def cmd_query(db, args, out) -> int:
+    # The postings index is loaded once per process, so the daemon answers
+    # from memory; it is rebuilt when the exported corpus changes.
+    sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+    import query
+
+    try:
+        index = query.load_index(db)
+        docs, plan = query.search(db, args.query, index)
+    except query.QueryError as exc:
+        raise CommandError(str(exc))
+    if args.explain:
+        print(plan.explain(), file=out)
+    elif args.count:
+        print(len(docs), file=out)
+    else:
+        for path, line, speaker, text in query.result_rows(db, index, docs[:args.limit]):
+            print(f'{path}\t{"" if line is None else line}\t{speaker or ""}\t{(text or "").strip()}', file=out)
+    return 0 if docs else 1
+
+
+def cmd_kwic(db, args, out) -> int:
+    where, params = play_filter(args)
+    hits = db.execute(
+        'SELECT t.item_pk, t.span, t.pos, u.path, i.line_number FROM tokens t '
+        'JOIN items i ON i.item_pk = t.item_pk JOIN units u ON u.unit_pk = i.unit_pk '
+        f'WHERE t.norm = ?{where} ORDER BY u.path, i.seq, t.span, t.pos LIMIT ?',
+        [args.word.lower(), *params, args.limit],
+    ).fetchall()
+    width = args.width
+    for item_pk, span, pos, path, line in hits:
+        tokens = db.execute(
+            'SELECT span, pos, pre, s FROM tokens WHERE item_pk = ? ORDER BY span, pos', (item_pk,)
+        ).fetchall()
+        at = next(k for k, tok in enumerate(tokens) if tok[0] == span and tok[1] == pos)
+        left = ''.join(pre + s for _, _, pre, s in tokens[:at])
+        right = ''.join(pre + s for _, _, pre, s in tokens[at + 1:])
+        left = (left + tokens[at][2])[-width:]
+        where = f'{path}:{"" if line is None else line}'
+        print(f'{where}\t{left:>{width}}[{tokens[at][3]}]{right[:width]}', file=out)
+    return 0 if hits else 1
+
+
+def cmd_stats(db, args, out) -> int:
+    if args.play and len(args.play) == 1:
+        rows = db.execute(
+            "SELECT i.speaker, COUNT(DISTINCT i.speech_id), COUNT(*) FROM items i JOIN units u ON u.unit_pk = i.unit_pk "
+            "WHERE u.play_id = ? AND i.kind = 'speech' AND i.line_number IS NOT NULL "
+            'GROUP BY i.speaker ORDER BY 3 DESC, 1',
+            (args.play[0],),
+        ).fetchall()
+        print('speaker\tspeeches\tlines', file=out)
+        for speaker, speeches, lines in rows:
+            print(f'{speaker}\t{speeches}\t{lines}', file=out)
+        return 0 if rows else 1
+    where, params = play_filter(args, 'play_id')
+    rows = db.execute(
+        f'SELECT play_id, COUNT(*), SUM(n_items), SUM(n_lines), SUM(n_tokens) FROM units WHERE 1 = 1{where} '
+        'GROUP BY play_id ORDER BY play_id',
+        params,
+    ).fetchall()
+    print('play\tunits\titems\tlines\ttokens', file=out)
+    for row in rows:
+        print('\t'.join(str(v) for v in row), file=out)
+    if len(rows) > 1:
+        print('\t'.join(['total'] + [str(sum(r[k] for r in rows)) for k in range(1, 5)]), file=out)
+    return 0 if rows else 1
+
+
+def cmd_resolve_serial(db, args, out) -> int:
+    # Non-zero if any serial is not found, so scripts notice a partial miss.
+    status = 0
+    for serial in args.serial:
+        row = db.execute(
+            'SELECT u.path, i.line_number, i.speaker, i.text, NULL FROM items i JOIN units u ON u.unit_pk = i.unit_pk '
+            'WHERE i.serial = ? OR i.line_serial = ? LIMIT 1',
+            (serial, serial),
+        ).fetchone()
+        if row is None:
+            row = db.execute(
+                'SELECT u.path, i.line_number, i.speaker, i.text, t.s FROM tokens t '
+                'JOIN items i ON i.item_pk = t.item_pk JOIN units u ON u.unit_pk = i.unit_pk WHERE t.serial = ? LIMIT 1',
+                (serial,),
+            ).fetchone()
+        if row is None:
+            row = db.execute(
+                'SELECT u.path, i.line_number, i.speaker, i.text, NULL FROM items i JOIN units u ON u.unit_pk = i.unit_pk '
+                'WHERE i.speech_id = ? ORDER BY i.seq LIMIT 1',
+                (serial,),
+            ).fetchone()
+        if row is None:
+            print(f'{serial}\tnot found', file=out)
+            status = 1
+            continue
+        path, line, speaker, text, token = row
+        fields = [serial, path, '' if line is None else str(line), speaker or '', text.strip()]
+        if token is not None:
+            fields.append(token)
+        print('\t'.join(fields), file=out)
+    return status
+
+
+def cmd_validate(args, out) -> int:
+    sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+    import validate_corpus
+
+    argv = [str(p) for p in args.paths] + (['--quiet'] if args.quiet else []) + (['--strict'] if args.strict else [])
+    return validate_corpus.main(argv)
+
+
+def cmd_export(args, out) -> int:
+    sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+    if args.format == 'sqlite':
+        import export_sqlite
+
+        if args.rebuild:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(DB_PATH + suffix):
+                    os.remove(DB_PATH + suffix)
+        count = export_sqlite.refresh(export_sqlite.DB_PATH, workers=args.workers)
+        print(f'Refreshed {count} units in {DB_PATH}', file=out)
+    else:
+        import export_parquet
+
+        results = export_parquet.export(workers=args.workers)
+        print(f'Wrote {len(results)} plays to {export_parquet.OUT_DIR}', file=out)
+    return 0
+
+
+def build_parser():
+    import argparse
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(prog='shakespeare-json', description='Query and maintain the Shakespeare JSON corpus.')
+    parser.add_argument('--no-daemon', action='store_true', help='never hand the query to a running daemon')
+    parser.add_argument('--socket', default=SOCKET_PATH,
+                        help='daemon socket for serve and for clients (default: $SHAKESPEARE_JSON_SOCKET or derived/)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('search', help='full-text search over lines (FTS5 syntax)')
+    p.add_argument('query')
+    p.add_argument('--play', action='append')
+    p.add_argument('--limit', type=int, default=1000)
+    p.add_argument('--rank', action='store_true', help='order by relevance instead of corpus order')
+    p.add_argument('--count', action='store_true', help='only print the number of matching lines (ignores --limit)')
+
+    p = sub.add_parser('query', help='structured query, e.g. play:hamlet speaker:HAMLET "mortal coil"~3 -stage:aside')
+    p.add_argument('query')
+    p.add_argument('--limit', type=int, default=1000)
+    p.add_argument('--count', action='store_true', help='only print the number of matching items (ignores --limit)')
+    p.add_argument('--explain', action='store_true', help='run the query and print its plan with estimated and actual rows')
+
+    p = sub.add_parser('kwic', help='keyword in context for a token norm')
+    p.add_argument('word')
+    p.add_argument('--play', action='append')
+    p.add_argument('--limit', type=int, default=1000)
+    p.add_argument('--width', type=int, default=40)
+
+    p = sub.add_parser('stats', help='per-play counts, or per-speaker counts for one play')
+    p.add_argument('--play', action='append')
+
+    p = sub.add_parser('resolve-serial', help='find the unit, line and text for item, line, speech or token serials')
+    p.add_argument('serial', nargs='+')
+
+    p = sub.add_parser('validate', help='check unit files for structural problems')
+    p.add_argument('paths', nargs='*', type=Path)
+    p.add_argument('--quiet', action='store_true')
+    p.add_argument('--strict', action='store_true')
+
+    p = sub.add_parser('export', help='refresh the SQLite database or write Parquet')
+    p.add_argument('format', choices=('sqlite', 'parquet'))
+    p.add_argument('--rebuild', action='store_true')
+    p.add_argument('--workers', type=int, default=None)
+
+    p = sub.add_parser('serve', help='keep the database open and answer queries over a Unix socket')
+    # Also accepted after `serve`; it sets the same option as the global --socket.
+    p.add_argument('--socket', default=argparse.SUPPRESS)
+
+    return parser
+
+
+QUERIES = {'search': cmd_search, 'query': cmd_query, 'kwic': cmd_kwic, 'stats': cmd_stats, 'resolve-serial': cmd_resolve_serial}
+
+
+def run(args, out, db=None) -> int:
+    if args.command in QUERIES:
+        own = db is None
+        db = db or open_db()
+        try:
+            return QUERIES[args.command](db, args, out)
+        finally:
+            if own:
+                db.close()
+    if args.command == 'validate':
+        return cmd_validate(args, out)
+    if args.command == 'export':
+        return cmd_export(args, out)
+    raise CommandError(f'unknown command {args.command}')
+
+
+# Wire format, kept free of json so the client never imports re: the request
+# is the NUL-joined argv, ended by closing the write side; the reply is a
+# "<status> <stdout bytes>" header line followed by stdout then stderr.
+
+def ask_daemon(argv: list[str], socket_path: str = SOCKET_PATH) -> tuple[int, str, str] | None:
+    import socket
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+    except OSError:
+        return None
+    with sock, sock.makefile('rb') as stream:
+        sock.sendall('\0'.join(argv).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        header = stream.readline().split()
+        body = stream.read()
+    if len(header) != 2:
+        return None
+    status, size = int(header[0]), int(header[1])
+    return status, body[:size].decode('utf-8'), body[size:].decode('utf-8')
+
+
+def serve(socket_path: str) -> None:
+    import io
+    import signal
+    import socketserver
+    from contextlib import redirect_stderr, redirect_stdout
+
+    parser = build_parser()
+    state = {'db': open_db(), 'inode': os.stat(DB_PATH).st_ino}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            out, err = io.StringIO(), io.StringIO()
+            status = 0
+            try:
+                request = self.rfile.read().decode('utf-8')
+                # argparse reports usage errors on stderr; send them back to the client.
+                with redirect_stdout(out), redirect_stderr(err):
+                    args = parser.parse_args(request.split('\0') if request else [])
+                if args.command not in DAEMON_COMMANDS:
+                    raise CommandError(f'{args.command} is not handled by the daemon')
+                # A rebuilt database is a new file; reopen it rather than keep reading the old one.
+                inode = os.stat(DB_PATH).st_ino
+                if inode != state['inode']:
+                    state['db'].close()
+                    state['db'], state['inode'] = open_db(), inode
+                status = run(args, out, state['db'])
+            except SystemExit as exc:
+                status = exc.code if isinstance(exc.code, int) else 2
+            except Exception as exc:
+                print(f'shakespeare-json: {exc}', file=err)
+                status = 2
+            stdout = out.getvalue().encode('utf-8')
+            self.wfile.write(f'{status} {len(stdout)}\n'.encode('ascii') + stdout + err.getvalue().encode('utf-8'))
+
+    os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # Stop cleanly (and remove the socket) on `kill` as well as on Ctrl-C.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with socketserver.UnixStreamServer(socket_path, Handler) as server:
+        print(f'Serving {DB_PATH} on {socket_path}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+def forward(argv: list[str], socket_path: str) -> int | None:
+    if {'-h', '--help'} & set(argv) or not os.path.exists(socket_path):
+        return None
+    reply = ask_daemon(argv, socket_path)
+    if reply is None:
+        return None
+    status, stdout, stderr = reply
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return status
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    # Fast path: with a daemon running, queries are forwarded before argparse
+    # is even imported; the daemon parses them with the same parser. A
+    # command first on the line means no global options (so no --no-daemon
+    # and no --socket) were given.
+    fast = bool(argv) and argv[0] in DAEMON_COMMANDS
+    if fast:
+        status = forward(argv, SOCKET_PATH)
+        if status is not None:
+            return status
+    args = build_parser().parse_args(argv)
+    if args.command in DAEMON_COMMANDS and not args.no_daemon and not fast:
+        status = forward(argv, args.socket)
+        if status is not None:
+            return status
+    if args.command == 'serve':
+        serve(args.socket)
+        return 0
+    try:
+        return run(args, sys.stdout)
+    except CommandError as exc:
+        print(f'shakespeare-json: {exc}', file=sys.stderr)
+        return 2
+    except BrokenPipeError:
+        # Output piped into head & co.; stop quietly.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
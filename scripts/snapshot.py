@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from corpus import DERIVED, ROOT, iter_unit_paths, rel_path
+
+
+STORE_DIR = DERIVED / 'snapshots'
+MANIFEST_VERSION = 1
+
+# Unit files are written with indent=2, so every element of "items" opens on
+# a line of its own at indent 4. Those lines are the candidate cut points:
+# everything before the first item (meta) is one chunk, and items are grouped
+# into chunks whose ends are picked from the items' own content, so an edit
+# only changes the chunk it lands in and the chunks after it line up again.
+ITEM_OPEN = b'\n    {\n'
+MIN_CHUNK = 8 * 1024
+MAX_CHUNK = 256 * 1024
+CUT_MASK = 7
+
+
+def chunk_bytes(raw: bytes) -> list[bytes]:
+    starts = []
+    pos = raw.find(ITEM_OPEN)
+    while pos >= 0:
+        starts.append(pos + 1)
+        pos = raw.find(ITEM_OPEN, pos + 1)
+    if not starts:
+        return [raw]
+    chunks = [raw[:starts[0]]]
+    bounds = starts + [len(raw)]
+    begin = starts[0]
+    for k in range(len(starts)):
+        end = bounds[k + 1]
+        size = end - begin
+        last = k + 1 == len(starts)
+        if last or size >= MAX_CHUNK or (size >= MIN_CHUNK and zlib.crc32(raw[bounds[k]:end]) & CUT_MASK == 0):
+            chunks.append(raw[begin:end])
+            begin = end
+    return chunks
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def fan_out(base: Path, key: str) -> Path:
+    return base / key[:2] / key[2:]
+
+
+def write_once(path: Path, data: bytes) -> int:
+    # Content-addressed, so an existing file already holds these bytes.
+    if path.exists():
+        return 0
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+def store_file(job: tuple[str, str, str]) -> tuple[str, dict, int, int]:
+    # Worker: chunk one file into the object store and record its recipe.
+    path_str, rel, store_str = job
+    path, store = Path(path_str), Path(store_str)
+    st = path.stat()
+    raw = path.read_bytes()
+    file_key = digest(raw)
+    written = new_chunks = 0
+    recipe = fan_out(store / 'recipes', file_key)
+    if not recipe.exists():
+        keys = []
+        for chunk in chunk_bytes(raw):
+            key = digest(chunk)
+            keys.append(key)
+            n = write_once(fan_out(store / 'objects', key), zlib.compress(chunk, 1))
+            written += n
+            new_chunks += 1 if n else 0
+        written += write_once(recipe, json.dumps(keys).encode('ascii'))
+    return rel, {'digest': file_key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, written, new_chunks
+
+
+class SnapshotStore:
+    # objects/  zlib-compressed chunks keyed by the sha1 of their bytes
+    # recipes/  per file content (keyed by file sha1): its list of chunk keys
+    # manifests/<name>.json  relative path -> file sha1, size and mtime
+
+    def __init__(self, path: Path = STORE_DIR):
+        self.path = path
+        self.objects = path / 'objects'
+        self.recipes = path / 'recipes'
+        self.manifests = path / 'manifests'
+
+    def names(self) -> list[str]:
+        if not self.manifests.is_dir():
+            return []
+        found = [(self.manifest(p.stem)['created'], p.stem) for p in self.manifests.glob('*.json')]
+        return [name for _, name in sorted(found)]
+
+    def manifest(self, name: str) -> dict:
+        try:
+            with open(self.manifests / f'{name}.json', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise SystemExit(f'no snapshot named {name!r}') from None
+        if data.get('version') != MANIFEST_VERSION:
+            raise SystemExit(f'snapshot {name!r} has manifest version {data.get("version")}')
+        return data
+
+    def chunks(self, file_key: str) -> list[str]:
+        with open(fan_out(self.recipes, file_key), encoding='ascii') as f:
+            return json.load(f)
+
+    def read(self, file_key: str) -> bytes:
+        parts = []
+        for key in self.chunks(file_key):
+            with open(fan_out(self.objects, key), 'rb') as f:
+                parts.append(zlib.decompress(f.read()))
+        raw = b''.join(parts)
+        if digest(raw) != file_key:
+            raise RuntimeError(f'snapshot object {file_key} is corrupt')
+        return raw
+
+    def create(self, root: Path = ROOT, name: str | None = None, message: str = '', workers: int | None = None) -> dict:
+        created = datetime.now(timezone.utc)
+        name = name or created.strftime('%Y%m%d-%H%M%S')
+        if (self.manifests / f'{name}.json').exists():
+            raise SystemExit(f'snapshot {name!r} already exists')
+        # Files whose size and mtime match the latest snapshot are not re-read.
+        names = self.names()
+        previous = self.manifest(names[-1])['files'] if names else {}
+        files: dict[str, dict] = {}
+        jobs = []
+        for path in iter_unit_paths(root):
+            rel = rel_path(path, root)
+            entry = previous.get(rel)
+            st = path.stat()
+            if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                files[rel] = entry
+            else:
+                jobs.append((str(path), rel, str(self.path)))
+        written = new_chunks = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for rel, entry, n_bytes, n_chunks in pool.map(store_file, jobs, chunksize=8):
+                files[rel] = entry
+                written += n_bytes
+                new_chunks += n_chunks
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'name': name,
+            'created': created.isoformat(timespec='seconds'),
+            'message': message,
+            'files': dict(sorted(files.items())),
+        }
+        self.manifests.mkdir(parents=True, exist_ok=True)
+        write_once(self.manifests / f'{name}.json', json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+        return {'name': name, 'files': len(files), 'scanned': len(jobs), 'new_chunks': new_chunks, 'bytes': written}
+
+    def checkout(self, name: str, dest: Path, prune: bool = False) -> tuple[int, int]:
+        # Files already holding the snapshot's bytes are left alone, so
+        # rolling the working tree back only rewrites what differs.
+        files = self.manifest(name)['files']
+        written = removed = 0
+        for rel, entry in files.items():
+            target = dest / rel
+            if current_digest(target, entry) == entry['digest']:
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f'{target.name}.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(self.read(entry['digest']))
+            os.replace(tmp, target)
+            written += 1
+        if prune and dest.is_dir():
+            for path in iter_unit_paths(dest):
+                if rel_path(path, dest) not in files:
+                    path.unlink()
+                    removed += 1
+        return written, removed
+
+    def drop(self, name: str) -> int:
+        # Removes a snapshot, then every recipe and chunk no other snapshot uses.
+        self.manifest(name)
+        (self.manifests / f'{name}.json').unlink()
+        live_files = {entry['digest'] for other in self.names() for entry in self.manifest(other)['files'].values()}
+        live_chunks = set()
+        for file_key in live_files:
+            live_chunks.update(self.chunks(file_key))
+        removed = 0
+        for base, live in ((self.recipes, live_files), (self.objects, live_chunks)):
+            for path in base.glob('*/*'):
+                if path.parent.name + path.name not in live:
+                    path.unlink()
+                    removed += 1
+        return removed
+
+
+def current_digest(path: Path, entry: dict | None = None) -> str | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    if entry and st.st_size != entry['size']:
+        return None
+    if entry and st.st_mtime_ns == entry['mtime_ns']:
+        return entry['digest']
+    return digest(path.read_bytes())
+
+
+def working_files(root: Path, base: dict) -> dict[str, dict]:
+    # The working tree as manifest entries; unchanged size+mtime is trusted.
+    files = {}
+    for path in iter_unit_paths(root):
+        rel = rel_path(path, root)
+        st = path.stat()
+        entry = base.get(rel)
+        if not (entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns):
+            entry = {'digest': digest(path.read_bytes()), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        files[rel] = entry
+    return files
+
+
+def diff_files(old: dict[str, dict], new: dict[str, dict]) -> list[tuple[str, str]]:
+    changes = []
+    for rel in sorted(old.keys() | new.keys()):
+        if rel not in new:
+            changes.append(('D', rel))
+        elif rel not in old:
+            changes.append(('A', rel))
+        elif old[rel]['digest'] != new[rel]['digest']:
+            changes.append(('M', rel))
+    return changes
+
+
+def item_changes(old_raw: bytes, new_raw: bytes) -> list[tuple[str, str]]:
+    # Item-level detail for one modified unit, matched by item serial.
+    def items(raw: bytes) -> dict[str, str]:
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return {}
+        if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+            return {}
+        out = {}
+        for item in data['items']:
+            key = item.get('serial') or f'seq {item.get("seq")}'
+            out[key] = json.dumps(item, sort_keys=True)
+        return out
+
+    old, new = items(old_raw), items(new_raw)
+    changes = [('-', key) for key in old if key not in new]
+    changes += [('+', key) for key in new if key not in old]
+    changes += [('~', key) for key in new if key in old and old[key] != new[key]]
+    return changes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Content-addressed snapshots of the unit files.')
+    parser.add_argument('--store', type=Path, default=STORE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('create', help='snapshot the working tree')
+    p.add_argument('--name')
+    p.add_argument('-m', '--message', default='')
+    p.add_argument('--workers', type=int, default=None)
+
+    sub.add_parser('list', help='list snapshots, oldest first')
+
+    p = sub.add_parser('diff', help='files changed between two snapshots, or since a snapshot')
+    p.add_argument('old')
+    p.add_argument('new', nargs='?', help='snapshot to compare with (default: the working tree)')
+    p.add_argument('--items', action='store_true', help='also list added, removed and changed item serials')
+
+    p = sub.add_parser('checkout', help='write a snapshot into a directory')
+    p.add_argument('name')
+    p.add_argument('dest', type=Path, nargs='?', default=ROOT, help='target directory (default: the working tree)')
+    p.add_argument('--prune', action='store_true', help='delete unit files that are not in the snapshot')
+
+    p = sub.add_parser('drop', help='delete a snapshot and the chunks only it used')
+    p.add_argument('name')
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.store)
+    if args.command == 'create':
+        stats = store.create(name=args.name, message=args.message, workers=args.workers)
+        print(
+            f'Snapshot {stats["name"]}: {stats["files"]} files, {stats["scanned"]} read, '
+            f'{stats["new_chunks"]} new chunks, {stats["bytes"] / 1e6:.1f} MB added'
+        )
+    elif args.command == 'list':
+        for name in store.names():
+            manifest = store.manifest(name)
+            print(f'{name}\t{manifest["created"]}\t{len(manifest["files"])} files\t{manifest["message"]}')
+    elif args.command == 'diff':
+        old = store.manifest(args.old)['files']
+        new = store.manifest(args.new)['files'] if args.new else working_files(ROOT, old)
+        changes = diff_files(old, new)
+        for status, rel in changes:
+            print(f'{status} {rel}')
+            if args.items and status == 'M':
+                new_raw = store.read(new[rel]['digest']) if args.new else (ROOT / rel).read_bytes()
+                for mark, key in item_changes(store.read(old[rel]['digest']), new_raw):
+                    print(f'    {mark} {key}')
+        print(f'{len(changes)} files changed', file=sys.stderr)
+    elif args.command == 'checkout':
+        written, removed = store.checkout(args.name, args.dest.resolve(), prune=args.prune)
+        print(f'Wrote {written} files to {args.dest}' + (f', removed {removed}' if args.prune else ''))
+    elif args.command == 'drop':
+        removed = store.drop(args.name)
+        print(f'Dropped {args.name} ({removed} unreferenced objects removed)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+from array import array
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Iterator
+
+from corpus import ROOT, iter_play_unit_paths, rel_path
+from lazy_unit import Unit, load_lazy
+
+
+TOKEN_KEYS = ('i', 'type', 's', 'norm', 'pre', 'serial')
+PUNCT_KEYS = ('kind', 'dash', 'quote', 'role')
+TOKEN_KEY_SET = frozenset(TOKEN_KEYS)
+OPTIONAL_KEYS = frozenset(('em', 'punct'))
+TYPES = ('word', 'punct')
+TYPE_IDS = {name: i for i, name in enumerate(TYPES)}
+DIGITS = '0123456789'
+
+# flags column
+EM_SET = 1
+EM_TRUE = 2
+HAS_PUNCT = 4
+ODD = 8
+
+
+class StringTable:
+    # Interned strings addressed by a dense integer id.
+
+    def __init__(self, values: tuple[str, ...] = ()):
+        self.values: list[str] = []
+        self.ids: dict[str, int] = {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value: str) -> int:
+        found = self.ids.get(value)
+        if found is None:
+            found = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return found
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class TokenStore:
+    # Tokens as rows of parallel arrays. Strings (s, norm, pre and the two
+    # halves of each serial) are interned in one table; type and punctuation
+    # metadata are small enums. Tokens that do not fit the usual shape are
+    # kept verbatim in `odd`.
+
+    def __init__(self):
+        self.strings = StringTable()
+        self.enums = {key: StringTable() for key in PUNCT_KEYS}
+        self.i = array('i')
+        self.type = array('B')
+        self.s = array('I')
+        self.norm = array('I')
+        self.pre = array('I')
+        self.serial_prefix = array('I')
+        self.serial_number = array('I')
+        self.flags = array('B')
+        self.punct = {key: array('B') for key in PUNCT_KEYS}
+        self.odd: dict[int, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def _fits(self, tok: dict) -> bool:
+        if not TOKEN_KEY_SET <= tok.keys() <= TOKEN_KEY_SET | OPTIONAL_KEYS:
+            return False
+        if tok['type'] not in TYPE_IDS or type(tok['i']) is not int or not -(1 << 31) <= tok['i'] < (1 << 31):
+            return False
+        if not (type(tok['s']) is str and type(tok['norm']) is str and type(tok['pre']) is str and type(tok['serial']) is str):
+            return False
+        if 'em' in tok and type(tok['em']) is not bool:
+            return False
+        if 'punct' in tok:
+            punct = tok['punct']
+            if type(punct) is not dict or tuple(punct) != PUNCT_KEYS:
+                return False
+            if not all(value is None or type(value) is str for value in punct.values()):
+                return False
+        return True
+
+    def append(self, tok: dict) -> int:
+        self.extend([tok])
+        return len(self.flags) - 1
+
+    def extend(self, tokens: list[dict]) -> TokenRange:
+        start = len(self.flags)
+        add = self.strings.add
+        fits = self._fits
+        punct_columns = [(self.punct[key], self.enums[key].add, key) for key in PUNCT_KEYS]
+        for tok in tokens:
+            if not fits(tok):
+                self.odd[len(self.flags)] = tok
+                for column in (self.i, self.type, self.s, self.norm, self.pre, self.serial_prefix, self.serial_number):
+                    column.append(0)
+                for column, _, _ in punct_columns:
+                    column.append(0)
+                self.flags.append(ODD)
+                continue
+            self.i.append(tok['i'])
+            self.type.append(TYPE_IDS[tok['type']])
+            self.s.append(add(tok['s']))
+            self.norm.append(add(tok['norm']))
+            self.pre.append(add(tok['pre']))
+            # Serials end in a digit run; it is interned as a string so zero padding survives.
+            serial = tok['serial']
+            cut = len(serial.rstrip(DIGITS))
+            self.serial_prefix.append(add(serial[:cut]))
+            self.serial_number.append(add(serial[cut:]))
+            flags = 0
+            if 'em' in tok:
+                flags |= EM_SET | (EM_TRUE if tok['em'] else 0)
+            punct = tok.get('punct')
+            if punct is None:
+                for column, _, _ in punct_columns:
+                    column.append(0)
+            else:
+                flags |= HAS_PUNCT
+                for column, intern, key in punct_columns:
+                    value = punct[key]
+                    column.append(0 if value is None else intern(value) + 1)
+            self.flags.append(flags)
+        return TokenRange(self, start, len(self.flags))
+
+    def get(self, row: int, key: str, default=None):
+        flags = self.flags[row]
+        if flags & ODD:
+            return self.odd[row].get(key, default)
+        strings = self.strings.values
+        if key == 'i':
+            return self.i[row]
+        if key == 'type':
+            return TYPES[self.type[row]]
+        if key == 's':
+            return strings[self.s[row]]
+        if key == 'norm':
+            return strings[self.norm[row]]
+        if key == 'pre':
+            return strings[self.pre[row]]
+        if key == 'serial':
+            return strings[self.serial_prefix[row]] + strings[self.serial_number[row]]
+        if key == 'em':
+            return bool(flags & EM_TRUE) if flags & EM_SET else default
+        if key == 'punct':
+            if not flags & HAS_PUNCT:
+                return default
+            return {k: self.enums[k].values[v - 1] if v else None for k, v in ((k, self.punct[k][row]) for k in PUNCT_KEYS)}
+        return default
+
+    def keys(self, row: int) -> tuple[str, ...]:
+        flags = self.flags[row]
+        if flags & ODD:
+            return tuple(self.odd[row])
+        return TOKEN_KEYS + (('em',) if flags & EM_SET else ()) + (('punct',) if flags & HAS_PUNCT else ())
+
+    def nbytes(self) -> int:
+        columns = [self.i, self.type, self.s, self.norm, self.pre, self.serial_prefix, self.serial_number, self.flags]
+        return sum(c.itemsize * len(c) for c in columns + list(self.punct.values()))
+
+
+class TokenView(Mapping):
+    # A read-only, dict-like token backed by one store row.
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store: TokenStore, row: int):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key: str):
+        missing = object()
+        value = self.store.get(self.row, key, missing)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default=None):
+        return self.store.get(self.row, key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self.store.keys(self.row)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.keys(self.row))
+
+    def __len__(self) -> int:
+        return len(self.store.keys(self.row))
+
+    def __repr__(self) -> str:
+        return f'TokenView({dict(self)!r})'
+
+
+class TokenRange(Sequence):
+    # The tokens of one span: rows start..end of a store.
+    __slots__ = ('store', 'start', 'end')
+
+    def __init__(self, store: TokenStore, start: int, end: int):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[k] for k in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TokenView(self.store, self.start + index)
+
+    def __iter__(self) -> Iterator[TokenView]:
+        store = self.store
+        for row in range(self.start, self.end):
+            yield TokenView(store, row)
+
+    def column(self, key: str) -> list:
+        # Bulk read of one field, e.g. every norm in the span.
+        return [self.store.get(row, key) for row in range(self.start, self.end)]
+
+
+class Corpus:
+    # Every unit as lazy_unit records whose span tokens live in one shared TokenStore.
+
+    def __init__(self, root: Path = ROOT):
+        self.root = root
+        self.store = TokenStore()
+        self.units: list[Unit] = []
+        self.by_path: dict[str, Unit] = {}
+
+    def add(self, unit: Unit) -> None:
+        for item in unit.items:
+            for span in item.spans:
+                span._tokens = self.store.extend(span.tokens)
+        self.units.append(unit)
+        self.by_path[rel_path(unit.path, self.root)] = unit
+
+    def unit(self, rel: str) -> Unit | None:
+        return self.by_path.get(rel)
+
+    def __iter__(self) -> Iterator[Unit]:
+        return iter(self.units)
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+
+def load_corpus(root: Path = ROOT, plays: set[str] | None = None) -> Corpus:
+    corpus = Corpus(root)
+    for path in iter_play_unit_paths(root, plays):
+        unit = load_lazy(path)
+        if unit is not None:
+            corpus.add(unit)
+    return corpus
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from corpus import ROOT, iter_unit_paths, load, rel_path, tokens_to_text
+from profiling import NullTrace, Trace, add_trace_arguments, finish_trace, trace_from_args
+
+
+KINDS = {'speech', 'speaker_label', 'stage', 'heading', 'cast_entry'}
+
+
+def check_unit(data) -> tuple[list[str], list[str]]:
+    errors: list[str] = []
+    warnings: list[str] = []
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        return ['not a unit: missing items list'], warnings
+    if not (data.get('meta') or {}).get('unit'):
+        return ['not a unit: missing meta.unit'], warnings
+    items = data['items']
+
+    seen_serials: set[str] = set()
+    seen_lines: set[str] = set()
+    seen_tokens: set[str] = set()
+    last_line = None
+    expected_seq = items[0].get('seq') if items else None
+    for item in items:
+        where = item.get('serial') or f'seq {item.get("seq")}'
+        if item.get('kind') not in KINDS:
+            errors.append(f'{where}: unknown kind {item.get("kind")!r}')
+        serial = item.get('serial')
+        if not serial:
+            errors.append(f'{where}: missing serial')
+        elif serial in seen_serials:
+            errors.append(f'{where}: duplicate serial')
+        seen_serials.add(serial)
+        if item.get('seq') != expected_seq:
+            warnings.append(f'{where}: seq {item.get("seq")} where {expected_seq} was expected')
+        expected_seq = (item.get('seq') or 0) + 1
+
+        if item.get('kind') == 'speech':
+            if not item.get('speech_id'):
+                errors.append(f'{where}: speech without speech_id')
+            line_serial = item.get('line_serial')
+            if line_serial:
+                if line_serial in seen_lines:
+                    errors.append(f'{where}: duplicate line_serial {line_serial}')
+                seen_lines.add(line_serial)
+            number = item.get('line_number')
+            if number is not None:
+                if last_line is not None and number <= last_line:
+                    errors.append(f'{where}: line {number} does not follow line {last_line}')
+                last_line = number
+
+        for span in item.get('spans') or []:
+            tokens = span.get('tokens') or []
+            if isinstance(span.get('text'), str) and tokens and tokens_to_text(tokens) != span['text']:
+                warnings.append(f'{where}: span text differs from its tokens')
+            for tok in tokens:
+                tok_serial = tok.get('serial')
+                if tok_serial in seen_tokens:
+                    warnings.append(f'{where}: duplicate token serial {tok_serial}')
+                seen_tokens.add(tok_serial)
+
+    numbering = data['meta'].get('numbering') or {}
+    first = next((item.get('line_number') for item in items if item.get('kind') == 'speech' and item.get('line_number') is not None), None)
+    if first is not None and numbering.get('line_start') is not None and first != numbering['line_start']:
+        warnings.append(f'numbering.line_start is {numbering["line_start"]} but the first line is {first}')
+    return errors, warnings
+
+
+def validate_path(path: Path, counters: dict | None = None) -> tuple[list[str], list[str]]:
+    try:
+        data = load(path)
+    except OSError as exc:
+        return [f'unreadable: {exc}'], []
+    except ValueError as exc:
+        return [f'invalid JSON: {exc}'], []
+    if counters is not None:
+        counters['bytes'] = path.stat().st_size
+    if counters is not None and isinstance(data, dict) and isinstance(data.get('items'), list):
+        counters['items'] = len(data['items'])
+        counters['tokens'] = sum(len(span.get('tokens') or []) for item in data['items'] for span in item.get('spans') or [])
+    return check_unit(data)
+
+
+def validate(
+    paths: list[Path], root: Path = ROOT, out=sys.stdout, quiet: bool = False, trace: Trace | None = None,
+) -> tuple[int, int]:
+    trace = trace or NullTrace()
+    n_errors = n_warnings = 0
+    for path in paths:
+        with trace.unit(rel_path(path, root), files=1) as counters:
+            errors, warnings = validate_path(path, counters)
+        n_errors += len(errors)
+        n_warnings += len(warnings)
+        rel = rel_path(path, root)
+        for message in errors:
+            print(f'ERROR {rel}: {message}', file=out)
+        if not quiet:
+            for message in warnings:
+                print(f'WARN  {rel}: {message}', file=out)
+    return n_errors, n_warnings
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Check unit files for structural and numbering problems.')
+    parser.add_argument('paths', nargs='*', type=Path, help='files to check (default: the whole corpus)')
+    parser.add_argument('--quiet', action='store_true', help='only print errors')
+    parser.add_argument('--strict', action='store_true', help='treat warnings as failures')
+    add_trace_arguments(parser)
+    args = parser.parse_args(argv)
+
+    trace = trace_from_args(args, 'validate_corpus')
+    with trace.stage('scan'):
+        paths = [p.resolve() for p in args.paths] if args.paths else list(iter_unit_paths(ROOT))
+    with trace.stage('validate'):
+        n_errors, n_warnings = validate(paths, quiet=args.quiet, trace=trace)
+        trace.count(errors=n_errors, warnings=n_warnings)
+    print(f'{len(paths)} files: {n_errors} errors, {n_warnings} warnings', file=sys.stderr)
+    finish_trace(trace, args)
+    return 1 if n_errors or (args.strict and n_warnings) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
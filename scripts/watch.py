@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import math
+import os
+import re
+import select
+import shutil
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from corpus import ROOT, SKIP_DIRS, iter_unit_paths, play_id, rel_path
+import validate_corpus
+
+
+INDEX_PATH = ROOT / 'index.json'
+DEBOUNCE = 0.15       # seconds without events before a batch is processed
+MAX_DELAY = 1.0       # ...but never hold a batch longer than this
+POLL_INTERVAL = 0.5
+
+# Artifacts too slow to patch per edit are rebuilt in the background, one
+# at a time, and only if they have been built before (the marker exists).
+BACKGROUND = (
+    ('query index', 'derived/query/index.bin', [sys.executable, 'scripts/query.py']),
+    ('fuzzy index', 'derived/fuzzy/index.json', [sys.executable, 'scripts/fuzzy_search.py', '--build']),
+    ('stage timeline', 'derived/timeline', [sys.executable, 'scripts/build_stage_timeline.py']),
+    ('character network', 'derived/network', [sys.executable, 'scripts/build_character_network.py']),
+    ('sides', 'derived/sides', [sys.executable, 'scripts/build_sides.py']),
+    ('search index', 'search/manifest.json', ['node', 'tools/build-search-index.mjs']),
+)
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT = struct.Struct('iIII')
+
+
+def is_watched_dir(name: str) -> bool:
+    return name not in SKIP_DIRS and not name.startswith('.')
+
+
+class InotifyWatcher:
+    # Linux inotify through libc: one watch per directory under the play
+    # directories, plus the repository root to notice new plays.
+
+    def __init__(self, root: Path = ROOT):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if libc is None or not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.libc = libc
+        self.root = root
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs: dict[int, Path] = {}
+        self._add(root)
+        for entry in os.scandir(root):
+            if entry.is_dir(follow_symlinks=False) and is_watched_dir(entry.name):
+                self.add_tree(Path(entry.path))
+
+    def _add(self, path: Path) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+        self.dirs[wd] = path
+
+    def add_tree(self, top: Path) -> set[Path]:
+        # Returns the JSON files already inside, which may have been written
+        # before the watch was in place.
+        found = set()
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [d for d in dirnames if is_watched_dir(d)]
+            self._add(Path(dirpath))
+            found.update(Path(dirpath) / name for name in filenames if name.endswith('.json'))
+        return found
+
+    def changes(self, timeout: float | None) -> set[Path] | None:
+        # Changed JSON paths seen within `timeout`, or None after a queue
+        # overflow, when only a full rescan is safe.
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            buf = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return set()
+        changed: set[Path] = set()
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, size = EVENT.unpack_from(buf, offset)
+            name = os.fsdecode(buf[offset + EVENT.size:offset + EVENT.size + size].rstrip(b'\0'))
+            offset += EVENT.size + size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            parent = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if parent is None or not name:
+                continue
+            path = parent / name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and is_watched_dir(name):
+                    changed |= self.add_tree(path)
+                continue
+            # Top-level files (index.json, package.json) are not units.
+            if parent != self.root and name.endswith('.json'):
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollWatcher:
+    # Fallback for systems without inotify: compares size and mtime of
+    # every unit file each interval.
+
+    def __init__(self, root: Path = ROOT, interval: float = POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.state = self.scan()
+
+    def scan(self) -> dict[Path, tuple[int, int]]:
+        state = {}
+        for path in iter_unit_paths(self.root):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            state[path] = (st.st_size, st.st_mtime_ns)
+        return state
+
+    def changes(self, timeout: float | None) -> set[Path] | None:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        state = self.scan()
+        changed = {path for path in state.keys() | self.state.keys() if state.get(path) != self.state.get(path)}
+        self.state = state
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def num_from(value) -> float | None:
+    # numFrom() in tools/build-index.mjs: integers and Roman numerals.
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return value
+    text = str(value).strip().upper()
+    if text.isdigit():
+        return int(text)
+    if not text or not re.fullmatch(r'[IVXLCDM]+', text):
+        return None
+    values = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500, 'M': 1000}
+    total = prev = 0
+    for ch in reversed(text):
+        total += -values[ch] if values[ch] < prev else values[ch]
+        prev = values[ch]
+    return total
+
+
+def scene_order(scene: dict) -> tuple[float, float]:
+    act, number = num_from(scene.get('act')), num_from(scene.get('scene'))
+    return (math.inf if act is None else act, math.inf if number is None else number)
+
+
+def scene_entry(path: Path, root: Path = ROOT) -> tuple[str, str, dict] | None:
+    # The index.json entry tools/build-index.mjs writes for a scene file.
+    try:
+        raw = path.read_bytes()
+        data = json.loads(raw)
+    except (OSError, ValueError):
+        return None
+    unit = (data.get('meta') or {}).get('unit') if isinstance(data, dict) else None
+    if not unit or str(unit.get('type') or '').lower() != 'scene':
+        return None
+    pid = play_id(data)
+    entry = {
+        'act': unit.get('act'),
+        'scene': unit.get('scene'),
+        'title': unit.get('title') or unit.get('label') or None,
+        'path': rel_path(path, root),
+        'hash': hashlib.sha1(raw).hexdigest()[:16],
+    }
+    return pid, (data['meta'].get('play') or {}).get('title') or pid, entry
+
+
+def patch_index(paths: set[Path], root: Path = ROOT, index_path: Path = INDEX_PATH) -> int:
+    # Replaces the entries of the given files in index.json, in the same
+    # shape and order as a full `npm run build:index`. Returns the number of
+    # scene entries added or removed; the file is only written on change.
+    with open(index_path, encoding='utf-8') as f:
+        raw = f.read()
+    index = json.loads(raw)
+    rels = {rel_path(path, root) for path in paths}
+    touched = set()
+    changes = 0
+    for play in index['plays']:
+        kept = [scene for scene in play['scenes'] if scene['path'] not in rels]
+        if len(kept) != len(play['scenes']):
+            changes += len(play['scenes']) - len(kept)
+            play['scenes'] = kept
+            touched.add(play['id'])
+    by_id = {play['id']: play for play in index['plays']}
+    new_play = False
+    for path in sorted(paths):
+        found = scene_entry(path, root)
+        if found is None:
+            continue
+        pid, title, entry = found
+        if pid not in by_id:
+            by_id[pid] = {'id': pid, 'title': title, 'scenes': [], 'scene_count': 0}
+            index['plays'].append(by_id[pid])
+            new_play = True
+        by_id[pid]['scenes'].append(entry)
+        touched.add(pid)
+        changes += 1
+    for pid in touched:
+        play = by_id[pid]
+        play['scenes'].sort(key=scene_order)
+        play['scene_count'] = len(play['scenes'])
+    index['plays'] = [play for play in index['plays'] if play['scenes']]
+    if new_play:
+        # Plays are ordered by localeCompare (ICU collation), which Python
+        # cannot reproduce exactly; a new play takes a full build instead.
+        if index_path == root / 'index.json' and shutil.which('node'):
+            build = subprocess.run(['node', 'tools/build-index.mjs'], cwd=root, stdout=subprocess.DEVNULL)
+            if build.returncode == 0:
+                return changes
+        index['plays'].sort(key=lambda play: play['title'].casefold())
+    text = json.dumps(index, ensure_ascii=False, indent=2)
+    if text != raw:
+        tmp = index_path.with_name(f'{index_path.name}.{os.getpid()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, index_path)
+    return changes
+
+
+class Background:
+    # Runs the BACKGROUND rebuilds one after another. Edits that arrive
+    # while a round is running schedule exactly one more round.
+
+    def __init__(self, root: Path = ROOT, enabled: bool = True):
+        self.root = root
+        self.queue: list[tuple[str, list[str]]] = []
+        self.dirty = False
+        self.proc: subprocess.Popen | None = None
+        self.current = ''
+        self.started = 0.0
+        self.jobs = []
+        if enabled:
+            for name, marker, argv in BACKGROUND:
+                if (root / marker).exists() and shutil.which(argv[0]):
+                    self.jobs.append((name, argv))
+
+    @property
+    def busy(self) -> bool:
+        return self.proc is not None or bool(self.queue)
+
+    def schedule(self) -> None:
+        if self.jobs:
+            self.dirty = True
+            self.poll()
+
+    def poll(self) -> None:
+        if self.proc is not None:
+            status = self.proc.poll()
+            if status is None:
+                return
+            outcome = 'done' if status == 0 else f'failed ({status})'
+            log(f'{self.current}: {outcome} in {time.perf_counter() - self.started:.1f}s')
+            self.proc = None
+        if not self.queue and self.dirty:
+            self.queue = list(self.jobs)
+            self.dirty = False
+        if self.queue:
+            self.current, argv = self.queue.pop(0)
+            self.started = time.perf_counter()
+            self.proc = subprocess.Popen(argv, cwd=self.root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self) -> None:
+        if self.proc is not None:
+            self.proc.terminate()
+            self.proc.wait()
+
+
+def log(message: str) -> None:
+    print(f'{time.strftime("%H:%M:%S")} {message}', flush=True)
+
+
+def process(paths: set[Path] | None, root: Path = ROOT, sqlite: bool = True, quiet: bool = False) -> None:
+    # The fast path: everything here is per changed unit.
+    start = time.perf_counter()
+    if paths is None:
+        # Lost events; fall back to the full (still incremental) refreshes.
+        paths = set(iter_unit_paths(root))
+        stale = None
+    else:
+        stale = paths
+    existing = sorted(path for path in paths if path.exists())
+    parts = []
+    n_errors, n_warnings = validate_corpus.validate(existing, root, quiet=quiet)
+    parts.append(f'{n_errors} errors, {n_warnings} warnings')
+    if INDEX_PATH.exists():
+        parts.append(f'index.json {patch_index(paths, root)} entries')
+    if sqlite:
+        from export_sqlite import DB_PATH, refresh
+
+        if DB_PATH.exists():
+            count = refresh(DB_PATH, root, workers=1, paths=None if stale is None else sorted(stale))
+            parts.append(f'sqlite {count} units')
+    names = ', '.join(rel_path(path, root) for path in sorted(paths)[:3]) + (' ...' if len(paths) > 3 else '')
+    log(f'{names}: {"; ".join(parts)} ({time.perf_counter() - start:.2f}s)')
+
+
+def watch(root: Path = ROOT, poll: bool = False, sqlite: bool = True, background: bool = True, quiet: bool = False) -> None:
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher(root)
+        except OSError as exc:
+            log(f'inotify unavailable ({exc}); polling every {POLL_INTERVAL}s')
+    if watcher is None:
+        watcher = PollWatcher(root)
+    jobs = Background(root, background)
+    mode = 'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'
+    log(f'Watching {root} ({mode}); background rebuilds: {", ".join(name for name, _ in jobs.jobs) or "none"}')
+    pending: set[Path] | None = set()
+    first = None
+    try:
+        while True:
+            if first is not None:
+                timeout = max(0.0, min(DEBOUNCE, first + MAX_DELAY - time.monotonic()))
+            else:
+                timeout = 0.5 if jobs.busy else None
+            got = watcher.changes(timeout)
+            if got is None or got:
+                pending = None if got is None or pending is None else pending | got
+                if first is None:
+                    first = time.monotonic()
+                if time.monotonic() - first < MAX_DELAY:
+                    continue
+            if first is not None:
+                process(pending, root, sqlite, quiet)
+                jobs.schedule()
+                pending, first = set(), None
+            jobs.poll()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        jobs.stop()
+        watcher.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Keep index.json and the derived data in step with edits to unit files.')
+    parser.add_argument('paths', nargs='*', type=Path, help='process these files once and exit instead of watching')
+    parser.add_argument('--poll', action='store_true', help='poll file sizes and mtimes instead of using inotify')
+    parser.add_argument('--no-sqlite', action='store_true', help='do not refresh derived/corpus.sqlite')
+    parser.add_argument('--no-background', action='store_true', help='do not rebuild the slower indexes')
+    parser.add_argument('--quiet', action='store_true', help='only print validation errors')
+    args = parser.parse_args(argv)
+
+    if args.paths:
+        process({path.resolve() for path in args.paths}, ROOT, not args.no_sqlite, args.quiet)
+        return 0
+    watch(ROOT, args.poll, not args.no_sqlite, not args.no_background, args.quiet)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import io
+import random
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import pytest
+
+from align_edition import Aligner, align_play, banded_dp, chain, edition_words, is_label
+from corpus import ROOT
+from render import TextRenderer, play_paths, render_units
+
+
+def levenshtein(a: list[str], b: list[str]) -> int:
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        cur = [i]
+        for j, y in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (x != y)))
+        prev = cur
+    return prev[-1]
+
+
+def alignment_cost(a: list[str], b: list[str], pairs: list[tuple[int, int]]) -> int:
+    assert all(p[0] < q[0] and p[1] < q[1] for p, q in zip(pairs, pairs[1:]))
+    return len(a) + len(b) - 2 * len(pairs) + sum(a[i] != b[j] for i, j in pairs)
+
+
+def test_chain_is_a_longest_increasing_run():
+    rng = random.Random(0)
+    for _ in range(200):
+        pairs = sorted({(rng.randrange(30), rng.randrange(30)) for _ in range(rng.randrange(1, 25))})
+        # chain() expects one anchor per position in a, as unique n-grams give.
+        pairs = sorted({i: (i, j) for i, j in pairs}.values())
+        out = chain(pairs)
+        assert all(p[0] < q[0] and p[1] < q[1] for p, q in zip(out, out[1:]))
+        best = [1] * len(pairs)
+        for k in range(len(pairs)):
+            for m in range(k):
+                if pairs[m][0] < pairs[k][0] and pairs[m][1] < pairs[k][1]:
+                    best[k] = max(best[k], best[m] + 1)
+        assert len(out) == max(best)
+
+
+def test_banded_dp_is_optimal():
+    rng = random.Random(1)
+    for _ in range(200):
+        a = [rng.choice('abcd') for _ in range(rng.randrange(0, 15))]
+        b = [rng.choice('abcd') for _ in range(rng.randrange(0, 15))]
+        pairs = banded_dp(a, b, 0, len(a), 0, len(b), None)
+        assert alignment_cost(a, b, pairs) == levenshtein(a, b)
+        # A band wider than both inputs is the full DP.
+        assert alignment_cost(a, b, banded_dp(a, b, 0, len(a), 0, len(b), 40)) == levenshtein(a, b)
+
+
+def test_aligner_recovers_edited_stream():
+    rng = random.Random(2)
+    a = [f'w{rng.randrange(3000)}' for _ in range(20000)]
+    b, truth = [], {}
+    for i, word in enumerate(a):
+        roll = rng.random()
+        if roll < 0.02:
+            continue
+        if roll < 0.04:
+            b.append('noise')
+        truth[i] = len(b)
+        b.append(word if roll > 0.06 else word + 'x')
+    pairs = Aligner(a, b).run()
+    right = sum(truth.get(i) == j for i, j in pairs)
+    assert right >= 0.98 * len(truth)
+    assert Aligner(a, a).run() == [(i, i) for i in range(len(a))]
+
+
+def test_labels():
+    for text in ('HAMLET', 'FIRST WITCH.', 'ACT I', 'GLOUCESTER & CLARENCE.'):
+        assert is_label(text)
+    for text in ('O!', 'I.', 'O, O, O, O!', 'Give you good-night.', '25 HAMLET.’', 'SCENE II. Elsinore.'):
+        assert not is_label(text)
+
+
+def test_hyphens_split_like_the_corpus(tmp_path):
+    (tmp_path / 'ed.txt').write_text('Give you good-night.\nPost-haste, o’er the joint-labourer.\n', encoding='utf-8')
+    keys, where, _ = edition_words(tmp_path / 'ed.txt')
+    assert keys == ['give', 'you', 'good', 'night', 'post', 'haste', 'oer', 'the', 'joint', 'labourer']
+    assert where[3] == (0, 1) and where[4] == (0, 2)
+
+
+@pytest.fixture(scope='module')
+def hamlet_text(tmp_path_factory) -> Path:
+    out = io.StringIO()
+    render_units([Path(p) for p in play_paths(ROOT, {'hamlet'})['hamlet']], [TextRenderer(out)])
+    path = tmp_path_factory.mktemp('align') / 'hamlet.txt'
+    path.write_text(out.getvalue(), encoding='utf-8')
+    return path
+
+
+def test_play_aligns_exactly_to_its_own_text(hamlet_text):
+    rows, stats = align_play('hamlet', hamlet_text)
+    assert stats['lines'] == len(rows) > 2000
+    assert {row[-1] for row in rows} == {'exact'}
+    # The text renderer numbers speech lines, so a numbered edition line
+    # must carry the corpus line number.
+    text = hamlet_text.read_text(encoding='utf-8').split('\n')
+    numbered = 0
+    for serial, _, number, _, first, *_ in rows:
+        label = text[first - 1].split(' ', 1)[0]
+        if label.isdigit():
+            assert label == str(number), serial
+            numbered += 1
+    assert numbered > 0.9 * len(rows)
+
+
+def test_synthetic_edition(hamlet_text, tmp_path):
+    # Another edition: respelled words, dropped and added lines, verse
+    # lines run together and no line numbers.
+    rng = random.Random(3)
+    out = []
+    for line in hamlet_text.read_text(encoding='utf-8').split('\n'):
+        number, _, rest = line.partition(' ')
+        if not number.isdigit():
+            out.append(line)
+            continue
+        roll = rng.random()
+        if roll < 0.01:
+            continue
+        if roll < 0.02:
+            out.append('An editor’s note that is not in the play')
+        words = [w + 'e' if rng.random() < 0.05 else w for w in rest.split(' ')]
+        if out and roll > 0.97 and not is_label(out[-1]):
+            out[-1] += ' ' + ' '.join(words)
+        else:
+            out.append(' '.join(words))
+    edition = tmp_path / 'other.txt'
+    edition.write_text('\n'.join(out), encoding='utf-8')
+    rows, stats = align_play('hamlet', edition)
+    mapped = sum(row[-1] in ('exact', 'partial') for row in rows)
+    assert mapped >= 0.98 * len(rows)
+    assert stats['banded_gaps'] == 0
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import json
+import zlib
+
+import pytest
+
+from build_dataset import DatasetReader, ShardWriter, assign_splits, previous_splits
+
+
+PLAYS = [f'play-{i:02d}' for i in range(30)]
+
+
+def held_out(split: dict[str, str]) -> dict[str, str]:
+    return {play: name for play, name in split.items() if name != 'train'}
+
+
+def test_counts_and_determinism():
+    split = assign_splits(PLAYS, 0, 3, 2)
+    assert sorted(split.values()).count('eval') == 3
+    assert sorted(split.values()).count('test') == 2
+    assert split == assign_splits(list(reversed(PLAYS)), 0, 3, 2)
+    assert split != assign_splits(PLAYS, 1, 3, 2)
+
+
+def test_new_plays_never_move_existing_ones():
+    first = assign_splits(PLAYS, 0, 3, 3)
+    for k in range(50):
+        new = f'new-{k:02d}'
+        split = assign_splits(PLAYS + [new], 0, 3, 3, first)
+        assert {play: split[play] for play in PLAYS} == first
+        assert split[new] == 'train'
+
+
+def test_freed_slots_only_take_unseen_plays():
+    first = assign_splits(PLAYS, 0, 3, 3)
+    gone = next(play for play, name in first.items() if name == 'test')
+    remaining = [play for play in PLAYS if play != gone]
+    # No unseen play: the slot stays empty rather than promoting a train play.
+    split = assign_splits(remaining, 0, 3, 3, first)
+    assert held_out(split) == {p: n for p, n in held_out(first).items() if p != gone}
+    split = assign_splits(remaining + ['late'], 0, 3, 3, first)
+    assert split['late'] == 'test'
+    assert all(split[play] == first[play] for play in remaining)
+
+
+def test_too_many_holdouts():
+    with pytest.raises(SystemExit):
+        assign_splits(PLAYS[:4], 0, 2, 2)
+
+
+def test_previous_splits_need_same_seed(tmp_path):
+    manifest = {'version': 1, 'seed': 7, 'splits': {'train': {'plays': ['a']}, 'eval': {'plays': ['b']}, 'test': {'plays': []}}}
+    (tmp_path / 'manifest.json').write_text(json.dumps(manifest), encoding='utf-8')
+    assert previous_splits(tmp_path, 7) == {'a': 'train', 'b': 'eval'}
+    assert previous_splits(tmp_path, 8) == {}
+    assert previous_splits(tmp_path / 'missing', 7) == {}
+
+
+def test_reader_round_trip(tmp_path):
+    records = [json.dumps({'id': k, 'text': 'x' * k}).encode('utf-8') for k in range(25)]
+    writer = ShardWriter(tmp_path, 'train', 10)
+    for record in records:
+        writer.add(zlib.compress(record))
+    writer.close()
+    manifest = {'version': 1, 'splits': {'train': {'shards': writer.shards}}}
+    (tmp_path / 'manifest.json').write_text(json.dumps(manifest), encoding='utf-8')
+    reader = DatasetReader(tmp_path, 'train')
+    assert [shard['examples'] for shard in writer.shards] == [10, 10, 5]
+    assert len(reader) == 25
+    assert [example['id'] for example in reader] == list(range(25))
+    assert reader[13] == {'id': 13, 'text': 'x' * 13}
+    assert reader[-1]['id'] == 24
+    with pytest.raises(IndexError):
+        reader[25]
+    reader.close()
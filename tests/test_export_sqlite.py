@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import shutil
+import sqlite3
+
+from corpus import ROOT, iter_unit_paths
+from export_sqlite import refresh
+
+
+def test_bad_unit_is_skipped_until_it_changes(tmp_path, capsys):
+    root = tmp_path / 'corpus'
+    good, other = list(iter_unit_paths(ROOT / 'macbeth' / '01_acts' / 'Act_01'))[:2]
+    act = root / 'macbeth' / '01_acts' / 'Act_01'
+    act.mkdir(parents=True)
+    shutil.copy(good, act / good.name)
+    bad = act / other.name
+    bad.write_text('{"truncated": ', encoding='utf-8')
+    db_path = tmp_path / 'corpus.sqlite'
+
+    assert refresh(db_path, root, workers=1) == 1
+    assert 'skipped until it changes' in capsys.readouterr().err
+    db = sqlite3.connect(db_path)
+    assert db.execute('SELECT path FROM skipped').fetchall() == [(f'macbeth/01_acts/Act_01/{other.name}',)]
+
+    # Unchanged, the bad file is neither re-read nor reported again.
+    assert refresh(db_path, root, workers=1) == 0
+    assert capsys.readouterr().err == ''
+
+    shutil.copy(other, bad)
+    assert refresh(db_path, root, workers=1) == 1
+    assert db.execute('SELECT COUNT(*) FROM skipped').fetchone() == (0,)
+    assert db.execute('SELECT COUNT(*) FROM units').fetchone() == (2,)
+
+    bad.unlink()
+    bad.write_text('[]', encoding='utf-8')
+    assert refresh(db_path, root, workers=1) == 0
+    assert db.execute('SELECT COUNT(*) FROM units').fetchone() == (1,)
+    bad.unlink()
+    assert refresh(db_path, root, workers=1) == 0
+    assert db.execute('SELECT COUNT(*) FROM skipped').fetchone() == (0,)
+    db.close()
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from corpus import ROOT, iter_unit_paths
+from lazy_unit import load_lazy
+
+
+def eager_tokens(data: dict) -> list[list[dict]]:
+    return [span.get('tokens') or [] for item in data['items'] for span in item.get('spans') or []]
+
+
+def lazy_tokens(unit) -> list[list[dict]]:
+    return [span.tokens for item in unit.items for span in item.spans]
+
+
+def write_unit(path: Path, items: list[dict], **dump) -> Path:
+    data = {'meta': {'unit': {'unit_id': 'x-a01-s01', 'type': 'scene'}}, 'items': items}
+    path.write_text(json.dumps(data, ensure_ascii=False, **dump), encoding='utf-8')
+    return path
+
+
+TRICKY_ITEMS = [
+    {'seq': 1, 'serial': 'i1', 'kind': 'speech', 'spans': [
+        {'type': 'text', 'text': 'a ] b', 'tokens': [
+            {'s': ']', 'type': 'punct', 'punct': {'kind': 'bracket'}},
+            {'s': '"tokens": [', 'type': 'word', 'norm': 'tokens'},
+            {'s': 'nested', 'type': 'word', 'extra': [[1, 2], []]},
+        ]},
+        {'type': 'text', 'text': '', 'tokens': []},
+        {'type': 'stage', 'text': 'Exit.'},
+    ]},
+]
+
+
+@pytest.mark.parametrize('path', sorted(iter_unit_paths(ROOT / 'hamlet' / '01_acts' / 'Act_01')), ids=lambda p: p.name)
+def test_corpus_tokens_equal_json_load(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    unit = load_lazy(path)
+    assert unit.meta == data['meta']
+    assert len(unit.items) == len(data['items'])
+    # Corpus files are indent=2, so every token array is deferred.
+    assert not any(span.loaded for item in unit.items for span in item.spans if span._end)
+    assert any(span._end for item in unit.items for span in item.spans)
+    assert lazy_tokens(unit) == eager_tokens(data)
+
+
+def test_tokens_are_deferred_and_reloaded(tmp_path):
+    path = write_unit(tmp_path / 'unit.json', TRICKY_ITEMS, indent=2)
+    unit = load_lazy(path)
+    span = unit.items[0].spans[0]
+    assert not span.loaded
+    assert span.tokens == TRICKY_ITEMS[0]['spans'][0]['tokens']
+    span.release()
+    assert not span.loaded
+    assert span.tokens == TRICKY_ITEMS[0]['spans'][0]['tokens']
+
+
+@pytest.mark.parametrize('dump', [{'indent': 2}, {'indent': 4}, {}, {'separators': (',', ':')}], ids=str)
+def test_any_layout_round_trips(tmp_path, dump):
+    path = write_unit(tmp_path / 'unit.json', TRICKY_ITEMS, **dump)
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    assert lazy_tokens(load_lazy(path)) == eager_tokens(data)
+
+
+def test_changed_file_is_refused(tmp_path):
+    path = write_unit(tmp_path / 'unit.json', TRICKY_ITEMS, indent=2)
+    unit = load_lazy(path)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('\n')
+    os.utime(path, ns=(0, 0))
+    with pytest.raises(RuntimeError):
+        unit.items[0].spans[0].tokens
+
+
+def test_rejects_non_units(tmp_path):
+    (tmp_path / 'bad.json').write_text('{"items": [', encoding='utf-8')
+    (tmp_path / 'meta.json').write_text('{"items": []}', encoding='utf-8')
+    assert load_lazy(tmp_path / 'bad.json') is None
+    assert load_lazy(tmp_path / 'meta.json') is None
+    assert load_lazy(tmp_path / 'missing.json') is None
+
+
+def test_corpus_filters_on_play_id():
+    from token_store import load_corpus
+
+    # Stored under the-merry-wives-of-windsor/, but the play id is merry-wives.
+    corpus = load_corpus(plays={'merry-wives'})
+    assert len(corpus) and {unit.meta['play']['id'] for unit in corpus} == {'merry-wives'}
+    assert not len(load_corpus(plays={'the-merry-wives-of-windsor'}))
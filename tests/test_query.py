@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import random
+import sqlite3
+from collections import defaultdict
+
+import pytest
+
+from corpus import ROOT, iter_unit_paths
+from export_sqlite import refresh
+from fuzzy_search import fold
+from query import (
+    KindClause, LineClause, PhraseClause, Plan, QueryError, SpeakerClause, StageClause, TermClause, TextClause,
+    UnitClause, gallop, load_index, parse, search, speaker_keys, words,
+)
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('query')
+    paths = [
+        *iter_unit_paths(ROOT / 'hamlet' / '01_acts' / 'Act_01'),
+        *(ROOT / 'hamlet' / '01_acts' / 'Act_03').glob('A03_S01_*.json'),
+        *iter_unit_paths(ROOT / 'macbeth' / '01_acts' / 'Act_01'),
+    ]
+    refresh(tmp / 'corpus.sqlite', ROOT, workers=1, paths=paths)
+    db = sqlite3.connect(tmp / 'corpus.sqlite')
+    index = load_index(db, tmp / 'index.bin')
+    yield db, index
+    db.close()
+
+
+def brute_force(db: sqlite3.Connection, clauses) -> set[int]:
+    # Evaluates every clause on every item straight from the database.
+    words_of = defaultdict(list)
+    for item_pk, norm, s in db.execute(
+        "SELECT item_pk, norm, s FROM tokens WHERE type = 'word' ORDER BY item_pk, span, pos"
+    ):
+        words_of[item_pk].append(fold(norm or s or ''))
+    stage_spans = defaultdict(list)
+    for item_pk, subtype, text in db.execute('SELECT item_pk, subtype, text FROM stage_spans'):
+        stage_spans[item_pk].append((subtype, text))
+    rows = db.execute(
+        'SELECT i.item_pk, i.kind, i.subtype, i.speaker, i.line_number, i.text, u.path, u.play_id, u.unit_id, u.act, u.scene '
+        'FROM items i JOIN units u ON u.unit_pk = i.unit_pk'
+    ).fetchall()
+
+    def phrase(found: list[str], terms: list[str], slop: int) -> bool:
+        def extend(k: int, after: int) -> bool:
+            if k == len(terms):
+                return True
+            return any(found[p] == terms[k] and extend(k + 1, p)
+                       for p in range(after + 1, min(after + slop + 2, len(found))))
+        return any(term == terms[0] and extend(1, p) for p, term in enumerate(found))
+
+    def matches(clause, row) -> bool:
+        item_pk, kind, subtype, speaker, line, text, path, play, uid, act, scene = row
+        if isinstance(clause, TermClause):
+            return clause.term in words_of[item_pk]
+        if isinstance(clause, PhraseClause):
+            return phrase(words_of[item_pk], clause.terms, clause.slop)
+        if isinstance(clause, StageClause):
+            # A stage item of that subtype, or an embedded stage span
+            # naming it, e.g. "(Aside.)" inside a speech.
+            return ((kind == 'stage' and subtype == clause.key)
+                    or any(clause.key == sub or clause.key in words(text or '') for sub, text in stage_spans[item_pk]))
+        if isinstance(clause, SpeakerClause):
+            return clause.name in speaker_keys(speaker)
+        if isinstance(clause, KindClause):
+            return ((clause.kind is None or (kind or '') == clause.kind)
+                    and (clause.subtype is None or (subtype or '') == clause.subtype))
+        if isinstance(clause, UnitClause):
+            value = {'play': play, 'act': act, 'scene': scene}.get(clause.field)
+            if clause.field == 'unit':
+                return clause.value in (uid, path)
+            return value is not None and str(value) == clause.value
+        if isinstance(clause, LineClause):
+            return isinstance(line, int) and clause.low <= line <= clause.high
+        if isinstance(clause, TextClause):
+            return clause.needle in fold(text or '')
+        raise AssertionError(clause)
+
+    return {row[0] for row in rows if all(matches(c, row) != c.negated for c in clauses)}
+
+
+QUERIES = [
+    'ghost',
+    'horatio -ghost',
+    '"to be"',
+    '"the king"~2',
+    '"my good lord"',
+    'speaker:HORATIO',
+    'speaker:horatio ghost',
+    'speaker:"FIRST WITCH"',
+    'kind:stage',
+    'stage:exit',
+    'stage:aside',
+    'stage:within -kind:stage',
+    'play:hamlet speaker:HAMLET "mortal coil"~3 -stage:aside',
+    'play:hamlet speaker:HAMLET kind:speech "mortal coil"~3 -stage:aside',
+    'speaker:HAMLET kind:speech -stage:aside',
+    'subtype:enter -play:macbeth',
+    'play:macbeth act:1 scene:3 witch',
+    'line:1-20 kind:speech',
+    'line:73',
+    'text:"my lord" speaker:HAMLET',
+    'text:thane',
+    '-kind:speech',
+    'unit:hamlet-a01-s01 -speaker:HORATIO',
+    'the and -speaker:HAMLET line:10-200',
+    'zzzznotaword',
+]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_results_match_brute_force(corpus, query):
+    db, index = corpus
+    docs, plan = search(db, query, index)
+    assert docs == sorted(docs)
+    pks = index.columns['item_pk']
+    assert {pks[doc] for doc in docs} == brute_force(db, parse(query))
+    # One step per clause, plus the full scan when nothing can drive.
+    assert len(plan.timings) == len(parse(query)) + (plan.driver is None)
+
+
+def test_embedded_stage_spans_are_indexed(corpus):
+    db, index = corpus
+    # Hamlet's first line, 1.2.67, opens with an "(Aside.)" span.
+    speech, _ = search(db, 'speaker:HAMLET kind:speech', index)
+    kept, _ = search(db, 'speaker:HAMLET kind:speech -stage:aside', index)
+    aside, _ = search(db, 'speaker:HAMLET stage:aside', index)
+    assert aside and set(aside) <= set(speech)
+    assert sorted(set(speech) - set(kept)) == aside
+    serials = {row[0] for row in db.execute(
+        'SELECT line_serial FROM items WHERE item_pk IN (%s)' % ','.join(str(index.columns['item_pk'][d]) for d in aside))}
+    assert 'hamlet-a01-s02-l0067' in serials
+
+
+def test_planner_drives_from_cheapest_clause(corpus):
+    db, index = corpus
+    plan = Plan(index, parse('kind:speech play:hamlet horatio'))
+    assert isinstance(plan.driver, TermClause)
+    # Exclusions never drive; a query made only of them scans everything.
+    plan = Plan(index, parse('-kind:speech'))
+    assert plan.driver is None
+    plan.run(db)
+    assert plan.timings[0][0] == 'scan'
+    # A text scan is the most expensive access path and only filters.
+    plan = Plan(index, parse('text:lord speaker:HORATIO'))
+    assert isinstance(plan.driver, SpeakerClause)
+
+
+def test_estimates_are_exact_for_posting_lists(corpus):
+    db, index = corpus
+    for query in ('ghost', 'speaker:HORATIO', 'kind:stage', 'stage:enter'):
+        clause = parse(query)[0]
+        assert clause.estimate(index) == len(clause.drive(index, db))
+
+
+def test_gallop_matches_set_intersection():
+    rng = random.Random(0)
+    for _ in range(300):
+        postings = sorted(rng.sample(range(5000), rng.randrange(0, 2000)))
+        docs = sorted(rng.sample(range(5000), rng.randrange(0, 200)))
+        assert gallop(docs, postings) == sorted(set(docs) & set(postings))
+
+
+@pytest.mark.parametrize('query', ['', 'bogus:field', 'line:abc', '"'])
+def test_bad_queries_raise(query):
+    with pytest.raises(QueryError):
+        parse(query)
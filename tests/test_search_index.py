@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from corpus import ROOT
+
+
+NODE = shutil.which('node')
+pytestmark = pytest.mark.skipif(NODE is None, reason='needs node')
+
+SCENES = [
+    'hamlet/01_acts/Act_01/A01_S01_Elsinore_A_platform_before_the_Castle.json',
+    'henry-vi-part2/01_acts/Act_02/A02_S01_Saint_Albans.json',
+]
+
+# Runs viewer/search-worker.js as the browser would, with fetch reading the
+# built files from disk.
+HARNESS = r'''
+import fs from 'node:fs';
+import path from 'node:path';
+import vm from 'node:vm';
+import {fileURLToPath, pathToFileURL} from 'node:url';
+
+const [worker, site, queries] = process.argv.slice(2);
+const listeners = [];
+const replies = [];
+Object.assign(globalThis, {
+  self: globalThis,
+  location: {href: pathToFileURL(path.join(site, 'viewer', 'search-worker.js')).href},
+  importScripts: (...names)=>names.forEach(name=>vm.runInThisContext(fs.readFileSync(path.join(path.dirname(worker), name), 'utf8'))),
+  addEventListener: (type, fn)=>listeners.push(fn),
+  postMessage: msg=>replies.push(msg),
+  fetch: async url=>new Response(fs.readFileSync(fileURLToPath(url))),
+});
+vm.runInThisContext(fs.readFileSync(worker, 'utf8'), {filename: worker});
+for (const [id, query] of JSON.parse(queries).entries()) await listeners[0]({data: {id, query, limit: 10}});
+console.log(JSON.stringify(replies));
+'''
+
+
+@pytest.fixture(scope='module')
+def site(tmp_path_factory) -> Path:
+    site = tmp_path_factory.mktemp('site')
+    plays: dict[str, list[dict]] = {}
+    for rel in SCENES:
+        (site / rel).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(ROOT / rel, site / rel)
+        plays.setdefault(rel.split('/')[0], []).append({'path': rel})
+    index = {'plays': [{'id': pid, 'title': pid, 'scenes': scenes} for pid, scenes in plays.items()]}
+    (site / 'index.json').write_text(json.dumps(index), encoding='utf-8')
+    subprocess.run([NODE, str(ROOT / 'tools' / 'build-search-index.mjs')], cwd=site, check=True, capture_output=True)
+    (site / 'harness.mjs').write_text(HARNESS, encoding='utf-8')
+    return site
+
+
+def search(site: Path, queries: list[str]) -> list[dict]:
+    worker = ROOT / 'viewer' / 'search-worker.js'
+    done = subprocess.run(
+        [NODE, str(site / 'harness.mjs'), str(worker), str(site), json.dumps(queries)],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(done.stdout)
+
+
+@pytest.mark.parametrize('query, terms, play, line', [
+    ('Give you good-night', ['give', 'you', 'good', 'night'], 'hamlet', 20),
+    ('good-night', ['good', 'night'], 'hamlet', 20),
+    ('GOOD NIGHT', ['good', 'night'], 'hamlet', 20),
+    ('-good-night-', ['good', 'night'], 'hamlet', 20),
+    ('half-hour hath', ['half', 'hour', 'hath'], 'henry-vi-part2', 70),
+    ('this half hour', ['this', 'half', 'hour'], 'henry-vi-part2', 70),
+    ('Saint Alban’s shrine', ["saint", "alban's", 'shrine'], 'henry-vi-part2', 70),
+])
+def test_query_terms_match_index_terms(site, query, terms, play, line):
+    (reply,) = search(site, [query])
+    assert reply['type'] == 'done' and reply['terms'] == terms
+    assert (play, line) in {(hit['play'], hit['line']) for hit in reply['results']}
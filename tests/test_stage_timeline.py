@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from build_stage_timeline import add_interval, intersect, subtract
+
+
+def flat(lines: set[int]) -> list[int]:
+    out: list[int] = []
+    for line in sorted(lines):
+        add_interval(out, line, line)
+    return out
+
+
+def lines_of(intervals: list[int]) -> set[int]:
+    return {line for i in range(0, len(intervals), 2) for line in range(intervals[i], intervals[i + 1] + 1)}
+
+
+@pytest.mark.parametrize('a, b, both, a_only', [
+    ([], [1, 5], [], []),
+    ([1, 5], [], [], [1, 5]),
+    ([1, 5], [1, 5], [1, 5], []),
+    ([1, 10], [3, 4], [3, 4], [1, 2, 5, 10]),
+    ([1, 3, 7, 9], [3, 7], [3, 3, 7, 7], [1, 2, 8, 9]),
+    ([5, 5], [1, 4, 6, 9], [], [5, 5]),
+    ([1, 4, 6, 9], [2, 7], [2, 4, 6, 7], [1, 1, 8, 9]),
+])
+def test_known_cases(a, b, both, a_only):
+    assert intersect(a, b) == both
+    assert intersect(b, a) == both
+    assert subtract(a, b) == a_only
+
+
+def test_matches_set_arithmetic():
+    rng = random.Random(0)
+    for _ in range(500):
+        a = {n for n in range(60) if rng.random() < 0.4}
+        b = {n for n in range(60) if rng.random() < 0.4}
+        assert lines_of(intersect(flat(a), flat(b))) == a & b
+        assert lines_of(subtract(flat(a), flat(b))) == a - b
+        # Results are sorted, disjoint [start, end] pairs.
+        for result in (intersect(flat(a), flat(b)), subtract(flat(a), flat(b))):
+            assert all(result[i] <= result[i + 1] for i in range(0, len(result), 2))
+            assert all(result[i] < result[i + 1] for i in range(1, len(result) - 1, 2))
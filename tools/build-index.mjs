@@ -1,4 +1,5 @@
 #!/usr/bin/env node
+import crypto from 'node:crypto';
 import fs from 'node:fs/promises';
 import path from 'node:path';
 
@@ -28,6 +29,11 @@ function numFrom(v){
   return total;
 }
 
+// Short content hash so the viewer can key persistent caches by file contents.
+function contentHash(raw){
+  return crypto.createHash('sha1').update(raw).digest('hex').slice(0, 16);
+}
+
 async function walk(dir){
   const out = [];
   const entries = await fs.readdir(dir, { withFileTypes: true });
@@ -63,9 +69,10 @@ async function main(){
       const title     = data.meta?.unit?.title || data.meta?.unit?.label || null;
 
       const relPath   = toPosix(path.relative(ROOT, abs));
+      const hash      = contentHash(raw);
 
       if (!plays.has(playId)) plays.set(playId, { id: playId, title: playTitle, scenes: [] });
-      plays.get(playId).scenes.push({ act, scene, title, path: relPath });
+      plays.get(playId).scenes.push({ act, scene, title, path: relPath, hash });
     } catch { /* ignore unreadable/bad JSON */ }
   }
 
@@ -0,0 +1,136 @@
+#!/usr/bin/env node
+// Builds the viewer's client-side search index from the scenes listed in
+// index.json (run tools/build-index.mjs first):
+//
+//   search/manifest.json                shard and play tables (small, uncompressed)
+//   search/shards/<prefix>.<h>.json.gz  postings of the terms starting with <prefix>
+//   search/lines/<play>.<h>.json.gz     the play's lines: scene, line number, speaker, text, line_serial
+//
+// Postings are [line, word] pairs, where line indexes the canon's speech lines
+// in reading order and word is the position of the word within the line, so
+// the worker can match phrases. Lines are delta-encoded. Shards that grow past
+// MAX_POSTINGS are split on a longer prefix. File names carry a content hash,
+// so they can be cached forever.
+import crypto from 'node:crypto';
+import fs from 'node:fs/promises';
+import path from 'node:path';
+import zlib from 'node:zlib';
+import '../viewer/search-terms.js';
+
+const ROOT = process.cwd();
+const INDEX = path.join(ROOT, 'index.json');
+const OUT = path.join(ROOT, 'search');
+
+const MAX_POSTINGS = 40000;
+const MAX_PREFIX = 4;
+
+// Shared with the worker, so index and query terms are folded alike.
+const {terms: wordTerms} = globalThis.ShakespeareSearchTerms;
+
+function shardKey(term, length){
+  return term.slice(0, length).replace(/[^a-z0-9]/g, '_');
+}
+
+function spanText(span){
+  if (typeof span?.text === 'string') return span.text;
+  return (span?.tokens || []).map(tok=>`${tok.pre||''}${tok.s||''}`).join('');
+}
+
+function contentHash(buf){
+  return crypto.createHash('sha1').update(buf).digest('hex').slice(0, 12);
+}
+
+async function writePacked(dir, name, value){
+  const packed = zlib.gzipSync(JSON.stringify(value), {level: 9});
+  const file = `${name}.${contentHash(packed)}.json.gz`;
+  await fs.writeFile(path.join(OUT, dir, file), packed);
+  return {file: `${dir}/${file}`, bytes: packed.length};
+}
+
+// Splits an oversized group of terms on one more prefix character.
+function partition(terms, postings, length, shards){
+  const groups = new Map();
+  for (const term of terms){
+    const key = shardKey(term, length);
+    if (!groups.has(key)) groups.set(key, []);
+    groups.get(key).push(term);
+  }
+  for (const [key, group] of groups){
+    const size = group.reduce((n, term)=>n + postings.get(term).length / 2, 0);
+    const splittable = length < MAX_PREFIX && group.some(term=>term.length > length);
+    if (size > MAX_POSTINGS && splittable) partition(group, postings, length + 1, shards);
+    else shards.set(key, group);
+  }
+}
+
+async function main(){
+  const index = JSON.parse(await fs.readFile(INDEX, 'utf8'));
+  await fs.rm(OUT, {recursive: true, force: true});
+  await fs.mkdir(path.join(OUT, 'shards'), {recursive: true});
+  await fs.mkdir(path.join(OUT, 'lines'), {recursive: true});
+
+  const postings = new Map();
+  const plays = [];
+  let lineId = 0;
+  for (const play of index.plays){
+    const entry = {id: play.id, title: play.title, start: lineId, count: 0};
+    const scenes = [];
+    const lines = [];
+    for (const scene of play.scenes){
+      let data;
+      try { data = JSON.parse(await fs.readFile(path.join(ROOT, scene.path), 'utf8')); }
+      catch { continue; }
+      const sceneIndex = scenes.length;
+      scenes.push(scene.path);
+      let pendingSpeaker = null;
+      for (const item of data.items || []){
+        if (item.kind === 'speaker_label'){ pendingSpeaker = item.speaker || null; continue; }
+        if (item.kind !== 'speech') continue;
+        const words = [];
+        for (const span of item.spans || []){
+          for (const tok of span.tokens || []){
+            if (tok.type === 'word' && (tok.norm || tok.s)) words.push(...wordTerms(tok.norm || tok.s));
+          }
+        }
+        const speaker = String(item.speaker || pendingSpeaker || '').replaceAll('_', ' ').trim();
+        const text = (item.spans || []).map(spanText).join('').replace(/\u00A0/g, ' ').trim();
+        lines.push([sceneIndex, item.line_number ?? null, speaker, text, item.line_serial || null]);
+        words.forEach((word, pos)=>{
+          if (!postings.has(word)) postings.set(word, []);
+          postings.get(word).push(lineId, pos);
+        });
+        lineId++;
+      }
+    }
+    entry.count = lines.length;
+    Object.assign(entry, await writePacked('lines', play.id, {play: play.id, title: play.title, start: entry.start, scenes, lines}));
+    plays.push(entry);
+  }
+
+  const shards = new Map();
+  partition(Array.from(postings.keys()).sort(), postings, 2, shards);
+  const manifest = {version: 1, lines: lineId, terms: postings.size, shards: {}, plays};
+  let total = 0;
+  for (const [key, terms] of [...shards].sort((a, b)=>a[0].localeCompare(b[0]))){
+    const out = {};
+    for (const term of terms){
+      const list = postings.get(term);
+      const packed = [];
+      let last = 0;
+      for (let i = 0; i < list.length; i += 2){
+        packed.push(list[i] - last, list[i+1]);
+        last = list[i];
+      }
+      out[term] = packed;
+    }
+    const written = await writePacked('shards', key, out);
+    manifest.shards[key] = written.file;
+    total += written.bytes;
+  }
+  await fs.writeFile(path.join(OUT, 'manifest.json'), JSON.stringify(manifest));
+  const lineBytes = plays.reduce((n, p)=>n + p.bytes, 0);
+  console.log(`Wrote ${OUT}: ${lineId} lines, ${postings.size} terms, ${shards.size} shards `
+    + `(${(total/1e6).toFixed(1)} MB) and ${plays.length} line tables (${(lineBytes/1e6).toFixed(1)} MB).`);
+}
+
+main().catch(e => { console.error(e); process.exit(1); });
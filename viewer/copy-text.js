@@ -0,0 +1,118 @@
+// Plain-text assembly shared by the viewer page and its copy worker.
+(function(global){
+  'use strict';
+
+  function spanText(span){
+    if (!span) return '';
+    if (typeof span.text === 'string') return span.text;
+    if (Array.isArray(span.tokens)){
+      return span.tokens.map(tok=>`${tok.pre||''}${tok.s||''}`).join('');
+    }
+    return '';
+  }
+
+  function textFromItem(item){
+    const spans = item.spans || [];
+    return spans.map(sp=>sp.text || '').join('');
+  }
+
+  function createCopyAccumulator(){
+    const normalizeLine = line => (line || '').replace(/\u00A0/g, ' ').replace(/[ \t]+$/, '');
+    const trimBlankEdges = lines => {
+      const copy = Array.from(lines);
+      while (copy.length && copy[0].trim() === '') copy.shift();
+      while (copy.length && copy[copy.length-1].trim() === '') copy.pop();
+      return copy;
+    };
+    const output = [];
+    return {
+      append(lines){
+        const normalized = trimBlankEdges(lines.map(normalizeLine));
+        if (!normalized.length) return;
+        if (output.length && output[output.length-1] !== '') output.push('');
+        output.push(...normalized);
+      },
+      result(){
+        while (output.length && output[output.length-1] === '') output.pop();
+        return output.join('\n');
+      }
+    };
+  }
+
+  // Streaming form of copyTextFromItems: items can be pushed one scene at a
+  // time and each scene dropped afterwards, with speech state carried across.
+  function createItemsCopier(acc = createCopyAccumulator()){
+    const appendBlock = lines => acc.append(lines);
+    let currentSpeech = null;
+    let lastSpeechId = null;
+    let pendingSpeaker = null;
+
+    const flushSpeech = () => {
+      if (!currentSpeech) return;
+      const block = [];
+      if (currentSpeech.speaker) block.push(currentSpeech.speaker);
+      block.push(...currentSpeech.lines);
+      appendBlock(block);
+      currentSpeech = null;
+      lastSpeechId = null;
+    };
+
+    const speakerName = value => (value || '').replaceAll('_',' ').replace(/\u00A0/g, ' ').trim();
+
+    return {
+      push(items){
+        for (const item of items || []){
+          if (!item) continue;
+          if (item.kind === 'speech'){
+            const speechId = item.speech_id ?? null;
+            if (!currentSpeech || speechId !== lastSpeechId){
+              flushSpeech();
+              const speakerRaw = pendingSpeaker || item.speaker || '';
+              const speaker = speakerName(speakerRaw);
+              currentSpeech = {speaker, lines:[]};
+              lastSpeechId = speechId;
+              pendingSpeaker = null;
+            }
+            const numberRaw = item.line_number != null ? String(item.line_number) : '';
+            const textRaw = (item.spans || []).map(spanText).join('').replace(/\u00A0/g, ' ');
+            let body = textRaw.replace(/[ \t]+$/, '');
+            if (numberRaw) body = body.replace(/^\s+/, '');
+            const combined = numberRaw ? `${numberRaw} ${body}` : body;
+            currentSpeech.lines.push(combined);
+            continue;
+          }
+          if (item.kind === 'speaker_label'){
+            pendingSpeaker = speakerName(item.speaker || '');
+            flushSpeech();
+            continue;
+          }
+          flushSpeech();
+          if (item.kind === 'stage'){
+            const stageText = (item.spans || []).map(spanText).join('');
+            appendBlock(stageText.split(/\r?\n/));
+            continue;
+          }
+          if (item.kind === 'heading'){
+            const headingText = textFromItem(item).replace(/\u00A0/g, ' ');
+            appendBlock([headingText]);
+            continue;
+          }
+          const fallbackText = (item.spans || []).map(spanText).join('');
+          appendBlock(fallbackText.split(/\r?\n/));
+        }
+      },
+      result(){
+        flushSpeech();
+        return acc.result();
+      }
+    };
+  }
+
+  function copyTextFromItems(items){
+    const copier = createItemsCopier();
+    copier.push(items);
+    return copier.result();
+  }
+
+  global.ShakespeareText = {spanText, textFromItem, createCopyAccumulator, createItemsCopier, copyTextFromItems};
+})(typeof self !== 'undefined' ? self : this);
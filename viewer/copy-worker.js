@@ -0,0 +1,38 @@
+// Fetches scenes one after another and assembles copy text off the main
+// thread. Only the scene being parsed (plus the next response in flight) is
+// held at any time; progress is posted after each scene.
+'use strict';
+importScripts('copy-text.js');
+
+const {createCopyAccumulator, createItemsCopier} = self.ShakespeareText;
+
+async function fetchScene(url){
+  const res = await fetch(url);
+  if (!res.ok) throw new Error(`Failed to load ${url}: ${res.status}`);
+  return res.text();
+}
+
+async function runJob({id, urls, title}){
+  const acc = createCopyAccumulator();
+  const heading = (title || '').replace(/\u00A0/g, ' ').trim();
+  if (heading) acc.append([heading]);
+  const copier = createItemsCopier(acc);
+  let next = urls.length ? fetchScene(urls[0]) : null;
+  for (let i = 0; i < urls.length; i++){
+    const raw = await next;
+    next = i + 1 < urls.length ? fetchScene(urls[i+1]) : null;
+    copier.push(JSON.parse(raw).items || []);
+    self.postMessage({id, type:'progress', done:i+1, total:urls.length});
+  }
+  return copier.result();
+}
+
+self.addEventListener('message', async e=>{
+  const job = e.data || {};
+  try {
+    const text = await runJob(job);
+    self.postMessage({id:job.id, type:'done', text});
+  } catch(err){
+    self.postMessage({id:job.id, type:'error', message:String(err?.message || err)});
+  }
+});
@@ -0,0 +1,20 @@
+// Term folding shared by tools/build-search-index.mjs (index terms), the
+// search worker (query terms) and the viewer page (highlighting), so all
+// three split and fold words the same way.
+(function(global){
+  'use strict';
+
+  function fold(s){
+    return String(s || '').normalize('NFKD').replace(/[\u0300-\u036f]/g, '').replace(/[\u2018\u2019]/g, "'").toLowerCase();
+  }
+
+  // Hyphens separate words, as in the corpus tokens ("good-night" is "good"
+  // and "night"); apostrophes stay inside them ("o'er").
+  const SEPARATOR = /[^\p{L}\p{N}']+/u;
+
+  function terms(s){
+    return fold(s).split(SEPARATOR).filter(Boolean);
+  }
+
+  global.ShakespeareSearchTerms = {fold, terms};
+})(typeof self !== 'undefined' ? self : globalThis);
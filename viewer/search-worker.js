@@ -0,0 +1,129 @@
+// Phrase search over the sharded index written by tools/build-search-index.mjs.
+// Only the manifest, the shards for the query's terms and the line tables of
+// plays with results are fetched; all of them are kept for later queries.
+'use strict';
+importScripts('search-terms.js');
+
+const MANIFEST_URL = new URL('../search/manifest.json', self.location.href).href;
+const KEY_LIMIT = 4;
+const POS_STRIDE = 4096;
+
+const cache = {manifest:null, shards:new Map(), lines:new Map()};
+
+function shardKey(term, length){
+  return term.slice(0, length).replace(/[^a-z0-9]/g, '_');
+}
+
+// The same terms tools/build-search-index.mjs indexes.
+const queryTerms = self.ShakespeareSearchTerms.terms;
+
+// Shards are gzip files; servers that already decoded them hand back JSON.
+async function fetchPacked(url){
+  const res = await fetch(url);
+  if (!res.ok) throw new Error(`Failed to load ${url}: ${res.status}`);
+  const buf = await res.arrayBuffer();
+  const bytes = new Uint8Array(buf, 0, Math.min(2, buf.byteLength));
+  if (bytes[0] === 0x1f && bytes[1] === 0x8b){
+    if (!('DecompressionStream' in self)) throw new Error('This browser cannot decompress the search index');
+    const stream = new Blob([buf]).stream().pipeThrough(new DecompressionStream('gzip'));
+    return JSON.parse(await new Response(stream).text());
+  }
+  return JSON.parse(new TextDecoder().decode(buf));
+}
+
+async function manifest(){
+  if (!cache.manifest){
+    cache.manifest = fetch(MANIFEST_URL).then(res=>{
+      if (!res.ok) throw new Error(`Search index not built (${res.status}); run npm run build:search`);
+      return res.json();
+    });
+    cache.manifest.catch(()=>{ cache.manifest = null; });
+  }
+  return cache.manifest;
+}
+
+function loadOnce(map, url){
+  if (!map.has(url)){
+    const request = fetchPacked(new URL(url, MANIFEST_URL).href);
+    request.catch(()=>map.delete(url));
+    map.set(url, request);
+  }
+  return map.get(url);
+}
+
+// Longest shard prefix first: large shards are split into longer prefixes.
+async function postings(term){
+  const {shards} = await manifest();
+  for (let length = KEY_LIMIT; length > 0; length--){
+    const file = shards[shardKey(term, length)];
+    if (!file) continue;
+    const shard = await loadOnce(cache.shards, file);
+    const packed = shard[term];
+    if (!packed) return [];
+    const out = new Array(packed.length / 2);
+    let line = 0;
+    for (let i = 0; i < packed.length; i += 2){
+      line += packed[i];
+      out[i / 2] = line * POS_STRIDE + packed[i+1];
+    }
+    return out;
+  }
+  return [];
+}
+
+function playFor(index, line){
+  let lo = 0, hi = index.plays.length - 1;
+  while (lo < hi){
+    const mid = (lo + hi + 1) >> 1;
+    if (index.plays[mid].start <= line) lo = mid;
+    else hi = mid - 1;
+  }
+  return index.plays[lo];
+}
+
+async function search({query, limit}){
+  const terms = queryTerms(query);
+  if (!terms.length) return {terms, total:0, results:[]};
+  const index = await manifest();
+  const lists = await Promise.all(terms.map(postings));
+  // A hit is a position of the first term followed by every later term;
+  // each line is reported once, at its first hit.
+  const later = lists.slice(1).map((list, k)=>new Set(list.map(key=>key - (k + 1))));
+  const hits = [];
+  let lastLine = -1;
+  for (const key of lists[0]){
+    const line = Math.floor(key / POS_STRIDE);
+    if (line === lastLine || !later.every(set=>set.has(key))) continue;
+    hits.push(key);
+    lastLine = line;
+  }
+  const shown = hits.slice(0, limit);
+  const results = [];
+  for (const key of shown){
+    const line = Math.floor(key / POS_STRIDE);
+    const play = playFor(index, line);
+    const table = await loadOnce(cache.lines, play.file);
+    const [scene, lineNumber, speaker, text, serial] = table.lines[line - play.start];
+    results.push({
+      play:play.id,
+      playTitle:play.title,
+      path:table.scenes[scene],
+      line:lineNumber,
+      speaker,
+      text,
+      serial,
+      word:key % POS_STRIDE
+    });
+  }
+  return {terms, total:hits.length, results};
+}
+
+self.addEventListener('message', async e=>{
+  const job = e.data || {};
+  try {
+    const result = await search(job);
+    self.postMessage({id:job.id, type:'done', ...result});
+  } catch(err){
+    self.postMessage({id:job.id, type:'error', message:String(err?.message || err)});
+  }
+});